@@ -0,0 +1,85 @@
+"""
+NativeProbe agent: owns packet capture, flow collection and anomaly detection
+
+Run one agent per host and start the web app with NATIVEPROBE_AGENT=remote;
+the web app then forwards capture, collector and detection requests to the
+agent over a local socket, so web workers can be added or restarted freely.
+
+Usage:
+    python agent.py [--socket PATH] [--detection METHOD] [--help]
+
+Options:
+    --socket PATH       Unix socket to listen on (default: Config.AGENT_SOCKET)
+    --detection METHOD  Start anomaly detection immediately with this method
+    --help              Show this help message
+"""
+import argparse
+import logging
+import signal
+import sys
+import threading
+from config import Config
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="NativeProbe agent")
+    parser.add_argument('--socket', default=None,
+                        help='Unix socket to listen on')
+    parser.add_argument('--detection', default=None,
+                        choices=['statistical', 'rule-based', 'machine-learning'],
+                        help='Start anomaly detection immediately with this method')
+    
+    return parser.parse_args()
+
+def main():
+    """Main entry point for the agent"""
+    args = parse_arguments()
+    
+    if args.socket:
+        Config.AGENT_SOCKET = args.socket
+    
+    from app import app, init_db
+    from utils.agent_rpc import AgentServer
+    from utils.agent_service import AGENT_METHODS, start_maintenance
+    from utils.anomaly_detection import start_anomaly_detection, stop_anomaly_detection
+    from utils.flow_analysis import stop_flow_collector, get_flow_collector_status
+    
+    init_db()
+    
+    server = AgentServer(AGENT_METHODS, context=app.app_context)
+    server.start()
+    start_maintenance()
+    
+    if args.detection:
+        with app.app_context():
+            start_anomaly_detection(args.detection)
+    
+    stop_event = threading.Event()
+    
+    def handle_signal(signum, frame):
+        logger.info(f"Agent received signal {signum}, shutting down")
+        stop_event.set()
+    
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    
+    logger.info("NativeProbe agent running")
+    while not stop_event.is_set():
+        stop_event.wait(1.0)
+    
+    # Capture workers run in their own sessions and keep capturing
+    server.stop()
+    with app.app_context():
+        stop_anomaly_detection()
+        if get_flow_collector_status()['running']:
+            stop_flow_collector()
+    
+    logger.info("NativeProbe agent stopped")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
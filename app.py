@@ -1,12 +1,16 @@
 """
 Flask application configuration for Network Traffic Analysis Tool
 """
-import os
 import logging
+import sqlite3
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from config import active_config
+from utils.serialization import FastJSONProvider
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -21,20 +25,25 @@ db = SQLAlchemy(model_class=Base)
 
 # Create Flask application
 app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "default-dev-key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.json = FastJSONProvider(app)
 
-# Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///network_traffic.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Load the configuration selected by FLASK_ENV, including database and pool settings
+app.config.from_object(active_config)
+app.secret_key = app.config["SECRET_KEY"]
 
 # Initialize app with database
 db.init_app(app)
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the configured pragmas (WAL journal and friends) to new SQLite connections"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for name, value in app.config["SQLITE_PRAGMAS"].items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
 # Import and register blueprints
 from routes.dashboard import dashboard_bp
 from routes.packet_analysis import packet_analysis_bp
@@ -50,11 +59,82 @@ app.register_blueprint(protocol_analysis_bp)
 app.register_blueprint(anomaly_detection_bp)
 app.register_blueprint(settings_bp)
 
-# Create database tables if they don't exist
-with app.app_context():
-    # Import models here to ensure they're registered with SQLAlchemy
-    import models
+def init_db():
+    """Create database tables that don't exist yet and add new columns to existing ones"""
+    from sqlalchemy.exc import OperationalError
+    
+    with app.app_context():
+        # Import models here to ensure they're registered with SQLAlchemy
+        import models
+        
+        logger.info("Creating database tables")
+        try:
+            db.create_all()
+        except OperationalError as e:
+            # Another process (web server or agent) created them at the same time
+            logger.warning(f"Retrying table creation: {e}")
+            db.session.rollback()
+            db.create_all()
+        upgrade_schema()
+        logger.info("Database tables created")
+
+def column_ddl(column, dialect):
+    """Column definition for ALTER TABLE ... ADD COLUMN (type, default and foreign key)"""
+    from sqlalchemy import literal
+    
+    preparer = dialect.identifier_preparer
+    ddl = f"{preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    
+    # Existing rows get the model's default, e.g. a sample weight of 1
+    if column.default is not None and column.default.is_scalar:
+        value = literal(column.default.arg, column.type).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}
+        )
+        ddl += f" DEFAULT {value}"
+    
+    for foreign_key in column.foreign_keys:
+        target = foreign_key.column
+        ddl += f" REFERENCES {preparer.quote(target.table.name)} ({preparer.quote(target.name)})"
+    return ddl
+
+def upgrade_schema():
+    """Add the columns and indexes models gained since an existing database was created
+
+    db.create_all() never alters a table that already exists, so databases
+    from earlier versions would fail on the first query that selects a new
+    column. New columns are all nullable or have a default, which lets them
+    be added in place.
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.exc import DBAPIError
+    
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect
     
-    logger.info("Creating database tables")
-    db.create_all()
-    logger.info("Database tables created")
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            statement = f"ALTER TABLE {dialect.identifier_preparer.quote(table.name)} ADD COLUMN {column_ddl(column, dialect)}"
+            try:
+                with db.engine.begin() as connection:
+                    connection.exec_driver_sql(statement)
+                logger.info(f"Added column {table.name}.{column.name}")
+            except DBAPIError as e:
+                # Another process (web server or agent) added it at the same time
+                logger.warning(f"Could not add column {table.name}.{column.name}: {e}")
+        
+        existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                with db.engine.begin() as connection:
+                    index.create(connection)
+                logger.info(f"Added index {index.name}")
+            except DBAPIError as e:
+                logger.warning(f"Could not add index {index.name}: {e}")
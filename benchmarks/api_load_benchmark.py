@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+API load benchmark for NativeProbe
+
+Seeds a throwaway SQLite database with synthetic captures, packets, flows
+and anomalies, then drives the read-only JSON API endpoints with
+concurrent keep-alive clients against the development server
+(`main.py --no-debug`) and the production server (`main.py serve`).
+Reports requests/s and latency percentiles for each.
+"""
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+from http.client import HTTPConnection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ENDPOINTS = (
+    '/api/dashboard/summary',
+    '/api/dashboard/live-stats',
+    '/api/packet-analysis/captures',
+    '/api/packet-analysis/packets/1',
+    '/api/flow-analysis/flows',
+    '/api/flow-analysis/top-talkers',
+    '/api/protocol-analysis/distribution',
+    '/api/protocol-analysis/tcp-flags',
+    '/api/anomaly-detection/anomalies',
+    '/api/settings/get'
+)
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Load-test the API under each server mode')
+    parser.add_argument('--modes', default='run,serve',
+                        help='Comma-separated server modes to test (run, serve)')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds of load per mode')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='Concurrent client connections')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes for serve mode')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='Threads per worker for serve mode')
+    parser.add_argument('--packets', type=int, default=50000,
+                        help='Synthetic packets to seed')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed for the synthetic data')
+    return parser.parse_args()
+
+def seed_database(packet_count, seed):
+    """Fill the database named by DATABASE_URL with synthetic traffic"""
+    from app import app, db, init_db
+    from models import PacketCapture, Packet, FlowRecord, ProtocolDistribution, AnomalyEvent, BandwidthUsage
+
+    init_db()
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    protocols = ('TCP', 'UDP', 'ICMP', 'DNS', 'HTTP')
+
+    with app.app_context():
+        capture = PacketCapture(name='benchmark', interface='lo', start_time=now, end_time=now,
+                                packet_count=packet_count)
+        db.session.add(capture)
+        db.session.commit()
+
+        packets = [{
+            'capture_id': capture.id,
+            'timestamp': now - datetime.timedelta(seconds=rng.random() * 3600),
+            'protocol': rng.choice(protocols),
+            'source_ip': f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            'destination_ip': f"192.168.1.{rng.randint(1, 254)}",
+            'source_port': rng.randint(1024, 65535),
+            'destination_port': rng.choice((80, 443, 53, 22)),
+            'length': rng.randint(60, 1514),
+            'tcp_flags': rng.choice(('S', 'SA', 'A', 'PA', 'FA', None)),
+            'sample_weight': 1
+        } for _ in range(packet_count)]
+        db.session.execute(db.insert(Packet), packets)
+
+        flows = [{
+            'timestamp': now - datetime.timedelta(seconds=rng.random() * 3600),
+            'flow_type': 'NetFlow',
+            'source_ip': f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            'destination_ip': f"192.168.1.{rng.randint(1, 254)}",
+            'source_port': rng.randint(1024, 65535),
+            'destination_port': rng.choice((80, 443, 53, 22)),
+            'protocol': rng.choice((6, 17)),
+            'bytes': rng.randint(100, 10 ** 6),
+            'packets': rng.randint(1, 1000)
+        } for _ in range(packet_count // 10)]
+        db.session.execute(db.insert(FlowRecord), flows)
+
+        db.session.execute(db.insert(ProtocolDistribution), [{
+            'timestamp': now - datetime.timedelta(minutes=minute),
+            'protocol': protocol,
+            'packet_count': rng.randint(10, 10000),
+            'byte_count': rng.randint(1000, 10 ** 7),
+            'percentage': 100.0 / len(protocols)
+        } for minute in range(60) for protocol in protocols])
+
+        db.session.execute(db.insert(BandwidthUsage), [{
+            'timestamp': now - datetime.timedelta(minutes=minute),
+            'interface': 'lo',
+            'bytes_in': rng.randint(10 ** 4, 10 ** 8),
+            'bytes_out': rng.randint(10 ** 4, 10 ** 8),
+            'packets_in': rng.randint(10, 10 ** 5),
+            'packets_out': rng.randint(10, 10 ** 5)
+        } for minute in range(60)])
+
+        db.session.execute(db.insert(AnomalyEvent), [{
+            'timestamp': now - datetime.timedelta(minutes=rng.randint(0, 600)),
+            'event_type': rng.choice(('Port Scan', 'SYN Flood', 'Bandwidth Spike')),
+            'severity': rng.randint(1, 5),
+            'description': 'Synthetic anomaly',
+            'source_ip': f"10.0.0.{rng.randint(1, 254)}"
+        } for _ in range(500)])
+        db.session.commit()
+
+def free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(mode, port, args, env):
+    """Launch main.py in the given mode and wait until it answers"""
+    cmd = [sys.executable, 'main.py', '--port', str(port)]
+    if mode == 'serve':
+        cmd.insert(2, 'serve')
+        if args.workers:
+            cmd += ['--workers', str(args.workers)]
+        if args.threads:
+            cmd += ['--threads', str(args.threads)]
+    else:
+        cmd.append('--no-debug')
+
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"main.py {mode} exited with status {process.returncode}")
+        try:
+            conn = HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', ENDPOINTS[0])
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"main.py {mode} did not start")
+
+def client(port, deadline, offset, latencies, errors):
+    """Issue requests round-robin over the endpoints until the deadline"""
+    conn = HTTPConnection('127.0.0.1', port, timeout=30)
+    i = offset
+    while time.monotonic() < deadline:
+        path = ENDPOINTS[i % len(ENDPOINTS)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(path)
+            else:
+                latencies.append(time.perf_counter() - started)
+        except OSError:
+            errors.append(path)
+            conn.close()
+            conn = HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.close()
+
+def run_load(port, duration, concurrency):
+    """Drive the server with concurrent clients; returns latencies, errors and elapsed time"""
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(target=client, args=(port, deadline, n, latencies, errors))
+        for n in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+
+    workdir = tempfile.mkdtemp(prefix='nativeprobe-load-')
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    env['NATIVEPROBE_AGENT'] = 'remote'  # Web processes only; the endpoints tested don't need the agent
+    env['NATIVEPROBE_AGENT_SOCKET'] = os.path.join(workdir, 'agent.sock')
+    os.environ['DATABASE_URL'] = env['DATABASE_URL']
+
+    import logging
+    logging.disable(logging.INFO)
+    seed_database(args.packets, args.seed)
+
+    print(f"Load: {args.concurrency} clients for {args.duration:.0f} s over {len(ENDPOINTS)} endpoints")
+    for mode in args.modes.split(','):
+        mode_env = dict(env, FLASK_ENV='production') if mode == 'serve' else env
+        port = free_port()
+        process = start_server(mode, port, args, mode_env)
+        try:
+            run_load(port, 1.0, args.concurrency)  # Warm-up
+            latencies, errors, elapsed = run_load(port, args.duration, args.concurrency)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        if not latencies:
+            print(f"  {mode:6s}: no successful requests ({len(errors)} errors)")
+            continue
+        print(f"  {mode:6s}: {len(latencies) / elapsed:8.1f} req/s"
+              f"  p50 {percentile(latencies, 0.50) * 1000:7.1f} ms"
+              f"  p99 {percentile(latencies, 0.99) * 1000:7.1f} ms"
+              f"  errors {len(errors)}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+SQLite ingest benchmark for NativeProbe
+
+Several producer threads (standing in for capture flushers, the flow
+collector and the anomaly detector) insert small batches of FlowRecord
+rows while a reader thread keeps querying, first the previous way
+(rollback journal, synchronous=FULL, every thread committing through its
+own session) and then with WAL pragmas and the single database writer.
+Reports rows/s written, reader queries/s and "database is locked" errors.
+Each mode runs in a fresh child process with its own database.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# SQLite settings before the writer existed
+PREVIOUS_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Benchmark concurrent SQLite ingest')
+    parser.add_argument('--producers', type=int, default=4,
+                        help='Concurrent writing threads')
+    parser.add_argument('--batches', type=int, default=200,
+                        help='Batches written by each producer')
+    parser.add_argument('--batch-size', type=int, default=20,
+                        help='Rows per batch')
+    parser.add_argument('--mode', choices=['before', 'after'], default=None,
+                        help=argparse.SUPPRESS)  # Internal: run one mode in this process
+    return parser.parse_args()
+
+def flow_rows(producer, batch, size):
+    """A batch of synthetic flow rows"""
+    now = datetime.datetime.utcnow()
+    return [{
+        'timestamp': now,
+        'flow_type': 'NetFlow-v5',
+        'source_ip': f"10.{producer}.{batch % 256}.{i % 256}",
+        'destination_ip': '192.168.1.1',
+        'source_port': 1024 + i,
+        'destination_port': 443,
+        'protocol': 6,
+        'bytes': 1500 * i,
+        'packets': i
+    } for i in range(size)]
+
+def run_mode(args):
+    """Run one mode in this process and print its results as JSON"""
+    from app import app, db, init_db
+    from models import FlowRecord
+    from utils.db_writer import submit_write, stop_db_writer
+
+    if args.mode == 'before':
+        app.config['SQLITE_PRAGMAS'] = PREVIOUS_PRAGMAS
+    init_db()
+
+    def insert_rows(rows):
+        db.session.execute(db.insert(FlowRecord), rows)
+
+    errors = []
+    done = threading.Event()
+    reads = [0]
+
+    def producer(n):
+        with app.app_context():
+            pending = []
+            for batch in range(args.batches):
+                rows = flow_rows(n, batch, args.batch_size)
+                if args.mode == 'after':
+                    pending.append(submit_write(insert_rows, rows))
+                    continue
+                try:
+                    insert_rows(rows)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(str(e))
+            for future in pending:
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(str(e))
+
+    def reader():
+        with app.app_context():
+            while not done.is_set():
+                try:
+                    db.session.query(db.func.count(FlowRecord.id)).scalar()
+                    db.session.commit()
+                    reads[0] += 1
+                except Exception as e:
+                    db.session.rollback()
+                    errors.append(str(e))
+
+    reader_thread = threading.Thread(target=reader)
+    reader_thread.start()
+    started = time.perf_counter()
+    producers = [threading.Thread(target=producer, args=(n,)) for n in range(args.producers)]
+    for thread in producers:
+        thread.start()
+    for thread in producers:
+        thread.join()
+    stop_db_writer()
+    elapsed = time.perf_counter() - started
+    done.set()
+    reader_thread.join()
+
+    with app.app_context():
+        stored = db.session.query(db.func.count(FlowRecord.id)).scalar()
+
+    print(json.dumps({
+        'rows': stored,
+        'elapsed': elapsed,
+        'reads': reads[0],
+        'locked': sum('locked' in e for e in errors),
+        'errors': len(errors)
+    }))
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    if args.mode:
+        import logging
+        logging.disable(logging.WARNING)
+        run_mode(args)
+        return 0
+
+    workdir = tempfile.mkdtemp(prefix='nativeprobe-ingest-')
+    total = args.producers * args.batches * args.batch_size
+    print(f"{args.producers} producers x {args.batches} batches x {args.batch_size} rows "
+          f"({total} rows) with one concurrent reader:")
+
+    for mode, label in (('before', 'per-thread commits, rollback journal'),
+                        ('after', 'WAL + single writer')):
+        env = dict(os.environ)
+        env['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, f'{mode}.db')}"
+        env['DB_WRITER'] = 'on' if mode == 'after' else 'off'
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode,
+             '--producers', str(args.producers), '--batches', str(args.batches),
+             '--batch-size', str(args.batch_size)],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"  {label:38s} {result['rows'] / result['elapsed']:10,.0f} rows/s"
+              f"  {result['reads'] / result['elapsed']:8,.0f} reads/s"
+              f"  {result['rows']:7d} rows stored  {result['locked']} locked errors")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Packet record benchmark for NativeProbe
+
+Compares the previous per-packet dict pipeline (dict with datetime and flag
+string per packet, turned into ORM Packet objects) with the PacketRecord
+pipeline (slotted records copied into the preallocated capture buffer and
+written with one executemany INSERT). Reports buffered memory and
+parse/write throughput on synthetic packets.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.packet_record import PacketRecord, seconds_to_us
+from utils.capture_buffer import CaptureBuffer
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Benchmark the packet record pipeline')
+    parser.add_argument('--packets', type=int, default=100000,
+                        help='Number of synthetic packets')
+    parser.add_argument('--batch', type=int, default=1000,
+                        help='Packets per database write')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed for the synthetic traffic')
+    return parser.parse_args()
+
+def synthetic_packets(count, seed):
+    """Generate raw field tuples standing in for decoded packets"""
+    rng = random.Random(seed)
+    start = time.time()
+    packets = []
+    for i in range(count):
+        tcp = rng.random() < 0.7
+        packets.append((
+            f"{start + i * 0.0001:.6f}",
+            rng.randint(60, 1514),
+            'TCP' if tcp else 'UDP',
+            f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            f"192.168.1.{rng.randint(1, 254)}",
+            rng.randint(1024, 65535),
+            rng.choice((80, 443, 53, 22)),
+            rng.choice((0x02, 0x12, 0x10, 0x18, 0x11, 0x04)) if tcp else None
+        ))
+    return packets
+
+def parse_to_dict(fields):
+    """The previous parser output: a dict with a datetime and a flag string"""
+    timestamp, length, protocol, source_ip, destination_ip, source_port, destination_port, flags = fields
+    packet_info = {
+        'timestamp': datetime.datetime.fromtimestamp(float(timestamp)),
+        'length': int(length),
+        'info': None,
+        'protocol': protocol,
+        'source_ip': source_ip,
+        'destination_ip': destination_ip,
+        'source_port': source_port,
+        'destination_port': destination_port
+    }
+    if flags is not None:
+        tcp_flags = ''
+        if flags & 0x02:
+            tcp_flags += 'S'
+        if flags & 0x10:
+            tcp_flags += 'A'
+        if flags & 0x01:
+            tcp_flags += 'F'
+        if flags & 0x04:
+            tcp_flags += 'R'
+        if flags & 0x08:
+            tcp_flags += 'P'
+        if flags & 0x20:
+            tcp_flags += 'U'
+        packet_info['tcp_flags'] = tcp_flags
+    return packet_info
+
+def parse_to_record(fields):
+    """The PacketRecord parser output"""
+    timestamp, length, protocol, source_ip, destination_ip, source_port, destination_port, flags = fields
+    return PacketRecord(
+        seconds_to_us(timestamp), int(length), protocol, source_ip, destination_ip,
+        source_port, destination_port, flags
+    )
+
+def measure_memory(packets, batch):
+    """Peak traced memory of holding one flush batch in each representation"""
+    sample = packets[:batch]
+
+    tracemalloc.start()
+    buffered = [parse_to_dict(fields) for fields in sample]
+    dict_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del buffered
+
+    tracemalloc.start()
+    buffer = CaptureBuffer(batch, 'drop-newest')
+    for fields in sample:
+        buffer.put(parse_to_record(fields))
+    record_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return dict_peak, record_peak
+
+def run_dict_pipeline(db, Packet, packets, batch, capture_id):
+    """Parse to dicts, build ORM objects and bulk save them"""
+    started = time.perf_counter()
+    pending = []
+    for fields in packets:
+        pending.append(parse_to_dict(fields))
+        if len(pending) >= batch:
+            save_dicts(db, Packet, pending, capture_id)
+            pending = []
+    save_dicts(db, Packet, pending, capture_id)
+    return time.perf_counter() - started
+
+def save_dicts(db, Packet, pending, capture_id):
+    """The previous save_packets_to_db body"""
+    packet_objects = [
+        Packet(
+            capture_id=capture_id,
+            timestamp=info.get('timestamp'),
+            protocol=info.get('protocol'),
+            source_ip=info.get('source_ip'),
+            destination_ip=info.get('destination_ip'),
+            source_port=info.get('source_port'),
+            destination_port=info.get('destination_port'),
+            length=info.get('length'),
+            info=info.get('info'),
+            tcp_flags=info.get('tcp_flags')
+        ) for info in pending
+    ]
+    db.session.bulk_save_objects(packet_objects)
+    db.session.commit()
+
+def run_record_pipeline(db, Packet, packets, batch, capture_id):
+    """Parse to PacketRecords, buffer them and insert with executemany"""
+    started = time.perf_counter()
+    buffer = CaptureBuffer(batch, 'drop-newest')
+    for fields in packets:
+        buffer.put(parse_to_record(fields))
+        if len(buffer) >= batch:
+            db.session.execute(db.insert(Packet), buffer.drain(capture_id))
+            db.session.commit()
+    rows = buffer.drain(capture_id)
+    if rows:
+        db.session.execute(db.insert(Packet), rows)
+        db.session.commit()
+    return time.perf_counter() - started
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+
+    # Use a throwaway database for the write phase
+    workdir = tempfile.mkdtemp(prefix='nativeprobe-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+
+    import logging
+    logging.disable(logging.INFO)
+    from app import app, db, init_db
+    from models import Packet, PacketCapture
+
+    init_db()
+    packets = synthetic_packets(args.packets, args.seed)
+
+    dict_peak, record_peak = measure_memory(packets, args.batch)
+    print(f"Buffered memory for {args.batch} packets:")
+    print(f"  dict path:   {dict_peak / 1024:10.1f} KiB ({dict_peak / args.batch:.0f} B/packet)")
+    print(f"  record path: {record_peak / 1024:10.1f} KiB ({record_peak / args.batch:.0f} B/packet)")
+
+    # Parse-only throughput
+    started = time.perf_counter()
+    for fields in packets:
+        parse_to_dict(fields)
+    dict_parse = time.perf_counter() - started
+    started = time.perf_counter()
+    for fields in packets:
+        parse_to_record(fields)
+    record_parse = time.perf_counter() - started
+    print(f"Parse throughput ({args.packets} packets):")
+    print(f"  dict path:   {args.packets / dict_parse:12,.0f} packets/s")
+    print(f"  record path: {args.packets / record_parse:12,.0f} packets/s")
+
+    # End-to-end parse and write throughput
+    with app.app_context():
+        capture = PacketCapture(name='benchmark', interface='none')
+        db.session.add(capture)
+        db.session.commit()
+
+        dict_total = run_dict_pipeline(db, Packet, packets, args.batch, capture.id)
+        record_total = run_record_pipeline(db, Packet, packets, args.batch, capture.id)
+
+    print(f"Parse + write throughput ({args.packets} packets, batches of {args.batch}):")
+    print(f"  dict path:   {args.packets / dict_total:12,.0f} packets/s")
+    print(f"  record path: {args.packets / record_total:12,.0f} packets/s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
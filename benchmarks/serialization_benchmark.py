@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+API serialization benchmark for NativeProbe
+
+Seeds a throwaway SQLite database and requests a 10k-row page of
+/api/packet-analysis/packets and /api/flow-analysis/flows in each response
+format. The previous implementation (ORM objects, a dict per row with
+isoformat() timestamps, Flask's default JSON provider) is run alongside
+as the baseline. Reports milliseconds per response and body size.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Benchmark API response serialization')
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='Rows per response')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Requests per format')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Random seed for the synthetic data')
+    return parser.parse_args()
+
+def seed_database(rows, seed):
+    """Fill the database named by DATABASE_URL with one capture's packets and some flows"""
+    from app import app, db, init_db
+    from models import PacketCapture, Packet, FlowRecord
+
+    init_db()
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    with app.app_context():
+        capture = PacketCapture(name='benchmark', interface='lo', start_time=now, end_time=now)
+        db.session.add(capture)
+        db.session.commit()
+
+        db.session.execute(db.insert(Packet), [{
+            'capture_id': capture.id,
+            'timestamp': now - datetime.timedelta(microseconds=rng.randint(0, 3600 * 10 ** 6)),
+            'protocol': rng.choice(('TCP', 'UDP', 'DNS', 'HTTP')),
+            'source_ip': f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            'destination_ip': f"192.168.1.{rng.randint(1, 254)}",
+            'source_port': rng.randint(1024, 65535),
+            'destination_port': rng.choice((80, 443, 53, 22)),
+            'length': rng.randint(60, 1514),
+            'info': 'Synthetic packet',
+            'tcp_flags': rng.choice(('S', 'SA', 'A', None)),
+            'sample_weight': 1
+        } for _ in range(rows)])
+
+        db.session.execute(db.insert(FlowRecord), [{
+            'timestamp': now - datetime.timedelta(microseconds=rng.randint(0, 3600 * 10 ** 6)),
+            'flow_type': 'NetFlow-v5',
+            'source_ip': f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+            'destination_ip': f"192.168.1.{rng.randint(1, 254)}",
+            'source_port': rng.randint(1024, 65535),
+            'destination_port': rng.choice((80, 443, 53, 22)),
+            'protocol': rng.choice((6, 17)),
+            'bytes': rng.randint(100, 10 ** 6),
+            'packets': rng.randint(1, 1000),
+            'start_time': now,
+            'end_time': now
+        } for _ in range(rows)])
+        db.session.commit()
+        return capture.id
+
+def previous_packets(capture_id, per_page):
+    """The packet list as it was built before: ORM rows, dicts, Flask's default JSON provider"""
+    from flask.json.provider import DefaultJSONProvider
+    from app import app
+    from models import Packet
+
+    packets = Packet.query.filter_by(capture_id=capture_id).order_by(
+        Packet.timestamp.desc()
+    ).paginate(page=1, per_page=per_page, error_out=False)
+    packet_list = [{
+        'id': packet.id,
+        'timestamp': packet.timestamp.isoformat(),
+        'protocol': packet.protocol,
+        'source_ip': packet.source_ip,
+        'source_port': packet.source_port,
+        'destination_ip': packet.destination_ip,
+        'destination_port': packet.destination_port,
+        'length': packet.length,
+        'info': packet.info,
+        'tcp_flags': packet.tcp_flags
+    } for packet in packets.items]
+    return DefaultJSONProvider(app).response({
+        'packets': packet_list,
+        'total': packets.total,
+        'pages': packets.pages,
+        'current_page': packets.page
+    }).get_data()
+
+def previous_flows(per_page):
+    """The flow list as it was built before"""
+    from flask.json.provider import DefaultJSONProvider
+    from app import app
+    from models import FlowRecord
+
+    flows = FlowRecord.query.order_by(FlowRecord.timestamp.desc()).paginate(
+        page=1, per_page=per_page, error_out=False
+    )
+    flow_list = [{
+        'id': flow.id,
+        'timestamp': flow.timestamp.isoformat(),
+        'flow_type': flow.flow_type,
+        'source_ip': flow.source_ip,
+        'destination_ip': flow.destination_ip,
+        'source_port': flow.source_port,
+        'destination_port': flow.destination_port,
+        'protocol': flow.protocol,
+        'bytes': flow.bytes,
+        'packets': flow.packets,
+        'start_time': flow.start_time.isoformat() if flow.start_time else None,
+        'end_time': flow.end_time.isoformat() if flow.end_time else None,
+        'tcp_flags': flow.tcp_flags,
+        'tos': flow.tos,
+        'input_interface': flow.input_interface,
+        'output_interface': flow.output_interface
+    } for flow in flows.items]
+    return DefaultJSONProvider(app).response({
+        'flows': flow_list,
+        'total': flows.total,
+        'pages': flows.pages,
+        'current_page': flows.page
+    }).get_data()
+
+def time_call(fn, repeat):
+    """Median seconds per call and the last result"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2], result
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+
+    workdir = tempfile.mkdtemp(prefix='nativeprobe-serialization-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'serialization.db')}"
+    os.environ['FLASK_ENV'] = 'production'
+
+    import logging
+    logging.disable(logging.INFO)
+    from app import app
+    from utils.serialization import get_optional_module
+
+    capture_id = seed_database(args.rows, args.seed)
+    client = app.test_client()
+
+    formats = [('json', None), ('columnar', 'application/vnd.nativeprobe.columnar+json')]
+    if get_optional_module('msgpack') is not None:
+        formats.append(('msgpack', 'application/msgpack'))
+
+    print(f"{args.rows}-row responses, median of {args.repeat} "
+          f"(orjson {'on' if get_optional_module('orjson') else 'off'}, "
+          f"msgpack {'on' if get_optional_module('msgpack') else 'not installed'}):")
+
+    endpoints = (
+        ('packets', f"/api/packet-analysis/packets/{capture_id}?per_page={args.rows}",
+         lambda: previous_packets(capture_id, args.rows)),
+        ('flows', f"/api/flow-analysis/flows?per_page={args.rows}",
+         lambda: previous_flows(args.rows))
+    )
+    for name, path, previous in endpoints:
+        with app.app_context():
+            elapsed, body = time_call(previous, args.repeat)
+        print(f"  {name:8s} {'previous rows':14s} {elapsed * 1000:8.1f} ms  {len(body) / 1024:8.0f} KiB")
+
+        for response_format, accept in formats:
+            headers = {'Accept': accept} if accept else {}
+            elapsed, response = time_call(lambda: client.get(path, headers=headers), args.repeat)
+            if response.status_code != 200:
+                print(f"  {name:8s} {response_format:14s} failed with {response.status_code}")
+                continue
+            print(f"  {name:8s} {response_format:14s} {elapsed * 1000:8.1f} ms  "
+                  f"{len(response.get_data()) / 1024:8.0f} KiB")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for NativeProbe
+
+Measures, in fresh interpreters, how long `import app` takes and which
+heavy libraries it drags in, and how long `main.py` takes from launch to
+its first successful HTTP response (the check desktop_app.wait_for_flask
+performs). Each run uses a new throwaway SQLite database so schema
+creation is included in the time to first response.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+from http.client import HTTPConnection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# desktop_app.FLASK_STARTUP_TIMEOUT (not imported, to keep tray libraries out of the measurement)
+FLASK_STARTUP_TIMEOUT = 10
+
+# Libraries that should only load when a capture or the ML detector needs them
+HEAVY_MODULES = ('scapy', 'pyshark', 'numpy')
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'heavy': [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='Benchmark application startup time')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of cold starts to measure')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Give up on a server start after this many seconds')
+    return parser.parse_args()
+
+def fresh_environment(workdir, run):
+    """Environment for a child process with its own empty database"""
+    env = dict(os.environ)
+    env['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, f'startup-{run}.db')}"
+    env['NATIVEPROBE_AGENT_SOCKET'] = os.path.join(workdir, f'agent-{run}.sock')
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    return env
+
+def free_port():
+    """Ask the OS for an unused TCP port"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def measure_import(env):
+    """Seconds to import the app module, and the heavy modules it loaded"""
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['heavy']
+
+def measure_first_response(env, timeout):
+    """Seconds from launching main.py until GET / answers successfully"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, 'main.py', '--port', str(port), '--no-debug'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"main.py exited with status {process.returncode}")
+            try:
+                conn = HTTPConnection('127.0.0.1', port, timeout=timeout)
+                conn.request('GET', '/')
+                status = conn.getresponse().status
+                conn.close()
+                if status < 400:
+                    return time.perf_counter() - started
+            except OSError:
+                pass
+            time.sleep(0.02)
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def summarize(label, values):
+    """Print median and worst case of a series of timings"""
+    print(f"  {label}: median {statistics.median(values):7.3f} s, worst {max(values):7.3f} s")
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    workdir = tempfile.mkdtemp(prefix='nativeprobe-startup-')
+
+    import_times = []
+    heavy_loaded = set()
+    response_times = []
+    failures = 0
+
+    for run in range(args.runs):
+        env = fresh_environment(workdir, run)
+        seconds, heavy = measure_import(env)
+        import_times.append(seconds)
+        heavy_loaded.update(heavy)
+
+        elapsed = measure_first_response(fresh_environment(workdir, f'{run}-server'), args.timeout)
+        if elapsed is None:
+            failures += 1
+        else:
+            response_times.append(elapsed)
+
+    print(f"Startup over {args.runs} cold starts:")
+    summarize("import app        ", import_times)
+    if response_times:
+        summarize("first response    ", response_times)
+        margin = FLASK_STARTUP_TIMEOUT - max(response_times)
+        print(f"  headroom against the desktop launcher's {FLASK_STARTUP_TIMEOUT} s timeout: {margin:.3f} s")
+    if failures:
+        print(f"  {failures} start(s) did not answer within {args.timeout} s")
+    print(f"  heavy modules loaded by import: {', '.join(sorted(heavy_loaded)) or 'none'}")
+    return 1 if failures or heavy_loaded else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,18 +13,123 @@ class Config:
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", "sqlite:///network_traffic.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    SQLITE_PRAGMAS = {  # applied to every new SQLite connection
+        "journal_mode": "WAL",  # readers don't block the writer or each other
+        "synchronous": "NORMAL",  # fsync at checkpoints rather than every commit
+        "busy_timeout": 30000,  # milliseconds to wait for a lock held by another process
+        "cache_size": -65536,  # KiB of page cache per connection
+        "temp_store": "MEMORY"
+    }
+    DB_WRITER = os.environ.get("DB_WRITER", "auto")  # auto (SQLite only), on or off
+    DB_WRITER_MAX_BATCH = 500  # queued writes committed in one transaction
+    DB_WRITER_MAX_DELAY = 0.05  # seconds to wait for more writes before committing
+    BULK_COPY_FORMAT = os.environ.get("BULK_COPY_FORMAT", "binary")  # binary or csv COPY on PostgreSQL
+    EXPORT_BATCH_SIZE = 5000  # rows fetched per server-side cursor batch when streaming an export
+
+    # Metrics store configuration (bandwidth and protocol time series)
+    METRICS_BACKEND = os.environ.get("METRICS_BACKEND", "sql")  # sql or influxdb
+    METRICS_RETENTION = 90 * 86400  # seconds before points are deleted
+    METRICS_DOWNSAMPLING = (  # (age, resolution) in seconds: older points are compacted to the resolution
+        (86400, 300),
+        (7 * 86400, 3600)
+    )
+    METRICS_MAINTENANCE_INTERVAL = 3600  # seconds between retention runs
+    INFLUXDB_URL = os.environ.get("INFLUXDB_URL", "http://localhost:8086")
+    INFLUXDB_DATABASE = os.environ.get("INFLUXDB_DATABASE", "nativeprobe")
+    INFLUXDB_USERNAME = os.environ.get("INFLUXDB_USERNAME", "")
+    INFLUXDB_PASSWORD = os.environ.get("INFLUXDB_PASSWORD", "")
+    INFLUXDB_TIMEOUT = 10  # seconds per HTTP request
+    INFLUXDB_BATCH_SIZE = 5000  # points per write request
+
+    # Production server configuration (main.py serve)
+    SERVER_WORKERS = int(os.environ.get("WEB_CONCURRENCY", "2"))  # pre-forked worker processes
+    SERVER_THREADS = int(os.environ.get("SERVER_THREADS", "8"))  # request threads per worker
+    SERVER_TIMEOUT = 60  # seconds before an unresponsive worker is restarted
+    SERVER_KEEPALIVE = 5  # seconds to hold idle keep-alive connections
+    SERVER_MAX_REQUESTS = 10000  # requests before a worker is recycled (0 disables; always 0 with an embedded agent)
     
     # Network capture configuration
     DEFAULT_CAPTURE_TIMEOUT = 60  # seconds
     MAX_PACKET_BUFFER = 10000  # number of packets to keep in memory
+    CAPTURE_BUFFER_POLICY = 'block'  # block, drop-newest or drop-oldest when the buffer is full
+    CAPTURE_FLUSH_BATCH = 1000  # packets per database write
+    CAPTURE_FLUSH_INTERVAL = 1.0  # seconds between database writes when traffic is light
+    CAPTURE_CHECKPOINT_INTERVAL = 5.0  # seconds between writes of a capture's running statistics
+    PCAP_STORE_DIR = os.environ.get("PCAP_STORE_DIR", "pcaps")  # managed pcap storage
+    CAPTURE_SEGMENT_SIZE = 64 * 1024 * 1024  # bytes per segment in continuous capture
+    CAPTURE_DISK_BUDGET = 2 * 1024 * 1024 * 1024  # bytes retained per continuous capture
+    CAPTURE_CLEANUP_INTERVAL = 600  # seconds between stale capture sweeps
+    STALE_CAPTURE_TIMEOUT = 3600  # seconds past its own timeout before a timed capture with no live worker is considered stuck
+    CAPTURE_WORKER_PROCESSES = os.environ.get("CAPTURE_WORKER_PROCESSES", "1") == "1"  # one process per capture
+    CAPTURE_WORKER_STOP_TIMEOUT = 10  # seconds to wait for a worker to exit after SIGTERM
+    
+    # Agent configuration
+    AGENT_MODE = os.environ.get("NATIVEPROBE_AGENT", "embedded")  # embedded or remote
+    AGENT_SOCKET = os.environ.get(
+        "NATIVEPROBE_AGENT_SOCKET",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "nativeprobe-agent.sock")
+    )
+    AGENT_PORT = int(os.environ.get("NATIVEPROBE_AGENT_PORT", "5055"))  # used where Unix sockets are unavailable
+    AGENT_RPC_TIMEOUT = 30  # seconds
+    AGENT_MAINTENANCE_INTERVAL = 30  # seconds between dead worker checks
     
+    # Bandwidth accounting configuration
+    BANDWIDTH_SAMPLE_INTERVAL = float(os.environ.get("BANDWIDTH_SAMPLE_INTERVAL", "10"))  # seconds (0.1 to 60, 0 disables)
+    BANDWIDTH_FLUSH_INTERVAL = 10.0  # seconds between batched writes of samples
+    BANDWIDTH_INTERFACES = [  # interfaces to sample; empty means every interface in sysfs
+        name for name in os.environ.get("BANDWIDTH_INTERFACES", "").split(",") if name
+    ]
+    BANDWIDTH_RING_SIZE = 600  # recent samples kept in memory per interface
+
     # Flow analysis configuration
     FLOW_COLLECTOR_PORT = 9995  # Default NetFlow collector port
     FLOW_ANALYSIS_INTERVAL = 60  # seconds
+    FLOW_ASSEMBLY = os.environ.get("FLOW_ASSEMBLY", "1") == "1"  # build conversations from captured packets
+    FLOW_IDLE_TIMEOUT = 15  # seconds without packets before a conversation is emitted
+    FLOW_ACTIVE_TIMEOUT = 1800  # seconds before a long conversation is emitted and restarted
+    FLOW_TABLE_MAX_FLOWS = 65536  # conversations held in memory per capture
+    FLOW_EXPORT_COLLECTORS = [  # host:port collectors that captured flows are exported to; empty disables
+        collector for collector in os.environ.get("FLOW_EXPORT_COLLECTORS", "").split(",") if collector
+    ]
+    FLOW_EXPORT_PROTOCOL = os.environ.get("FLOW_EXPORT_PROTOCOL", "ipfix")  # netflow5, netflow9 or ipfix
+    FLOW_EXPORT_TEMPLATE_INTERVAL = 60  # seconds between v9/IPFIX template retransmissions
+    FLOW_EXPORT_MTU = 1400  # bytes per export datagram
     
     # Anomaly detection configuration
     ANOMALY_CHECK_INTERVAL = 300  # seconds
+    ANOMALY_DETECTOR_INTERVALS = {  # per-detector overrides, in seconds
+        'syn_flood': 10,
+        'connection': 60
+    }
+    ANOMALY_DETECTOR_TIMEOUT = 120  # seconds before a detector run is reported as timed out
+    ANOMALY_DETECTOR_WORKERS = 4
+    ANOMALY_STATS_RECONCILE_INTERVAL = 3600  # seconds between full rebuilds of the statistics counters
     ANOMALY_THRESHOLD_MULTIPLIER = 3.0  # standard deviations from mean
+    ANOMALY_DEDUP_WINDOW = 3600  # seconds of quiet before a repeated hit opens a new event
+    ANOMALY_FLUSH_BATCH = 500  # new events buffered before a batched insert
+    
+    # SYN flood detection configuration
+    TCP_TRACKER_MAX_CONNECTIONS = 65536  # half-open handshakes held in memory
+    TCP_TRACKER_MAX_DESTINATIONS = 4096  # destinations with handshake statistics
+    TCP_TRACKER_REPORT_DESTINATIONS = 256  # busiest destinations a capture worker reports to the agent per checkpoint
+    TCP_HANDSHAKE_TIMEOUT = 30  # seconds before a half-open handshake counts as failed
+    SYN_FLOOD_WINDOW = 60  # seconds per handshake statistics window
+    SYN_FLOOD_MIN_SYNS = 200  # SYNs per window before a destination is evaluated
+    SYN_FLOOD_MIN_COMPLETION_RATIO = 0.2  # completed handshakes per SYN
+    SYN_FLOOD_HALF_OPEN_THRESHOLD = 1000  # concurrent half-open connections to one destination
+    
+    # Machine-learning anomaly detection configuration
+    ML_WINDOW_SECONDS = 300  # per-host feature window
+    ML_TRAINING_DAYS = 7  # history used to train the model
+    ML_MIN_TRAINING_SAMPLES = 50  # host-windows required before training
+    ML_TREES = 100
+    ML_SAMPLE_SIZE = 256
+    ML_CONTAMINATION = 0.01  # expected fraction of anomalous host-windows
+    ML_MODEL_PATH = os.environ.get("ML_MODEL_PATH", "anomaly_model.npz")
     
     # UI configuration
     ITEMS_PER_PAGE = 50
@@ -3,7 +3,7 @@
 Desktop application wrapper for NativeProbe
 
 This script wraps the NativeProbe web application in a desktop-like experience by:
-1. Starting the Flask server in the background
+1. Starting the capture agent and the Flask server in the background
 2. Automatically opening a browser window
 3. Providing a system tray icon with controls
 4. Handling graceful shutdown
@@ -50,6 +50,13 @@ def parse_arguments():
                         help='Run in production mode without debug')
     return parser.parse_args()
 
+def start_agent():
+    """Start the capture/collection/detection agent in a separate process"""
+    import subprocess
+    
+    logger.info("Starting NativeProbe agent...")
+    return subprocess.Popen([sys.executable, 'agent.py'])
+
 def start_flask_server(port, debug_mode=True):
     """Start the Flask server in a separate process"""
     import subprocess
@@ -60,12 +67,27 @@ def start_flask_server(port, debug_mode=True):
     if not debug_mode:
         cmd.append('--no-debug')
     
+    # The web server forwards capture and detection requests to the agent
+    env = dict(os.environ, NATIVEPROBE_AGENT='remote')
+    
     # Start the Flask server as a subprocess
     logger.info(f"Starting NativeProbe server on port {port}...")
-    process = subprocess.Popen(cmd)
+    process = subprocess.Popen(cmd, env=env)
     
     return process
 
+def stop_processes(*processes):
+    """Terminate child processes, killing any that do not exit in time"""
+    for process in processes:
+        if process and process.poll() is None:
+            process.terminate()
+    for process in processes:
+        if process:
+            try:
+                process.wait(timeout=5)
+            except Exception:
+                process.kill()
+
 def wait_for_flask(host, port, timeout=FLASK_STARTUP_TIMEOUT):
     """Wait for Flask server to start up"""
     start_time = time.time()
@@ -111,7 +133,7 @@ def create_icon_image():
     
     return image
 
-def setup_tray_icon(server_process, host, port):
+def setup_tray_icon(server_process, agent_process, host, port):
     """Set up system tray icon with menu"""
     if not HAS_TRAY_SUPPORT:
         return None
@@ -124,8 +146,7 @@ def setup_tray_icon(server_process, host, port):
     def exit_app(icon, item):
         icon.stop()
         logger.info("Shutting down NativeProbe...")
-        server_process.terminate()
-        server_process.wait(timeout=5)
+        stop_processes(server_process, agent_process)
         sys.exit(0)
     
     # Create a menu with options
@@ -138,16 +159,11 @@ def setup_tray_icon(server_process, host, port):
     icon = pystray.Icon('NativeProbe', image, 'NativeProbe', menu)
     return icon
 
-def handle_exit(server_process):
+def handle_exit(server_process, agent_process):
     """Handle graceful shutdown on exit"""
     def signal_handler(sig, frame):
         logger.info("Shutting down NativeProbe...")
-        if server_process:
-            server_process.terminate()
-            try:
-                server_process.wait(timeout=5)
-            except:
-                server_process.kill()
+        stop_processes(server_process, agent_process)
         sys.exit(0)
     
     signal.signal(signal.SIGINT, signal_handler)
@@ -160,16 +176,17 @@ def main():
     host = DEFAULT_HOST
     port = args.port
     
-    # Start the Flask server
+    # Start the agent and the Flask server
+    agent_process = start_agent()
     server_process = start_flask_server(port, not args.no_debug)
     
     # Set up signal handler for graceful shutdown
-    handle_exit(server_process)
+    handle_exit(server_process, agent_process)
     
     # Wait for Flask to start
     if not wait_for_flask(host, port):
         logger.error("Failed to start server. Check logs for details.")
-        server_process.terminate()
+        stop_processes(server_process, agent_process)
         return 1
     
     # Open browser if requested
@@ -180,7 +197,7 @@ def main():
     
     # Set up system tray icon if supported and requested
     if HAS_TRAY_SUPPORT and not args.no_tray:
-        icon = setup_tray_icon(server_process, host, port)
+        icon = setup_tray_icon(server_process, agent_process, host, port)
         if icon:
             logger.info("NativeProbe is running in the system tray")
             icon.run()
@@ -193,9 +210,7 @@ def main():
         except KeyboardInterrupt:
             pass
         finally:
-            if server_process.poll() is None:
-                server_process.terminate()
-                server_process.wait(timeout=5)
+            stop_processes(server_process, agent_process)
     
     return 0
 
@@ -2,17 +2,27 @@
 Main entry point for the Network Traffic Analysis Tool
 
 Usage:
-    python main.py [--port PORT] [--no-debug] [--help]
+    python main.py [--port PORT] [--no-debug] [--init-db] [--help]
+    python main.py serve [--port PORT] [--workers N] [--threads N]
+
+Commands:
+    run             Development server (default)
+    serve           Production server (gunicorn) using the FLASK_ENV configuration
 
 Options:
     --port PORT     Specify the port number to listen on (default: 5000)
     --no-debug      Run in production mode without debug
+    --init-db       Create the database tables and exit
+    --workers N     Worker processes for serve (default: Config.SERVER_WORKERS)
+    --threads N     Request threads per worker for serve (default: Config.SERVER_THREADS)
     --help          Show this help message
 """
 import argparse
 import logging
+import os
 import sys
-from app import app
+from app import app, init_db
+from config import Config
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -21,10 +31,18 @@ logger = logging.getLogger(__name__)
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description="Network Traffic Analysis Tool")
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'serve'],
+                        help="'run' for the development server, 'serve' for production (default: run)")
     parser.add_argument('--port', type=int, default=5000,
                         help='Port number to listen on (default: 5000)')
     parser.add_argument('--no-debug', action='store_true',
                         help='Run in production mode without debug')
+    parser.add_argument('--init-db', action='store_true',
+                        help='Create the database tables and exit')
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f'Worker processes for serve (default: {Config.SERVER_WORKERS})')
+    parser.add_argument('--threads', type=int, default=None,
+                        help=f'Request threads per worker for serve (default: {Config.SERVER_THREADS})')
     
     return parser.parse_args()
 
@@ -35,8 +53,24 @@ def main():
     debug_mode = not args.no_debug
     port = args.port
     
+    init_db()
+    if args.init_db:
+        return
+    
+    if args.command == 'serve':
+        from utils.web_server import serve
+        return serve(app, port=port, workers=args.workers, threads=args.threads)
+    
+    # Without a separate agent, this process also runs capture and detection maintenance.
+    # In debug mode Werkzeug's reloader re-runs this in a child process that does the
+    # serving; only that process starts it, so the sampler and maintenance run once.
+    serving_process = not debug_mode or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if Config.AGENT_MODE == 'embedded' and serving_process:
+        from utils.agent_service import start_maintenance
+        start_maintenance()
+    
     logger.info(f"Starting Network Traffic Analysis Tool on port {port}")
     app.run(host='0.0.0.0', port=port, debug=debug_mode)
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -12,12 +12,49 @@ class PacketCapture(db.Model):
     start_time = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     end_time = db.Column(db.DateTime, nullable=True)
     packet_count = db.Column(db.Integer, default=0)
+    byte_count = db.Column(db.BigInteger, nullable=True)  # Sample-weighted bytes captured
+    protocol_counts = db.Column(db.Text, nullable=True)  # JSON {protocol: sample-weighted packets}
+    first_packet_time = db.Column(db.DateTime, nullable=True)
+    last_packet_time = db.Column(db.DateTime, nullable=True)
     file_path = db.Column(db.String(255), nullable=True)
-    filter_expression = db.Column(db.String(255), nullable=True)
+    filter_expression = db.Column(db.String(255), nullable=True)  # BPF capture filter (kernel)
+    display_filter = db.Column(db.String(255), nullable=True)  # Wireshark display filter (userspace)
+    packets_seen = db.Column(db.BigInteger, nullable=True)  # Packets received on the interface during capture
+    packets_delivered = db.Column(db.BigInteger, nullable=True)  # Packets that passed the capture filter
     description = db.Column(db.Text, nullable=True)
+    continuous = db.Column(db.Boolean, default=False)  # Ring-buffer capture with rotating segments
+    segment_size = db.Column(db.BigInteger, nullable=True)  # bytes per pcap segment
+    disk_budget = db.Column(db.BigInteger, nullable=True)  # bytes retained across all segments
+    sampling_mode = db.Column(db.String(20), default='none')  # none, systematic or flow
+    sampling_rate = db.Column(db.Integer, default=1)  # Keep 1 in N packets
+    snap_length = db.Column(db.Integer, nullable=True)  # bytes of each frame stored
+    linktype = db.Column(db.Integer, nullable=True)  # pcap link-layer header type of the frames (None: Ethernet)
+    buffer_policy = db.Column(db.String(20), nullable=True)  # block, drop-newest or drop-oldest
+    store_packets = db.Column(db.Boolean, default=True)  # False keeps only flows (no packet rows or frames)
+    kernel_drops = db.Column(db.BigInteger, nullable=True)  # Packets dropped by the kernel socket
+    app_drops = db.Column(db.BigInteger, nullable=True)  # Packets dropped by the full application buffer
+    timeout = db.Column(db.Integer, nullable=True)  # seconds; None for continuous captures
+    worker_pid = db.Column(db.Integer, nullable=True)  # Capture worker process, if run out of process
+    worker_cpu = db.Column(db.Integer, nullable=True)  # CPU the worker is pinned to
+    tcp_handshakes = db.Column(db.Text, nullable=True)  # JSON snapshot of the worker's TCP handshake tracker
     
     # Relationship with captured packets
     packets = db.relationship('Packet', backref='capture', lazy=True)
+    segments = db.relationship('CaptureSegment', backref='capture', lazy=True)
+
+class CaptureSegment(db.Model):
+    """Model for retained pcap segments of a continuous capture"""
+    id = db.Column(db.Integer, primary_key=True)
+    capture_id = db.Column(db.Integer, db.ForeignKey('packet_capture.id'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False)
+    file_path = db.Column(db.String(255), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=True)
+    end_time = db.Column(db.DateTime, nullable=True)
+    packet_count = db.Column(db.Integer, default=0)
+    byte_size = db.Column(db.BigInteger, default=0)
+    closed = db.Column(db.Boolean, default=False)
+    
+    __table_args__ = (db.UniqueConstraint('capture_id', 'sequence'),)
 
 class Packet(db.Model):
     """Model for individual network packets"""
@@ -32,12 +69,18 @@ class Packet(db.Model):
     length = db.Column(db.Integer, nullable=True)
     info = db.Column(db.Text, nullable=True)
     tcp_flags = db.Column(db.String(10), nullable=True)
+    pcap_offset = db.Column(db.BigInteger, nullable=True)  # Byte offset of the frame in the capture's pcap file
+    pcap_segment = db.Column(db.Integer, nullable=True)  # Segment sequence number for continuous captures
+    sample_weight = db.Column(db.Integer, default=1)  # Packets this row stands for when the capture was sampled
+    
+    __table_args__ = (db.Index('ix_packet_capture_segment', 'capture_id', 'pcap_segment'),)
     
 class FlowRecord(db.Model):
-    """Model for NetFlow/IPFIX/sFlow records"""
+    """Model for NetFlow/IPFIX/sFlow records and conversations assembled from captures"""
     id = db.Column(db.Integer, primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
-    flow_type = db.Column(db.String(10), nullable=False)  # NetFlow, IPFIX, sFlow
+    flow_type = db.Column(db.String(10), nullable=False)  # NetFlow, IPFIX, sFlow, Capture
+    capture_id = db.Column(db.Integer, db.ForeignKey('packet_capture.id'), nullable=True)  # Capture a conversation was assembled from
     source_ip = db.Column(db.String(45), nullable=False)
     destination_ip = db.Column(db.String(45), nullable=False)
     source_port = db.Column(db.Integer, nullable=True)
@@ -45,12 +88,17 @@ class FlowRecord(db.Model):
     protocol = db.Column(db.Integer, nullable=True)
     bytes = db.Column(db.BigInteger, nullable=True)
     packets = db.Column(db.BigInteger, nullable=True)
+    reverse_bytes = db.Column(db.BigInteger, nullable=True)  # Responder to initiator, for bidirectional flows
+    reverse_packets = db.Column(db.BigInteger, nullable=True)
     start_time = db.Column(db.DateTime, nullable=True)
     end_time = db.Column(db.DateTime, nullable=True)
     tcp_flags = db.Column(db.Integer, nullable=True)
+    reverse_tcp_flags = db.Column(db.Integer, nullable=True)
     tos = db.Column(db.Integer, nullable=True)
     input_interface = db.Column(db.Integer, nullable=True)
     output_interface = db.Column(db.Integer, nullable=True)
+    
+    __table_args__ = (db.Index('ix_flow_record_capture', 'capture_id'),)
 
 class BandwidthUsage(db.Model):
     """Model for bandwidth utilization metrics"""
@@ -82,6 +130,19 @@ class AnomalyEvent(db.Model):
     destination_ip = db.Column(db.String(45), nullable=True)
     resolved = db.Column(db.Boolean, default=False)
     resolution_notes = db.Column(db.Text, nullable=True)
+    signature = db.Column(db.String(255), nullable=True)  # Stable key used to group repeated hits
+    occurrence_count = db.Column(db.Integer, default=1)
+    last_seen = db.Column(db.DateTime, nullable=True)
+
+class AnomalyStatistic(db.Model):
+    """Model for running anomaly counters (by severity, event type and resolution)"""
+    id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(20), nullable=False)  # severity, event_type, resolved
+    key = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.BigInteger, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('dimension', 'key'),)
 
 class CaptureInterface(db.Model):
     """Model for network interfaces available for capture"""
@@ -3,7 +3,9 @@ Anomaly detection routes for Network Traffic Analysis Tool
 """
 from flask import Blueprint, render_template, jsonify, request
 from models import AnomalyEvent
-from utils.anomaly_detection import start_anomaly_detection, stop_anomaly_detection
+from utils.agent_service import call_agent
+from utils.agent_rpc import AgentUnavailable
+from utils.anomaly_statistics import adjust_anomaly_counters, get_anomaly_counters
 from app import db
 import datetime
 
@@ -22,7 +24,7 @@ def start_detection():
     sensitivity = data.get('sensitivity', 3.0)  # Default: 3.0 standard deviations
     
     try:
-        success = start_anomaly_detection(detection_method, sensitivity)
+        success = call_agent('start_detection', method=detection_method, sensitivity=sensitivity)
         return jsonify({'success': success})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -31,11 +33,43 @@ def start_detection():
 def stop_detection():
     """API endpoint to stop anomaly detection"""
     try:
-        success = stop_anomaly_detection()
+        success = call_agent('stop_detection')
         return jsonify({'success': success})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@anomaly_detection_bp.route('/api/anomaly-detection/train-model', methods=['POST'])
+def train_detection_model():
+    """API endpoint to train the machine-learning model on stored history"""
+    data = request.json or {}
+    days = data.get('days')  # Default: Config.ML_TRAINING_DAYS
+    
+    try:
+        stats = call_agent('train_model', days=days)
+        if stats is None:
+            return jsonify({'success': False, 'error': 'Not enough traffic history to train a model'}), 400
+        return jsonify({'success': True, 'model': stats})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@anomaly_detection_bp.route('/api/anomaly-detection/model')
+def detection_model():
+    """API endpoint to get machine-learning model training and scoring statistics"""
+    try:
+        return jsonify(call_agent('model_statistics'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@anomaly_detection_bp.route('/api/anomaly-detection/syn-tracker')
+def syn_tracker():
+    """API endpoint to get live per-destination TCP handshake statistics"""
+    min_syns = request.args.get('min_syns', 1, type=int)
+    
+    try:
+        return jsonify(call_agent('syn_tracker', min_syns=min_syns))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @anomaly_detection_bp.route('/api/anomaly-detection/anomalies')
 def get_anomalies():
     """API endpoint to get detected anomalies"""
@@ -81,7 +115,9 @@ def get_anomalies():
             'source_ip': anomaly.source_ip,
             'destination_ip': anomaly.destination_ip,
             'resolved': anomaly.resolved,
-            'resolution_notes': anomaly.resolution_notes
+            'resolution_notes': anomaly.resolution_notes,
+            'occurrence_count': anomaly.occurrence_count or 1,
+            'last_seen': anomaly.last_seen.isoformat() if anomaly.last_seen else None
         })
     
     return jsonify({
@@ -100,6 +136,10 @@ def resolve_anomaly(anomaly_id):
     # Get the anomaly
     anomaly = AnomalyEvent.query.get_or_404(anomaly_id)
     
+    # Move the event between resolution counters in the same transaction
+    if not anomaly.resolved:
+        adjust_anomaly_counters({('resolved', 'false'): -1, ('resolved', 'true'): 1})
+    
     # Update the anomaly
     anomaly.resolved = True
     anomaly.resolution_notes = resolution_notes
@@ -107,58 +147,49 @@ def resolve_anomaly(anomaly_id):
     # Save to database
     db.session.commit()
     
+    # New hits should open a fresh event rather than fold into a resolved one
+    try:
+        call_agent('forget_anomaly', anomaly_id=anomaly_id)
+    except AgentUnavailable:
+        pass  # The agent rebuilds its index from unresolved events when it starts
+    
     return jsonify({'success': True})
 
 @anomaly_detection_bp.route('/api/anomaly-detection/statistics')
 def anomaly_statistics():
     """API endpoint to get anomaly statistics"""
-    # Get counts by severity
-    severity_counts = db.session.query(
-        AnomalyEvent.severity,
-        db.func.count().label('count')
-    ).group_by(AnomalyEvent.severity).all()
-    
-    # Get counts by event type
-    event_type_counts = db.session.query(
-        AnomalyEvent.event_type,
-        db.func.count().label('count')
-    ).group_by(AnomalyEvent.event_type).all()
-    
-    # Get counts by resolved status
-    resolution_counts = db.session.query(
-        AnomalyEvent.resolved,
-        db.func.count().label('count')
-    ).group_by(AnomalyEvent.resolved).all()
+    # Read the running counters instead of grouping the whole event table
+    counters = get_anomaly_counters()
+    
+    try:
+        detectors = call_agent('detector_statistics')
+    except AgentUnavailable:
+        detectors = {}
     
     # Format the data
     severity_data = [
         {
-            'severity': sev.severity,
-            'count': sev.count
-        } for sev in severity_counts
+            'severity': int(severity),
+            'count': count
+        } for severity, count in sorted(counters['severity'].items(), key=lambda item: int(item[0]))
     ]
     
     event_type_data = [
         {
-            'event_type': evt.event_type,
-            'count': evt.count
-        } for evt in event_type_counts
+            'event_type': event_type,
+            'count': count
+        } for event_type, count in counters['event_type'].items()
     ]
     
     resolution_data = {
-        'resolved': 0,
-        'unresolved': 0
+        'resolved': counters['resolved'].get('true', 0),
+        'unresolved': counters['resolved'].get('false', 0)
     }
     
-    for res in resolution_counts:
-        if res.resolved:
-            resolution_data['resolved'] = res.count
-        else:
-            resolution_data['unresolved'] = res.count
-    
     return jsonify({
         'by_severity': severity_data,
         'by_event_type': event_type_data,
         'by_resolution': resolution_data,
-        'total': sum(sev.count for sev in severity_counts)
+        'total': resolution_data['resolved'] + resolution_data['unresolved'],
+        'detectors': detectors
     })
@@ -2,13 +2,25 @@
 Dashboard routes for Network Traffic Analysis Tool
 """
 from flask import Blueprint, render_template, jsonify, request
-from models import PacketCapture, BandwidthUsage, ProtocolDistribution, AnomalyEvent
+from models import PacketCapture, AnomalyEvent
 from utils.packet_capture import get_available_interfaces
+from utils.metrics_store import get_metrics_store
+from utils.agent_service import call_agent
+from utils.agent_rpc import AgentUnavailable
+from utils.downsampling import downsample_series, DOWNSAMPLING_METHODS
+from utils.serialization import negotiate_format, encode_table, send
+from config import Config
 from app import db
 import datetime
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
+# Fields of each dashboard summary table
+BANDWIDTH_COLUMNS = ('timestamp', 'interface', 'bytes_in', 'bytes_out', 'packets_in', 'packets_out')
+PROTOCOL_COLUMNS = ('protocol', 'packet_count', 'byte_count', 'percentage')
+ANOMALY_COLUMNS = ('timestamp', 'event_type', 'severity', 'description', 'source_ip', 'destination_ip', 'resolved')
+CAPTURE_COLUMNS = ('id', 'name', 'interface', 'start_time', 'packet_count', 'filter_expression')
+
 @dashboard_bp.route('/')
 def index():
     """Render the main dashboard page"""
@@ -18,18 +30,24 @@ def index():
 @dashboard_bp.route('/api/dashboard/summary')
 def dashboard_summary():
     """API endpoint for dashboard summary data"""
-    # Get the latest bandwidth usage
+    points = request.args.get('points', Config.MAX_CHART_POINTS, type=int)  # per interface
+    method = request.args.get('downsample', 'lttb')
+    if method not in DOWNSAMPLING_METHODS:
+        return jsonify({'success': False, 'error': f"Unknown downsampling method: {method}"}), 400
+    response_format = negotiate_format()
+    
+    # Get the last hour of bandwidth usage, downsampled per interface
     current_time = datetime.datetime.utcnow()
     past_hour = current_time - datetime.timedelta(hours=1)
     
-    bandwidth_data = BandwidthUsage.query.filter(
-        BandwidthUsage.timestamp >= past_hour
-    ).order_by(BandwidthUsage.timestamp.desc()).limit(100).all()
+    metrics = get_metrics_store()
+    bandwidth_data = downsample_series(
+        metrics.query('bandwidth', start=past_hour),
+        ('bytes_in', 'bytes_out'), points, method, tag='interface'
+    )
     
     # Get protocol distribution
-    protocol_data = ProtocolDistribution.query.filter(
-        ProtocolDistribution.timestamp >= past_hour
-    ).order_by(ProtocolDistribution.timestamp.desc()).limit(10).all()
+    protocol_data = metrics.query('protocol_distribution', start=past_hour, descending=True, limit=10)
     
     # Get recent anomalies
     anomalies = AnomalyEvent.query.filter(
@@ -42,86 +60,67 @@ def dashboard_summary():
     ).all()
     
     # Format the data for the frontend
-    bandwidth_series = [
-        {
-            'timestamp': data.timestamp.isoformat(),
-            'interface': data.interface,
-            'bytes_in': data.bytes_in,
-            'bytes_out': data.bytes_out,
-            'packets_in': data.packets_in,
-            'packets_out': data.packets_out
-        } for data in bandwidth_data
-    ]
-    
-    protocol_series = [
-        {
-            'protocol': data.protocol,
-            'packet_count': data.packet_count,
-            'byte_count': data.byte_count,
-            'percentage': data.percentage
-        } for data in protocol_data
-    ]
-    
-    anomaly_list = [
-        {
-            'timestamp': anomaly.timestamp.isoformat(),
-            'event_type': anomaly.event_type,
-            'severity': anomaly.severity,
-            'description': anomaly.description,
-            'source_ip': anomaly.source_ip,
-            'destination_ip': anomaly.destination_ip,
-            'resolved': anomaly.resolved
-        } for anomaly in anomalies
-    ]
-    
-    capture_list = [
-        {
-            'id': capture.id,
-            'name': capture.name,
-            'interface': capture.interface,
-            'start_time': capture.start_time.isoformat(),
-            'packet_count': capture.packet_count,
-            'filter_expression': capture.filter_expression
-        } for capture in active_captures
-    ]
-    
-    return jsonify({
-        'bandwidth': bandwidth_series,
-        'protocols': protocol_series,
-        'anomalies': anomaly_list,
-        'active_captures': capture_list
-    })
+    return send({
+        'bandwidth': encode_table(
+            BANDWIDTH_COLUMNS,
+            [tuple(data[column] for column in BANDWIDTH_COLUMNS) for data in bandwidth_data],
+            response_format
+        ),
+        'protocols': encode_table(
+            PROTOCOL_COLUMNS,
+            [tuple(data[column] for column in PROTOCOL_COLUMNS) for data in protocol_data],
+            response_format
+        ),
+        'anomalies': encode_table(
+            ANOMALY_COLUMNS,
+            [tuple(getattr(anomaly, column) for column in ANOMALY_COLUMNS) for anomaly in anomalies],
+            response_format
+        ),
+        'active_captures': encode_table(
+            CAPTURE_COLUMNS,
+            [tuple(getattr(capture, column) for column in CAPTURE_COLUMNS) for capture in active_captures],
+            response_format,
+            time_columns=('start_time',)
+        )
+    }, response_format)
 
 @dashboard_bp.route('/api/dashboard/live-stats')
 def live_stats():
     """API endpoint for real-time network statistics"""
     # Get the most recent bandwidth data
-    latest_bandwidth = BandwidthUsage.query.order_by(
-        BandwidthUsage.timestamp.desc()
-    ).first()
+    metrics = get_metrics_store()
+    try:
+        # The sampler's in-memory ring is newer than anything written yet
+        live_bandwidth = call_agent('live_bandwidth', limit=1)
+    except AgentUnavailable:
+        live_bandwidth = []
+    if live_bandwidth:
+        latest_bandwidth = live_bandwidth[-1]
+    else:
+        latest_bandwidth = next(iter(metrics.latest('bandwidth')), None)
+        if latest_bandwidth:
+            latest_bandwidth['timestamp'] = latest_bandwidth['timestamp'].isoformat()
     
     # Get the latest protocol distribution
-    latest_protocols = ProtocolDistribution.query.order_by(
-        ProtocolDistribution.timestamp.desc()
-    ).limit(5).all()
+    latest_protocols = metrics.latest('protocol_distribution', limit=5)
     
     # Format the data
     bandwidth_data = {}
     if latest_bandwidth:
         bandwidth_data = {
-            'timestamp': latest_bandwidth.timestamp.isoformat(),
-            'interface': latest_bandwidth.interface,
-            'bytes_in': latest_bandwidth.bytes_in,
-            'bytes_out': latest_bandwidth.bytes_out,
-            'packets_in': latest_bandwidth.packets_in,
-            'packets_out': latest_bandwidth.packets_out,
-            'total_bandwidth': (latest_bandwidth.bytes_in + latest_bandwidth.bytes_out) / 1024  # KB
+            'timestamp': latest_bandwidth['timestamp'],
+            'interface': latest_bandwidth['interface'],
+            'bytes_in': latest_bandwidth['bytes_in'],
+            'bytes_out': latest_bandwidth['bytes_out'],
+            'packets_in': latest_bandwidth['packets_in'],
+            'packets_out': latest_bandwidth['packets_out'],
+            'total_bandwidth': (latest_bandwidth['bytes_in'] + latest_bandwidth['bytes_out']) / 1024  # KB
         }
     
     protocol_data = [
         {
-            'protocol': proto.protocol,
-            'percentage': proto.percentage
+            'protocol': proto['protocol'],
+            'percentage': proto['percentage']
         } for proto in latest_protocols
     ]
     
@@ -3,12 +3,22 @@ Flow analysis routes for Network Traffic Analysis Tool
 """
 from flask import Blueprint, render_template, jsonify, request
 from models import FlowRecord
-from utils.flow_analysis import start_flow_collector, stop_flow_collector
+from utils.agent_service import call_agent
+from utils.serialization import negotiate_format, encode_table, send
+from utils.export import check_export_format, stream_csv, stream_parquet, export_response
 from app import db
 import datetime
 
 flow_analysis_bp = Blueprint('flow_analysis', __name__)
 
+# Flow record fields returned by the flow list
+FLOW_COLUMNS = (
+    'id', 'timestamp', 'flow_type', 'source_ip', 'destination_ip', 'source_port',
+    'destination_port', 'protocol', 'bytes', 'packets', 'start_time', 'end_time',
+    'tcp_flags', 'tos', 'input_interface', 'output_interface', 'capture_id',
+    'reverse_bytes', 'reverse_packets', 'reverse_tcp_flags'
+)
+
 @flow_analysis_bp.route('/flow-analysis')
 def flow_analysis():
     """Render the flow analysis page"""
@@ -19,10 +29,10 @@ def start_collector():
     """API endpoint to start the flow collector"""
     data = request.json
     flow_type = data.get('flow_type', 'netflow')  # netflow, ipfix, sflow
-    port = data.get('port', 9995)
+    port = int(data.get('port', 9995))
     
     try:
-        success = start_flow_collector(flow_type, port)
+        success = call_agent('start_collector', flow_type=flow_type, port=port)
         return jsonify({'success': success})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -31,27 +41,21 @@ def start_collector():
 def stop_collector():
     """API endpoint to stop the flow collector"""
     try:
-        success = stop_flow_collector()
+        success = call_agent('stop_collector')
         return jsonify({'success': success})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@flow_analysis_bp.route('/api/flow-analysis/flows')
-def get_flows():
-    """API endpoint to get flow records"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 50, type=int)
+def filter_flows(query):
+    """Apply the flow list filters from the request arguments to a query"""
     flow_type = request.args.get('flow_type', None)
     start_time = request.args.get('start_time', None)
     end_time = request.args.get('end_time', None)
     source_ip = request.args.get('source_ip', None)
     destination_ip = request.args.get('destination_ip', None)
     
-    # Build the query with filters
-    query = FlowRecord.query
-    
     if flow_type:
-        query = query.filter_by(flow_type=flow_type)
+        query = query.filter(FlowRecord.flow_type == flow_type)
     
     if start_time:
         start_dt = datetime.datetime.fromisoformat(start_time)
@@ -67,39 +71,45 @@ def get_flows():
     if destination_ip:
         query = query.filter(FlowRecord.destination_ip.like(f"%{destination_ip}%"))
     
+    return query
+
+@flow_analysis_bp.route('/api/flow-analysis/flows')
+def get_flows():
+    """API endpoint to get flow records"""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    response_format = negotiate_format()
+    
+    # Build the query with filters, over plain columns
+    query = filter_flows(db.session.query(*[getattr(FlowRecord, column) for column in FLOW_COLUMNS]))
+    
     # Order and paginate
     flows = query.order_by(FlowRecord.timestamp.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
     
-    # Format the flow data for the frontend
-    flow_list = []
-    for flow in flows.items:
-        flow_list.append({
-            'id': flow.id,
-            'timestamp': flow.timestamp.isoformat(),
-            'flow_type': flow.flow_type,
-            'source_ip': flow.source_ip,
-            'destination_ip': flow.destination_ip,
-            'source_port': flow.source_port,
-            'destination_port': flow.destination_port,
-            'protocol': flow.protocol,
-            'bytes': flow.bytes,
-            'packets': flow.packets,
-            'start_time': flow.start_time.isoformat() if flow.start_time else None,
-            'end_time': flow.end_time.isoformat() if flow.end_time else None,
-            'tcp_flags': flow.tcp_flags,
-            'tos': flow.tos,
-            'input_interface': flow.input_interface,
-            'output_interface': flow.output_interface
-        })
-    
-    return jsonify({
-        'flows': flow_list,
+    return send({
+        'flows': encode_table(FLOW_COLUMNS, flows.items, response_format,
+                              time_columns=('timestamp', 'start_time', 'end_time')),
         'total': flows.total,
         'pages': flows.pages,
         'current_page': flows.page
-    })
+    }, response_format)
+
+@flow_analysis_bp.route('/api/flow-analysis/export')
+def export_flows():
+    """API endpoint to stream the flow records matching the flow list filters as CSV or Parquet"""
+    export_format = request.args.get('format', 'csv')
+    
+    try:
+        check_export_format(export_format, allowed=('csv', 'parquet'))
+        query = filter_flows(db.session.query(*[getattr(FlowRecord, column) for column in FLOW_COLUMNS]))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    query = query.order_by(FlowRecord.timestamp.asc(), FlowRecord.id.asc())
+    chunks = stream_parquet(query) if export_format == 'parquet' else stream_csv(query)
+    return export_response(chunks, export_format, 'flows')
 
 @flow_analysis_bp.route('/api/flow-analysis/top-talkers')
 def top_talkers():
@@ -1,14 +1,34 @@
 """
 Packet analysis routes for Network Traffic Analysis Tool
 """
-from flask import Blueprint, render_template, jsonify, request
-from models import PacketCapture, Packet
-from utils.packet_capture import start_packet_capture, stop_packet_capture, get_packet_details
+from flask import Blueprint, render_template, jsonify, request, Response
+from models import PacketCapture, Packet, CaptureSegment, FlowRecord
+from utils.packet_capture import get_packet_details, get_capture_pcap_files
+from utils.agent_service import call_agent
+from utils.pcap_store import stream_pcap
+from utils.capture_filters import validate_capture_filter
+from utils.serialization import negotiate_format, encode_table, send
+from utils.export import check_export_format, stream_csv, stream_parquet, stream_frames, export_response
 from app import db
 import datetime
+import json
+import time
 
 packet_analysis_bp = Blueprint('packet_analysis', __name__)
 
+# Packet fields returned by the packet list
+PACKET_COLUMNS = (
+    'id', 'timestamp', 'protocol', 'source_ip', 'source_port', 'destination_ip',
+    'destination_port', 'length', 'info', 'tcp_flags'
+)
+
+# Conversation fields returned by the conversation list
+CONVERSATION_COLUMNS = (
+    'id', 'source_ip', 'source_port', 'destination_ip', 'destination_port', 'protocol',
+    'start_time', 'end_time', 'packets', 'bytes', 'reverse_packets', 'reverse_bytes',
+    'tcp_flags', 'reverse_tcp_flags'
+)
+
 @packet_analysis_bp.route('/packet-analysis')
 def packet_analysis():
     """Render the packet analysis page"""
@@ -22,23 +42,60 @@ def start_capture():
     data = request.json
     interface = data.get('interface')
     capture_name = data.get('name')
-    filter_expr = data.get('filter_expression', '')
+    filter_expr = data.get('capture_filter', data.get('filter_expression', ''))  # BPF, applied in the kernel
+    display_filter = data.get('display_filter', '')
     timeout = data.get('timeout', 60)  # default 60 seconds
+    continuous = bool(data.get('continuous', False))  # ring-buffer capture until stopped
+    segment_size_mb = data.get('segment_size_mb')
+    disk_budget_mb = data.get('disk_budget_mb')
+    sampling_mode = data.get('sampling_mode', 'none')  # none, systematic (1-in-N) or flow (hash)
+    sampling_rate = data.get('sampling_rate', 1)
+    snap_length = data.get('snap_length')
+    buffer_policy = data.get('buffer_policy')  # block, drop-newest or drop-oldest
+    store_packets = bool(data.get('store_packets', True))  # False keeps only flows
     
     if not interface or not capture_name:
         return jsonify({'success': False, 'error': 'Interface and name are required'}), 400
     
     try:
-        capture_id = start_packet_capture(interface, capture_name, filter_expr, timeout)
+        capture_id = call_agent(
+            'start_capture',
+            interface=interface,
+            name=capture_name,
+            filter_expr=filter_expr,
+            timeout=timeout,
+            continuous=continuous,
+            segment_size=int(float(segment_size_mb) * 1024 * 1024) if segment_size_mb else None,
+            disk_budget=int(float(disk_budget_mb) * 1024 * 1024) if disk_budget_mb else None,
+            display_filter=display_filter,
+            sampling_mode=sampling_mode,
+            sampling_rate=int(sampling_rate or 1),
+            snap_length=int(snap_length) if snap_length else None,
+            buffer_policy=buffer_policy,
+            store_packets=store_packets
+        )
         return jsonify({'success': True, 'capture_id': capture_id})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@packet_analysis_bp.route('/api/packet-analysis/validate-filter', methods=['POST'])
+def validate_filter():
+    """API endpoint to check that a BPF capture filter compiles"""
+    data = request.json or {}
+    
+    try:
+        instructions = validate_capture_filter(data.get('capture_filter', ''))
+        return jsonify({'success': True, 'instructions': instructions})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 @packet_analysis_bp.route('/api/packet-analysis/stop-capture/<int:capture_id>', methods=['POST'])
 def stop_capture(capture_id):
     """API endpoint to stop an active packet capture"""
     try:
-        success = stop_packet_capture(capture_id)
+        success = call_agent('stop_capture', capture_id=capture_id)
         return jsonify({'success': success})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -48,34 +105,21 @@ def get_packets(capture_id):
     """API endpoint to get packets from a specific capture"""
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 50, type=int)
+    response_format = negotiate_format()
     
-    # Pagination
-    packets = Packet.query.filter_by(capture_id=capture_id).order_by(
+    # Pagination over plain columns; no ORM objects are built for the page
+    packets = db.session.query(*[getattr(Packet, column) for column in PACKET_COLUMNS]).filter(
+        Packet.capture_id == capture_id
+    ).order_by(
         Packet.timestamp.desc()
     ).paginate(page=page, per_page=per_page, error_out=False)
     
-    # Format packet data for the frontend
-    packet_list = []
-    for packet in packets.items:
-        packet_list.append({
-            'id': packet.id,
-            'timestamp': packet.timestamp.isoformat(),
-            'protocol': packet.protocol,
-            'source_ip': packet.source_ip,
-            'source_port': packet.source_port,
-            'destination_ip': packet.destination_ip,
-            'destination_port': packet.destination_port,
-            'length': packet.length,
-            'info': packet.info,
-            'tcp_flags': packet.tcp_flags
-        })
-    
-    return jsonify({
-        'packets': packet_list,
+    return send({
+        'packets': encode_table(PACKET_COLUMNS, packets.items, response_format),
         'total': packets.total,
         'pages': packets.pages,
         'current_page': packets.page
-    })
+    }, response_format)
 
 @packet_analysis_bp.route('/api/packet-analysis/packet-details/<int:packet_id>')
 def packet_details(packet_id):
@@ -83,7 +127,7 @@ def packet_details(packet_id):
     # Get the packet from the database
     packet = Packet.query.get_or_404(packet_id)
     
-    # Get detailed packet information (this would typically involve examining the PCAP file)
+    # Get detailed packet information from the stored frame
     details = get_packet_details(packet)
     
     return jsonify({
@@ -105,9 +149,170 @@ def get_captures():
             'start_time': capture.start_time.isoformat(),
             'end_time': capture.end_time.isoformat() if capture.end_time else None,
             'packet_count': capture.packet_count,
+            'byte_count': capture.byte_count,
+            'protocol_counts': json.loads(capture.protocol_counts) if capture.protocol_counts else {},
+            'first_packet_time': capture.first_packet_time.isoformat() if capture.first_packet_time else None,
+            'last_packet_time': capture.last_packet_time.isoformat() if capture.last_packet_time else None,
             'filter_expression': capture.filter_expression,
+            'display_filter': capture.display_filter,
+            'packets_seen': capture.packets_seen,
+            'packets_delivered': capture.packets_delivered,
+            'sampling_mode': capture.sampling_mode,
+            'sampling_rate': capture.sampling_rate,
+            'snap_length': capture.snap_length,
+            'buffer_policy': capture.buffer_policy,
+            'store_packets': capture.store_packets is not False,
+            'kernel_drops': capture.kernel_drops,
+            'app_drops': capture.app_drops,
+            'worker_pid': capture.worker_pid,
+            'worker_cpu': capture.worker_cpu,
             'description': capture.description,
-            'active': capture.end_time is None
+            'active': capture.end_time is None,
+            'continuous': bool(capture.continuous)
         })
     
     return jsonify(capture_list)
+
+@packet_analysis_bp.route('/api/packet-analysis/workers')
+def get_capture_workers():
+    """API endpoint to get capture worker processes and their aggregate statistics"""
+    try:
+        return jsonify(call_agent('capture_workers'))
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@packet_analysis_bp.route('/api/packet-analysis/captures/<int:capture_id>/conversations')
+def get_conversations(capture_id):
+    """API endpoint to get the bidirectional conversations assembled from a capture"""
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 50, type=int)
+    sort = request.args.get('sort', 'start_time')  # start_time or bytes
+    response_format = negotiate_format()
+    
+    if sort == 'bytes':
+        order = (db.func.coalesce(FlowRecord.bytes, 0) + db.func.coalesce(FlowRecord.reverse_bytes, 0)).desc()
+    else:
+        order = FlowRecord.start_time.asc()
+    
+    conversations = db.session.query(*[getattr(FlowRecord, column) for column in CONVERSATION_COLUMNS]).filter(
+        FlowRecord.capture_id == capture_id
+    ).order_by(order, FlowRecord.id.asc()).paginate(page=page, per_page=per_page, error_out=False)
+    
+    return send({
+        'conversations': encode_table(CONVERSATION_COLUMNS, conversations.items, response_format,
+                                      time_columns=('start_time', 'end_time')),
+        'total': conversations.total,
+        'pages': conversations.pages,
+        'current_page': conversations.page
+    }, response_format)
+
+@packet_analysis_bp.route('/api/packet-analysis/captures/<int:capture_id>/conversations/rebuild', methods=['POST'])
+def rebuild_conversations(capture_id):
+    """API endpoint to reassemble a capture's conversations from its stored packets"""
+    capture = PacketCapture.query.get_or_404(capture_id)
+    if capture.end_time is None:
+        return jsonify({'success': False, 'error': 'Capture is still running'}), 400
+    
+    try:
+        flows = call_agent('assemble_flows', capture_id=capture_id)
+        return jsonify({'success': True, 'flows': flows})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@packet_analysis_bp.route('/api/packet-analysis/captures/<int:capture_id>/segments')
+def get_capture_segments(capture_id):
+    """API endpoint to get the retained pcap segments of a capture"""
+    capture = PacketCapture.query.get_or_404(capture_id)
+    
+    segments = CaptureSegment.query.filter_by(capture_id=capture_id).order_by(
+        CaptureSegment.sequence.asc()
+    ).all()
+    
+    segment_list = [
+        {
+            'sequence': segment.sequence,
+            'start_time': segment.start_time.isoformat() if segment.start_time else None,
+            'end_time': segment.end_time.isoformat() if segment.end_time else None,
+            'packet_count': segment.packet_count,
+            'byte_size': segment.byte_size,
+            'closed': segment.closed
+        } for segment in segments
+    ]
+    
+    return jsonify({
+        'capture_id': capture.id,
+        'continuous': bool(capture.continuous),
+        'segment_size': capture.segment_size,
+        'disk_budget': capture.disk_budget,
+        'retained_bytes': sum(segment.byte_size or 0 for segment in segments),
+        'segments': segment_list
+    })
+
+@packet_analysis_bp.route('/api/packet-analysis/captures/<int:capture_id>/pcap')
+def download_capture_pcap(capture_id):
+    """API endpoint to download a capture's frames as pcap, optionally only the last N minutes"""
+    capture = PacketCapture.query.get_or_404(capture_id)
+    minutes = request.args.get('minutes', None, type=float)
+    
+    start_time = None
+    start_timestamp = None
+    if minutes:
+        start_time = datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes)
+        start_timestamp = time.time() - minutes * 60
+    
+    paths = get_capture_pcap_files(capture, start_time)
+    if not paths:
+        return jsonify({'success': False, 'error': 'No stored frames for this capture'}), 404
+    
+    return Response(
+        stream_pcap(paths, start_timestamp),
+        mimetype='application/vnd.tcpdump.pcap',
+        headers={'Content-Disposition': f'attachment; filename=capture_{capture_id}.pcap'}
+    )
+
+
+@packet_analysis_bp.route('/api/packet-analysis/captures/<int:capture_id>/export')
+def export_capture(capture_id):
+    """API endpoint to stream a capture's packets as CSV, Parquet or pcap"""
+    capture = PacketCapture.query.get_or_404(capture_id)
+    export_format = request.args.get('format', 'csv')
+    protocol = request.args.get('protocol', None)
+    source_ip = request.args.get('source_ip', None)
+    destination_ip = request.args.get('destination_ip', None)
+    
+    try:
+        check_export_format(export_format)
+        start_time = request.args.get('start_time', None)
+        start_time = datetime.datetime.fromisoformat(start_time) if start_time else None
+        end_time = request.args.get('end_time', None)
+        end_time = datetime.datetime.fromisoformat(end_time) if end_time else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if export_format == 'pcap':
+        columns = [Packet.pcap_segment, Packet.pcap_offset]
+    else:
+        columns = [getattr(Packet, column) for column in PACKET_COLUMNS]
+    
+    # Filters, in capture order
+    query = db.session.query(*columns).filter(Packet.capture_id == capture_id)
+    if protocol:
+        query = query.filter(Packet.protocol == protocol)
+    if source_ip:
+        query = query.filter(Packet.source_ip == source_ip)
+    if destination_ip:
+        query = query.filter(Packet.destination_ip == destination_ip)
+    if start_time:
+        query = query.filter(Packet.timestamp >= start_time)
+    if end_time:
+        query = query.filter(Packet.timestamp <= end_time)
+    query = query.order_by(Packet.timestamp.asc(), Packet.id.asc())
+    
+    if export_format == 'pcap':
+        chunks = stream_frames(capture, query)
+    elif export_format == 'parquet':
+        chunks = stream_parquet(query)
+    else:
+        chunks = stream_csv(query)
+    
+    return export_response(chunks, export_format, f"capture_{capture_id}")
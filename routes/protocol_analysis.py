@@ -2,8 +2,11 @@
 Protocol analysis routes for Network Traffic Analysis Tool
 """
 from flask import Blueprint, render_template, jsonify, request
-from models import ProtocolDistribution, Packet
+from models import Packet
 from app import db
+from utils.metrics_store import get_metrics_store
+from utils.downsampling import downsample, DOWNSAMPLING_METHODS
+from config import Config
 import datetime
 
 protocol_analysis_bp = Blueprint('protocol_analysis', __name__)
@@ -31,23 +34,16 @@ def protocol_distribution():
     else:
         start_time = current_time - datetime.timedelta(hours=1)  # Default to 1 hour
     
-    # Get protocol distribution data
-    protocols = ProtocolDistribution.query.filter(
-        ProtocolDistribution.timestamp >= start_time
-    ).order_by(ProtocolDistribution.timestamp.desc()).all()
+    # Get protocol distribution totals, aggregated by the metrics store
+    protocols = get_metrics_store().summarize('protocol_distribution', start=start_time)
     
-    # Aggregate data by protocol
-    protocol_data = {}
-    for proto in protocols:
-        if proto.protocol not in protocol_data:
-            protocol_data[proto.protocol] = {
-                'packet_count': 0,
-                'byte_count': 0,
-                'percentage': 0.0
-            }
-        
-        protocol_data[proto.protocol]['packet_count'] += proto.packet_count
-        protocol_data[proto.protocol]['byte_count'] += proto.byte_count
+    protocol_data = {
+        proto['protocol']: {
+            'packet_count': proto['packet_count'] or 0,
+            'byte_count': proto['byte_count'] or 0,
+            'percentage': 0.0
+        } for proto in protocols
+    }
     
     # Calculate overall percentage
     total_bytes = sum(data['byte_count'] for data in protocol_data.values())
@@ -105,7 +101,7 @@ def tcp_flags_analysis():
             flags = packet.tcp_flags
             if flags not in flag_counts:
                 flag_counts[flags] = 0
-            flag_counts[flags] += 1
+            flag_counts[flags] += packet.sample_weight or 1
         
         # Format data for the frontend
         result = [
@@ -166,6 +162,10 @@ def protocol_over_time():
     try:
         time_range = request.args.get('time_range', '1h')  # 1h, 6h, 24h, 7d
         interval = request.args.get('interval', '5m')  # 1m, 5m, 10m, 30m, 1h
+        points = request.args.get('points', Config.MAX_CHART_POINTS, type=int)
+        method = request.args.get('downsample', 'lttb')  # lttb, minmax or none
+        if method not in DOWNSAMPLING_METHODS:
+            return jsonify({'success': False, 'error': f"Unknown downsampling method: {method}"}), 400
         
         # Convert time_range to a datetime
         current_time = datetime.datetime.utcnow()
@@ -198,34 +198,23 @@ def protocol_over_time():
             start_time = current_time - datetime.timedelta(hours=1)
             group_minutes = 5  # Default
         
-        # Query for protocol distribution data
-        protocols = ProtocolDistribution.query.filter(
-            ProtocolDistribution.timestamp >= start_time
-        ).order_by(ProtocolDistribution.timestamp.asc()).all()
+        # Protocol distribution bucketed by the metrics store
+        protocols = get_metrics_store().query(
+            'protocol_distribution', start=start_time, interval=group_minutes * 60
+        )
         
-        # Group data by time interval
+        # Group the buckets by time
         time_series = {}
         for proto in protocols:
-            # Round the timestamp to the nearest interval
-            rounded_time = proto.timestamp.replace(
-                second=0,
-                microsecond=0,
-                minute=(proto.timestamp.minute // group_minutes) * group_minutes
-            )
-            
-            time_key = rounded_time.isoformat()
+            time_key = proto['timestamp'].isoformat()
             
             if time_key not in time_series:
                 time_series[time_key] = {}
             
-            if proto.protocol not in time_series[time_key]:
-                time_series[time_key][proto.protocol] = {
-                    'packet_count': 0,
-                    'byte_count': 0
-                }
-            
-            time_series[time_key][proto.protocol]['packet_count'] += proto.packet_count
-            time_series[time_key][proto.protocol]['byte_count'] += proto.byte_count
+            time_series[time_key][proto['protocol']] = {
+                'packet_count': proto['packet_count'],
+                'byte_count': proto['byte_count']
+            }
         
         # Format data for the frontend
         result = []
@@ -259,6 +248,10 @@ def protocol_over_time():
         # Sort by timestamp
         result.sort(key=lambda x: x['timestamp'])
         
+        # Keep the shape of every protocol's series within the requested point count
+        protocol_names = {key for row in result for key in row if key != 'timestamp'}
+        result = downsample(result, sorted(protocol_names), points, method)
+        
         return jsonify({
             'time_series': result,
             'time_range': time_range,
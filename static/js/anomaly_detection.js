@@ -435,7 +435,7 @@ function loadAnomalies(page = 1) {
                         <td>${timeStr}</td>
                         <td>${anomaly.event_type}</td>
                         <td><span class="badge bg-${severityClass}"><i class="fas fa-${severityIcon} me-1"></i> ${severityLabel}</span></td>
-                        <td>${anomaly.description}</td>
+                        <td>${anomaly.description}${anomaly.occurrence_count > 1 ? ` <span class="badge bg-secondary">&times;${anomaly.occurrence_count}</span>` : ''}</td>
                         <td>${anomaly.source_ip || '-'}</td>
                         <td>${anomaly.destination_ip || '-'}</td>
                         <td>
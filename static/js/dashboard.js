@@ -265,11 +265,7 @@ function updateBandwidthChart(bandwidthData) {
     // Process and sort data chronologically
     bandwidthData.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
     
-    // Limit data points to prevent chart from becoming too crowded
-    const maxDataPoints = 20;
-    if (bandwidthData.length > maxDataPoints) {
-        bandwidthData = bandwidthData.slice(bandwidthData.length - maxDataPoints);
-    }
+    // The server already downsampled the series to the chart's point budget
     
     // Extract data for chart
     const labels = bandwidthData.map(d => {
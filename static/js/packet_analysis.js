@@ -163,6 +163,9 @@ function loadCaptures() {
                             <small>Interface: ${capture.interface} | Start: ${startTime} | End: ${endTime}</small>
                             <div>Packets: ${capture.packet_count.toLocaleString()}</div>
                             ${capture.filter_expression ? `<div class="text-muted small">Filter: ${capture.filter_expression}</div>` : ''}
+                            ${capture.display_filter ? `<div class="text-muted small">Display filter: ${capture.display_filter}</div>` : ''}
+                            ${capture.kernel_drops || capture.app_drops ? `<div class="text-warning small">Dropped: ${(capture.kernel_drops || 0).toLocaleString()} kernel, ${(capture.app_drops || 0).toLocaleString()} buffer</div>` : ''}
+                            ${capture.sampling_rate > 1 ? `<div class="text-muted small">Sampled 1 in ${capture.sampling_rate} (${capture.sampling_mode}), counts estimated</div>` : ''}
                         </div>
                         <div>
                             <button class="btn btn-sm btn-primary view-packets" title="View Packets">
@@ -229,7 +232,14 @@ function startCapture() {
     const interfaceEl = document.getElementById('capture-interface');
     const nameEl = document.getElementById('capture-name');
     const filterEl = document.getElementById('capture-filter');
+    const displayFilterEl = document.getElementById('display-filter');
     const timeoutEl = document.getElementById('capture-timeout');
+    const continuousEl = document.getElementById('capture-continuous');
+    const diskBudgetEl = document.getElementById('capture-disk-budget');
+    const samplingModeEl = document.getElementById('capture-sampling-mode');
+    const samplingRateEl = document.getElementById('capture-sampling-rate');
+    const snapLengthEl = document.getElementById('capture-snap-length');
+    const storePacketsEl = document.getElementById('capture-store-packets');
     
     startButton.disabled = true;
     startButton.innerHTML = '<span class="spinner-border spinner-border-sm"></span> Starting...';
@@ -253,8 +263,15 @@ function startCapture() {
     const data = {
         interface: interface,
         name: name,
-        filter_expression: filter,
-        timeout: timeout
+        capture_filter: filter,
+        display_filter: displayFilterEl ? displayFilterEl.value : '',
+        timeout: timeout,
+        continuous: continuousEl ? continuousEl.checked : false,
+        disk_budget_mb: diskBudgetEl ? parseFloat(diskBudgetEl.value) : null,
+        sampling_mode: samplingModeEl ? samplingModeEl.value : 'none',
+        sampling_rate: samplingRateEl ? parseInt(samplingRateEl.value) || 1 : 1,
+        snap_length: snapLengthEl && snapLengthEl.value ? parseInt(snapLengthEl.value) : null,
+        store_packets: storePacketsEl ? storePacketsEl.checked : true
     };
     
     // Show loading state
@@ -280,6 +297,7 @@ function startCapture() {
             // Reset form
             nameEl.value = '';
             filterEl.value = '';
+            if (displayFilterEl) displayFilterEl.value = '';
             
             // Reload captures list
             loadCaptures();
@@ -691,9 +709,13 @@ function filterPackets() {
 
 // Export packets to file
 function exportPackets() {
-    // This would typically download a PCAP file or CSV
-    // For now, just show a message
-    showAlert('Export functionality is not implemented in this version', 'info');
+    if (!currentCaptureId) {
+        showAlert('Select a capture to export', 'warning');
+        return;
+    }
+    
+    // Streamed by the server as CSV; use format=pcap or format=parquet for other formats
+    window.location.href = `/api/packet-analysis/captures/${currentCaptureId}/export?format=csv`;
 }
 
 // Show alert message
@@ -0,0 +1,160 @@
+"""
+Local RPC between the web app and the NativeProbe agent
+
+Each request is one connection carrying a single line of JSON,
+{"method": ..., "params": {...}}, answered by one line of JSON holding
+either "result" or "error". A Unix domain socket is used where the
+platform has one, otherwise TCP on localhost.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from config import Config
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+# Exception types re-raised as themselves on the client; anything else becomes AgentError
+REMOTE_EXCEPTIONS = {
+    'ValueError': ValueError,
+    'KeyError': KeyError,
+    'PermissionError': PermissionError
+}
+
+class AgentError(RuntimeError):
+    """The agent failed to carry out a request"""
+
+class AgentUnavailable(ConnectionError):
+    """The agent is not running or not reachable"""
+
+def use_unix_socket():
+    """Whether the agent listens on a Unix domain socket"""
+    return hasattr(socket, 'AF_UNIX')
+
+def read_message(conn):
+    """Read one newline-terminated JSON message"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if chunk.endswith(b'\n'):
+            break
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError("RPC message too large")
+    if not chunks:
+        return None
+    return json.loads(b''.join(chunks))
+
+def send_message(conn, message):
+    """Write one JSON message followed by a newline"""
+    conn.sendall(json.dumps(message, default=str).encode() + b'\n')
+
+class AgentServer:
+    """Serve RPC methods to local clients, one thread per connection"""
+
+    def __init__(self, methods, context=None):
+        self.methods = methods
+        self.context = context  # Callable returning a context manager entered per request
+        self.sock = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """Bind the listening socket and start accepting connections"""
+        if use_unix_socket():
+            path = Config.AGENT_SOCKET
+            if os.path.exists(path):
+                os.remove(path)  # Stale socket from a previous run
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.bind(path)
+            os.chmod(path, 0o600)
+            logger.info(f"Agent listening on {path}")
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(('127.0.0.1', Config.AGENT_PORT))
+            logger.info(f"Agent listening on 127.0.0.1:{Config.AGENT_PORT}")
+        self.sock.listen(64)
+        self.running = True
+
+        self.thread = threading.Thread(target=self._accept_loop, name='agent-rpc')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop accepting connections and remove the socket file"""
+        self.running = False
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+        if use_unix_socket() and os.path.exists(Config.AGENT_SOCKET):
+            os.remove(Config.AGENT_SOCKET)
+
+    def _accept_loop(self):
+        """Accept connections until stopped"""
+        while self.running:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            handler = threading.Thread(target=self._handle, args=(conn,))
+            handler.daemon = True
+            handler.start()
+
+    def _handle(self, conn):
+        """Answer one request"""
+        with conn:
+            try:
+                request = read_message(conn)
+                if request is None:
+                    return
+                method = self.methods.get(request.get('method'))
+                if method is None:
+                    raise KeyError(f"Unknown agent method '{request.get('method')}'")
+                params = request.get('params') or {}
+                if self.context:
+                    with self.context():
+                        result = method(**params)
+                else:
+                    result = method(**params)
+                send_message(conn, {'result': result})
+            except Exception as e:
+                logger.error(f"Agent request failed: {e}")
+                try:
+                    send_message(conn, {'error': str(e), 'type': type(e).__name__})
+                except OSError:
+                    pass
+
+def call(method, params=None, timeout=None):
+    """Call a method on the agent with a dict of keyword arguments and return its result"""
+    try:
+        if use_unix_socket():
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = Config.AGENT_SOCKET
+        else:
+            conn = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = ('127.0.0.1', Config.AGENT_PORT)
+        conn.settimeout(timeout or Config.AGENT_RPC_TIMEOUT)
+        conn.connect(address)
+    except OSError as e:
+        raise AgentUnavailable(f"NativeProbe agent is not running ({e})")
+
+    with conn:
+        send_message(conn, {'method': method, 'params': params or {}})
+        response = read_message(conn)
+
+    if response is None:
+        raise AgentError(f"No response from agent for '{method}'")
+    if 'error' in response:
+        exception = REMOTE_EXCEPTIONS.get(response.get('type'), AgentError)
+        raise exception(response['error'])
+    return response.get('result')
@@ -0,0 +1,187 @@
+"""
+Agent service: the data-plane operations owned by the NativeProbe agent
+
+Packet capture, flow collection, anomaly detection and their maintenance
+run in exactly one process. With AGENT_MODE 'remote' that is the separate
+agent (agent.py) and the web app reaches these methods over RPC; with
+'embedded' they run inside the web process, as a single-process install.
+"""
+import os
+import time
+import logging
+import threading
+from config import Config
+from utils import agent_rpc
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+started_at = time.time()
+maintenance_thread = None
+
+def agent_ping():
+    """Identify the process serving agent requests"""
+    return {'pid': os.getpid(), 'mode': Config.AGENT_MODE, 'uptime': round(time.time() - started_at, 1)}
+
+def agent_status():
+    """Summary of everything the agent is running"""
+    from utils.capture_manager import get_worker_status
+    from utils.flow_analysis import get_flow_collector_status
+    from utils.anomaly_detection import get_detector_statistics, detector_scheduler
+    from utils.bandwidth import get_bandwidth_sampler
+    from utils.packet_capture import get_flow_export_status
+    return {
+        'agent': agent_ping(),
+        'captures': get_worker_status(),
+        'flow_collector': get_flow_collector_status(),
+        'flow_export': get_flow_export_status(),
+        'anomaly_detection': {
+            'running': bool(detector_scheduler and detector_scheduler.is_running()),
+            'detectors': get_detector_statistics()
+        },
+        'bandwidth': get_bandwidth_sampler().get_statistics()
+    }
+
+def agent_start_capture(interface, name, filter_expr='', timeout=60, **options):
+    """Start a capture and return its id"""
+    from utils.capture_manager import start_capture
+    return start_capture(interface, name, filter_expr, timeout, **options)
+
+def agent_stop_capture(capture_id):
+    """Stop a capture"""
+    from utils.capture_manager import stop_capture
+    return stop_capture(capture_id)
+
+def agent_capture_workers():
+    """Capture worker status"""
+    from utils.capture_manager import get_worker_status
+    return get_worker_status()
+
+def agent_start_collector(flow_type='netflow', port=9995):
+    """Start the flow collector"""
+    from utils.flow_analysis import start_flow_collector
+    return start_flow_collector(flow_type, port)
+
+def agent_stop_collector():
+    """Stop the flow collector"""
+    from utils.flow_analysis import stop_flow_collector
+    return stop_flow_collector()
+
+def agent_start_detection(method='statistical', sensitivity=3.0):
+    """Start anomaly detection"""
+    from utils.anomaly_detection import start_anomaly_detection
+    return start_anomaly_detection(method, sensitivity)
+
+def agent_stop_detection():
+    """Stop anomaly detection"""
+    from utils.anomaly_detection import stop_anomaly_detection
+    return stop_anomaly_detection()
+
+def agent_detector_statistics():
+    """Per-detector run statistics"""
+    from utils.anomaly_detection import get_detector_statistics
+    return get_detector_statistics()
+
+def agent_forget_anomaly(anomaly_id):
+    """Drop a resolved anomaly from the deduplication index"""
+    from utils.anomaly_detection import forget_anomaly_event
+    forget_anomaly_event(anomaly_id)
+    return True
+
+def agent_train_model(days=None):
+    """Train the machine-learning model"""
+    from utils.ml_detection import train_model
+    return train_model(days)
+
+def agent_model_statistics():
+    """Machine-learning model statistics"""
+    from utils.ml_detection import get_model_statistics
+    return get_model_statistics()
+
+def agent_assemble_flows(capture_id):
+    """Rebuild a capture's conversations from its stored packets"""
+    from utils.flow_assembly import assemble_capture_flows
+    return assemble_capture_flows(capture_id)
+
+def agent_live_bandwidth(interface=None, limit=None):
+    """Recent bandwidth samples from the sampler's in-memory rings"""
+    from utils.bandwidth import get_live_bandwidth
+    return get_live_bandwidth(interface, limit)
+
+def agent_syn_tracker(min_syns=1):
+    """Live per-destination TCP handshake statistics, including those reported by capture workers"""
+    from utils.capture_manager import get_tcp_handshakes
+    return get_tcp_handshakes(min_syns=min_syns)
+
+AGENT_METHODS = {
+    'ping': agent_ping,
+    'status': agent_status,
+    'start_capture': agent_start_capture,
+    'stop_capture': agent_stop_capture,
+    'capture_workers': agent_capture_workers,
+    'start_collector': agent_start_collector,
+    'stop_collector': agent_stop_collector,
+    'start_detection': agent_start_detection,
+    'stop_detection': agent_stop_detection,
+    'detector_statistics': agent_detector_statistics,
+    'forget_anomaly': agent_forget_anomaly,
+    'train_model': agent_train_model,
+    'model_statistics': agent_model_statistics,
+    'syn_tracker': agent_syn_tracker,
+    'live_bandwidth': agent_live_bandwidth,
+    'assemble_flows': agent_assemble_flows
+}
+
+# Methods that may legitimately run for minutes
+SLOW_METHODS = {
+    'train_model': 600,
+    'assemble_flows': 600,
+    'stop_capture': Config.CAPTURE_WORKER_STOP_TIMEOUT + Config.AGENT_RPC_TIMEOUT
+}
+
+def call_agent(name, /, **params):
+    """Run an agent method, over RPC or in this process depending on AGENT_MODE"""
+    if Config.AGENT_MODE == 'remote':
+        return agent_rpc.call(name, params, timeout=SLOW_METHODS.get(name))
+    return AGENT_METHODS[name](**params)
+
+def maintenance_loop():
+    """Close stale captures, reap dead capture workers and apply metrics retention"""
+    from app import app
+    from utils.packet_capture import cleanup_stale_captures
+    from utils.capture_manager import reap_dead_workers
+    from utils.metrics_store import get_metrics_store
+
+    last_cleanup = time.monotonic()
+    last_retention = None
+    while True:
+        time.sleep(Config.AGENT_MAINTENANCE_INTERVAL)
+        try:
+            with app.app_context():
+                reaped = reap_dead_workers()
+                if reaped:
+                    logger.info(f"Closed {reaped} captures whose worker exited")
+            if time.monotonic() - last_cleanup >= Config.CAPTURE_CLEANUP_INTERVAL:
+                last_cleanup = time.monotonic()
+                cleanup_stale_captures()
+            if last_retention is None or time.monotonic() - last_retention >= Config.METRICS_MAINTENANCE_INTERVAL:
+                last_retention = time.monotonic()
+                with app.app_context():
+                    compacted = get_metrics_store().apply_retention()
+                if compacted:
+                    logger.info(f"Downsampled metrics to {compacted} points")
+        except Exception as e:
+            logger.error(f"Error in agent maintenance: {e}")
+
+def start_maintenance():
+    """Start the maintenance loop and bandwidth sampler once per process"""
+    from utils.bandwidth import start_bandwidth_sampler
+    global maintenance_thread
+    if maintenance_thread and maintenance_thread.is_alive():
+        return False
+    start_bandwidth_sampler()
+    maintenance_thread = threading.Thread(target=maintenance_loop, name='agent-maintenance')
+    maintenance_thread.daemon = True
+    maintenance_thread.start()
+    return True
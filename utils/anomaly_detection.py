@@ -3,295 +3,369 @@ Anomaly detection utility functions
 """
 import logging
 import threading
-import time
 import datetime
 import statistics
-import numpy as np
 from app import db, app
-from models import AnomalyEvent, BandwidthUsage, FlowRecord, Packet
+from config import Config
+from models import AnomalyEvent, FlowRecord, Packet, Settings
+from utils.detector_scheduler import DetectorScheduler
+from utils.anomaly_statistics import adjust_anomaly_counters, count_new_events, reconcile_anomaly_counters
+from utils.tcp_tracker import find_syn_floods
+from utils.capture_manager import get_tcp_handshakes
+from utils.db_writer import submit_write
+from utils.bulk_loader import bulk_insert
+from utils.metrics_store import get_metrics_store
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 # Global variables
-detector_thread = None
-stop_detector = False
+detector_scheduler = None
 detection_method = 'statistical'
 sensitivity = 3.0  # Default: 3.0 standard deviations
 
+# Per-thread counters for the detector run in progress
+run_context = threading.local()
+
+# Anomaly dedup index: (event_type, source, destination, signature) -> entry
+anomaly_index = {}
+anomaly_index_lock = threading.Lock()
+anomaly_index_loaded = False
+pending_anomalies = []  # New event rows waiting for a batched insert
+
+# Detectors run by the scheduler, each on its own interval
+DETECTORS = {
+    'bandwidth': lambda now: detect_bandwidth_anomalies(now),
+    'protocol': lambda now: detect_protocol_anomalies(now),
+    'connection': lambda now: detect_connection_anomalies(now),
+    'syn_flood': lambda now: detect_syn_floods(),
+    'flow': lambda now: detect_flow_anomalies(now),
+    'machine_learning': lambda now: detect_ml_anomalies(now)
+}
+
+def get_detector_interval(name):
+    """Get a detector's interval in seconds
+
+    Order of precedence: the `anomaly_interval_<name>` setting, the
+    per-detector configuration override, the `anomaly_check_interval`
+    setting, then Config.ANOMALY_CHECK_INTERVAL.
+    """
+    settings = {}
+    try:
+        settings = {
+            setting.key: setting.value
+            for setting in Settings.query.filter(
+                Settings.key.in_(['anomaly_check_interval', f'anomaly_interval_{name}'])
+            ).all()
+        }
+    except Exception as e:
+        logger.error(f"Error reading interval settings for detector {name}: {e}")
+    
+    for value in (settings.get(f'anomaly_interval_{name}'),
+                  Config.ANOMALY_DETECTOR_INTERVALS.get(name),
+                  settings.get('anomaly_check_interval')):
+        try:
+            if value:
+                return float(value)
+        except ValueError:
+            logger.warning(f"Ignoring invalid interval {value!r} for detector {name}")
+    
+    return Config.ANOMALY_CHECK_INTERVAL
+
+def run_detector(func):
+    """Run one detector with an app context and report (rows scanned, new events)
+
+    Exceptions, including a failed insert of the run's events, propagate to
+    the scheduler, which counts them as errors.
+    """
+    run_context.events = 0
+    with app.app_context():
+        rows_scanned = func(datetime.datetime.utcnow())
+        flush_anomaly_events()
+    return rows_scanned or 0, run_context.events
+
 def start_anomaly_detection(method='statistical', sens=3.0):
     """Start anomaly detection"""
-    global detector_thread, stop_detector, detection_method, sensitivity
+    global detector_scheduler, detection_method, sensitivity
     
-    if detector_thread and detector_thread.is_alive():
+    if detector_scheduler and detector_scheduler.is_running():
         logger.warning("Anomaly detection already running")
         return False
     
-    if detector_thread and detector_thread.is_alive():
-        logger.warning("Anomaly detection already running")
-        return False
-    
-    stop_detector = False
     detection_method = method
     sensitivity = sens
     
-    def detector_loop():
-        global stop_detector
-        
-        try:
-            logger.info(f"Started anomaly detection with method: {detection_method}, sensitivity: {sensitivity}")
-            
-            while not stop_detector:
-                try:
-                    # Detect anomalies with Flask application context
-                    with app.app_context():
-                        detect_anomalies()
-                    
-                    # Sleep for a while
-                    time.sleep(300)  # Check every 5 minutes
-                
-                except Exception as e:
-                    logger.error(f"Error in anomaly detection: {e}")
-                    time.sleep(60)  # Sleep on error
-            
-            logger.info("Anomaly detection stopped")
-        
-        except Exception as e:
-            logger.error(f"Error in detector thread: {e}")
+    scheduler = DetectorScheduler(max_workers=Config.ANOMALY_DETECTOR_WORKERS)
+    for name, func in DETECTORS.items():
+        if name == 'machine_learning' and detection_method != 'machine-learning':
+            continue
+        scheduler.register(
+            name,
+            lambda func=func: run_detector(func),
+            interval=get_detector_interval(name),
+            timeout=Config.ANOMALY_DETECTOR_TIMEOUT
+        )
     
-    # Start detector thread
-    detector_thread = threading.Thread(target=detector_loop)
-    detector_thread.daemon = True
-    detector_thread.start()
+    # Periodically rebuild the statistics counters to correct any drift
+    scheduler.register(
+        'statistics_reconcile',
+        lambda: run_detector(lambda now: reconcile_anomaly_counters()),
+        interval=Config.ANOMALY_STATS_RECONCILE_INTERVAL,
+        timeout=Config.ANOMALY_DETECTOR_TIMEOUT
+    )
     
+    scheduler.start()
+    detector_scheduler = scheduler
+    
+    logger.info(f"Started anomaly detection with method: {detection_method}, sensitivity: {sensitivity}")
     return True
 
 def stop_anomaly_detection():
     """Stop anomaly detection"""
-    global stop_detector, detector_thread
+    global detector_scheduler
     
-    if not detector_thread or not detector_thread.is_alive():
+    if not detector_scheduler or not detector_scheduler.is_running():
         logger.warning("Anomaly detection not running")
         return False
     
-    stop_detector = True
-    detector_thread.join(timeout=5.0)
-    
-    if detector_thread.is_alive():
-        logger.warning("Anomaly detector thread did not stop gracefully")
-    else:
+    if detector_scheduler.stop(timeout=5.0):
         logger.info("Anomaly detector stopped successfully")
+    else:
+        logger.warning("Anomaly detector scheduler did not stop gracefully")
     
-    detector_thread = None
+    detector_scheduler = None
     return True
 
+def get_detector_statistics():
+    """Get run statistics for each scheduled detector"""
+    if not detector_scheduler:
+        return {}
+    return detector_scheduler.get_statistics()
+
 def detect_anomalies():
-    """Detect anomalies in network traffic"""
-    # Get current time
+    """Run every detector once in turn; a failing detector doesn't stop the others"""
     current_time = datetime.datetime.utcnow()
     
-    # Check for bandwidth anomalies
-    detect_bandwidth_anomalies(current_time)
-    
-    # Check for protocol anomalies
-    detect_protocol_anomalies(sensitivity)
-    
-    # Check for connection anomalies
-    detect_connection_anomalies(current_time)
+    for name, func in DETECTORS.items():
+        # Score hosts against the trained model only in machine-learning mode
+        if name == 'machine_learning' and detection_method != 'machine-learning':
+            continue
+        try:
+            func(current_time)
+        except Exception as e:
+            logger.error(f"Error in anomaly detector {name}: {e}")
     
-    # Check for flow anomalies
-    detect_flow_anomalies(current_time)
+    # Write new events and repeat counts in one batch
+    flush_anomaly_events()
 
 def detect_bandwidth_anomalies(current_time):
     """Detect anomalies in bandwidth usage"""
-    try:
-        # Get bandwidth data for the last 24 hours
-        past_day = current_time - datetime.timedelta(hours=24)
-        bandwidth_data = BandwidthUsage.query.filter(
-            BandwidthUsage.timestamp >= past_day
-        ).order_by(BandwidthUsage.timestamp.asc()).all()
+    # Get bandwidth data for the last 24 hours
+    past_day = current_time - datetime.timedelta(hours=24)
+    bandwidth_data = get_metrics_store().query('bandwidth', start=past_day)
+    
+    if not bandwidth_data or len(bandwidth_data) < 10:
+        logger.info("Not enough bandwidth data for anomaly detection")
+        return len(bandwidth_data)
+    
+    # Analyze each interface
+    interfaces = set(data['interface'] for data in bandwidth_data)
+    
+    for interface in interfaces:
+        interface_data = [data for data in bandwidth_data if data['interface'] == interface]
         
-        if not bandwidth_data or len(bandwidth_data) < 10:
-            logger.info("Not enough bandwidth data for anomaly detection")
-            return
+        # Extract bytes in/out data
+        bytes_in = [data['bytes_in'] for data in interface_data]
+        bytes_out = [data['bytes_out'] for data in interface_data]
         
-        # Analyze each interface
-        interfaces = set(data.interface for data in bandwidth_data)
+        # Calculate statistics
+        mean_in = statistics.mean(bytes_in)
+        stdev_in = statistics.stdev(bytes_in) if len(bytes_in) > 1 else 0
         
-        for interface in interfaces:
-            interface_data = [data for data in bandwidth_data if data.interface == interface]
-            
-            # Extract bytes in/out data
-            bytes_in = [data.bytes_in for data in interface_data]
-            bytes_out = [data.bytes_out for data in interface_data]
-            
-            # Calculate statistics
-            mean_in = statistics.mean(bytes_in)
-            stdev_in = statistics.stdev(bytes_in) if len(bytes_in) > 1 else 0
-            
-            mean_out = statistics.mean(bytes_out)
-            stdev_out = statistics.stdev(bytes_out) if len(bytes_out) > 1 else 0
-            
-            # Check the latest data point
-            latest = interface_data[-1]
-            
-            # Check for anomalies in bytes in
-            if stdev_in > 0 and abs(latest.bytes_in - mean_in) > sensitivity * stdev_in:
-                # Anomaly detected
-                create_anomaly_event(
-                    'Bandwidth Anomaly',
-                    f"Unusual incoming traffic on interface {interface}: {latest.bytes_in} bytes "
-                    f"(mean: {mean_in:.2f}, threshold: {mean_in + sensitivity * stdev_in:.2f})",
-                    severity=calculate_severity(latest.bytes_in, mean_in, stdev_in)
-                )
-            
-            # Check for anomalies in bytes out
-            if stdev_out > 0 and abs(latest.bytes_out - mean_out) > sensitivity * stdev_out:
-                # Anomaly detected
-                create_anomaly_event(
-                    'Bandwidth Anomaly',
-                    f"Unusual outgoing traffic on interface {interface}: {latest.bytes_out} bytes "
-                    f"(mean: {mean_out:.2f}, threshold: {mean_out + sensitivity * stdev_out:.2f})",
-                    severity=calculate_severity(latest.bytes_out, mean_out, stdev_out)
-                )
+        mean_out = statistics.mean(bytes_out)
+        stdev_out = statistics.stdev(bytes_out) if len(bytes_out) > 1 else 0
+        
+        # Check the latest data point
+        latest = interface_data[-1]
+        
+        # Check for anomalies in bytes in
+        if stdev_in > 0 and abs(latest['bytes_in'] - mean_in) > sensitivity * stdev_in:
+            # Anomaly detected
+            create_anomaly_event(
+                'Bandwidth Anomaly',
+                f"Unusual incoming traffic on interface {interface}: {latest['bytes_in']} bytes "
+                f"(mean: {mean_in:.2f}, threshold: {mean_in + sensitivity * stdev_in:.2f})",
+                severity=calculate_severity(latest['bytes_in'], mean_in, stdev_in),
+                signature=f"bandwidth-in:{interface}"
+            )
+        
+        # Check for anomalies in bytes out
+        if stdev_out > 0 and abs(latest['bytes_out'] - mean_out) > sensitivity * stdev_out:
+            # Anomaly detected
+            create_anomaly_event(
+                'Bandwidth Anomaly',
+                f"Unusual outgoing traffic on interface {interface}: {latest['bytes_out']} bytes "
+                f"(mean: {mean_out:.2f}, threshold: {mean_out + sensitivity * stdev_out:.2f})",
+                severity=calculate_severity(latest['bytes_out'], mean_out, stdev_out),
+                signature=f"bandwidth-out:{interface}"
+            )
     
-    except Exception as e:
-        logger.error(f"Error detecting bandwidth anomalies: {e}")
+    return len(bandwidth_data)
 
 def detect_protocol_anomalies(current_time):
     """Detect anomalies in protocol distribution"""
-    try:
-        # Get protocol distribution for the last 24 hours
-        past_day = current_time - datetime.timedelta(hours=24)
-        
-        # Get protocol counts
-        protocol_counts = db.session.query(
-            Packet.protocol,
-            db.func.count().label('count')
-        ).filter(
-            Packet.timestamp >= past_day,
-            Packet.protocol != None
-        ).group_by(Packet.protocol).all()
-        
-        if not protocol_counts or len(protocol_counts) < 3:
-            logger.info("Not enough protocol data for anomaly detection")
-            return
-        
-        # Calculate total packets
-        total_packets = sum(pc.count for pc in protocol_counts)
+    # Get protocol distribution for the last 24 hours
+    past_day = current_time - datetime.timedelta(hours=24)
+    
+    # Get protocol counts
+    protocol_counts = db.session.query(
+        Packet.protocol,
+        db.func.sum(Packet.sample_weight).label('count')
+    ).filter(
+        Packet.timestamp >= past_day,
+        Packet.protocol != None
+    ).group_by(Packet.protocol).all()
+    
+    # Calculate total packets
+    total_packets = sum(pc.count for pc in protocol_counts)
+    
+    if not protocol_counts or len(protocol_counts) < 3:
+        logger.info("Not enough protocol data for anomaly detection")
+        return total_packets
+    
+    # Calculate expected percentage for each protocol
+    for protocol in protocol_counts:
+        percentage = (protocol.count / total_packets) * 100
         
-        # Calculate expected percentage for each protocol
-        for protocol in protocol_counts:
-            percentage = (protocol.count / total_packets) * 100
-            
-            # Check for unusual protocol distribution
-            # For simplicity, flag if any protocol exceeds 80% of traffic
-            if percentage > 80:
-                create_anomaly_event(
-                    'Protocol Anomaly',
-                    f"Unusual amount of {protocol.protocol} traffic: {percentage:.2f}% of total traffic",
-                    severity=3 if percentage > 90 else 2
-                )
+        # Check for unusual protocol distribution
+        # For simplicity, flag if any protocol exceeds 80% of traffic
+        if percentage > 80:
+            create_anomaly_event(
+                'Protocol Anomaly',
+                f"Unusual amount of {protocol.protocol} traffic: {percentage:.2f}% of total traffic",
+                severity=3 if percentage > 90 else 2,
+                signature=f"protocol-share:{protocol.protocol}"
+            )
     
-    except Exception as e:
-        logger.error(f"Error detecting protocol anomalies: {e}")
+    return total_packets
 
 def detect_connection_anomalies(current_time):
     """Detect anomalies in connection patterns"""
-    try:
-        # Get TCP connection data for the last hour
-        past_hour = current_time - datetime.timedelta(hours=1)
-        
-        # Count TCP flags
-        flag_counts = db.session.query(
-            Packet.tcp_flags,
-            db.func.count().label('count')
-        ).filter(
-            Packet.timestamp >= past_hour,
-            Packet.protocol == 'TCP',
-            Packet.tcp_flags != None
-        ).group_by(Packet.tcp_flags).all()
-        
-        if not flag_counts:
-            logger.info("Not enough TCP flag data for anomaly detection")
-            return
-        
-        # Look for unusual flag patterns
-        
-        # Check for SYN flood (many SYN flags without corresponding SYN-ACK)
-        syn_count = sum(fc.count for fc in flag_counts if fc.tcp_flags == 'S')
-        synack_count = sum(fc.count for fc in flag_counts if fc.tcp_flags == 'SA')
-        
-        if syn_count > 0 and synack_count > 0:
-            syn_to_synack_ratio = syn_count / synack_count
-            
-            # If we have many more SYNs than SYN-ACKs, it might indicate a SYN flood
-            if syn_to_synack_ratio > 3:
-                create_anomaly_event(
-                    'TCP Flag Anomaly',
-                    f"Possible SYN flood attack detected: SYN to SYN-ACK ratio is {syn_to_synack_ratio:.2f}",
-                    severity=4 if syn_to_synack_ratio > 10 else 3
-                )
-        
-        # Check for many RST flags, which might indicate port scanning or connection issues
-        rst_count = sum(fc.count for fc in flag_counts if 'R' in fc.tcp_flags)
-        total_count = sum(fc.count for fc in flag_counts)
+    # Get TCP connection data for the last hour
+    past_hour = current_time - datetime.timedelta(hours=1)
+    
+    # Count TCP flags
+    flag_counts = db.session.query(
+        Packet.tcp_flags,
+        db.func.sum(Packet.sample_weight).label('count')
+    ).filter(
+        Packet.timestamp >= past_hour,
+        Packet.protocol == 'TCP',
+        Packet.tcp_flags != None
+    ).group_by(Packet.tcp_flags).all()
+    
+    if not flag_counts:
+        logger.info("Not enough TCP flag data for anomaly detection")
+        return
+    
+    # Look for unusual flag patterns
+    
+    # Check for many RST flags, which might indicate port scanning or connection issues
+    rst_count = sum(fc.count for fc in flag_counts if 'R' in fc.tcp_flags)
+    total_count = sum(fc.count for fc in flag_counts)
+    
+    if total_count > 0:
+        rst_percentage = (rst_count / total_count) * 100
         
-        if total_count > 0:
-            rst_percentage = (rst_count / total_count) * 100
-            
-            if rst_percentage > 30:
-                create_anomaly_event(
-                    'TCP Flag Anomaly',
-                    f"High rate of RST flags ({rst_percentage:.2f}% of TCP packets), "
-                    f"possible port scanning or connection issues",
-                    severity=3 if rst_percentage > 50 else 2
-                )
+        if rst_percentage > 30:
+            create_anomaly_event(
+                'TCP Flag Anomaly',
+                f"High rate of RST flags ({rst_percentage:.2f}% of TCP packets), "
+                f"possible port scanning or connection issues",
+                severity=3 if rst_percentage > 50 else 2,
+                signature="rst-rate"
+            )
     
-    except Exception as e:
-        logger.error(f"Error detecting connection anomalies: {e}")
+    return total_count
+
+def detect_syn_floods():
+    """Report destinations with SYN flood handshake patterns, across all running captures"""
+    handshakes = get_tcp_handshakes(min_syns=Config.SYN_FLOOD_MIN_SYNS)
+    for victim in find_syn_floods(handshakes['destinations']):
+        ratio = victim['completion_ratio']
+        create_anomaly_event(
+            'SYN Flood',
+            f"Possible SYN flood against {victim['destination_ip']}: "
+            f"{victim['half_open']} half-open connections, "
+            f"{ratio * 100:.1f}% of {max(victim['syns'], victim['last_window_syns'])} handshakes completed",
+            severity=5 if ratio < 0.05 else 4,
+            destination_ip=victim['destination_ip'],
+            signature="syn-flood"
+        )
+    
+    return handshakes['tracker']['tracked_destinations']
 
 def detect_flow_anomalies(current_time):
     """Detect anomalies in flow records"""
-    try:
-        # Get flow data for the last 24 hours
-        past_day = current_time - datetime.timedelta(hours=24)
-        
-        # Get top source IPs by flow count
-        top_sources = db.session.query(
-            FlowRecord.source_ip,
-            db.func.count().label('flow_count')
-        ).filter(
-            FlowRecord.timestamp >= past_day
-        ).group_by(FlowRecord.source_ip).order_by(
-            db.desc('flow_count')
-        ).limit(10).all()
-        
-        if not top_sources:
-            logger.info("Not enough flow data for anomaly detection")
-            return
-        
-        # Calculate average flow count
-        avg_flow_count = db.session.query(
-            db.func.avg(db.func.count())
-        ).filter(
-            FlowRecord.timestamp >= past_day
-        ).group_by(FlowRecord.source_ip).scalar() or 0
-        
-        # Check for IPs with unusually high flow counts
-        for source in top_sources:
-            if source.flow_count > avg_flow_count * 5:
-                create_anomaly_event(
-                    'Flow Anomaly',
-                    f"Host {source.source_ip} has an unusually high number of flows: "
-                    f"{source.flow_count} (average: {avg_flow_count:.2f})",
-                    severity=3 if source.flow_count > avg_flow_count * 10 else 2,
-                    source_ip=source.source_ip
-                )
+    # Get flow data for the last 24 hours
+    past_day = current_time - datetime.timedelta(hours=24)
     
-    except Exception as e:
-        logger.error(f"Error detecting flow anomalies: {e}")
+    # Get top source IPs by flow count
+    top_sources = db.session.query(
+        FlowRecord.source_ip,
+        db.func.count().label('flow_count')
+    ).filter(
+        FlowRecord.timestamp >= past_day
+    ).group_by(FlowRecord.source_ip).order_by(
+        db.desc('flow_count')
+    ).limit(10).all()
+    
+    if not top_sources:
+        logger.info("Not enough flow data for anomaly detection")
+        return 0
+    
+    # Calculate average flow count
+    avg_flow_count = db.session.query(
+        db.func.avg(db.func.count())
+    ).filter(
+        FlowRecord.timestamp >= past_day
+    ).group_by(FlowRecord.source_ip).scalar() or 0
+    
+    # Check for IPs with unusually high flow counts
+    for source in top_sources:
+        if source.flow_count > avg_flow_count * 5:
+            create_anomaly_event(
+                'Flow Anomaly',
+                f"Host {source.source_ip} has an unusually high number of flows: "
+                f"{source.flow_count} (average: {avg_flow_count:.2f})",
+                severity=3 if source.flow_count > avg_flow_count * 10 else 2,
+                source_ip=source.source_ip,
+                signature="flow-count"
+            )
+    
+    return sum(source.flow_count for source in top_sources)
+
+def detect_ml_anomalies(current_time):
+    """Detect anomalous hosts with the machine-learning model"""
+    # Imported here so numpy is only loaded when the ML detector runs
+    from utils.ml_detection import get_model, train_model, score_hosts, get_model_statistics
+    
+    # Train on stored history the first time the model is needed
+    if get_model() is None and train_model() is None:
+        logger.info("Not enough history for machine-learning anomaly detection")
+        return 0
+    
+    for host, score in score_hosts(current_time):
+        create_anomaly_event(
+            'ML Anomaly',
+            f"Host {host} deviates from learned traffic behaviour (anomaly score: {score:.3f})",
+            severity=5 if score > 0.8 else 4 if score > 0.7 else 3,
+            source_ip=host,
+            signature="ml-score"
+        )
+    
+    return get_model_statistics()['last_hosts_scored']
 
 def calculate_severity(value, mean, stdev):
     """Calculate severity level based on how far the value is from the mean"""
@@ -316,51 +390,196 @@ def calculate_baseline_statistics(data):
     """Calculate mean and standard deviation for baseline"""
     if not data:
         return 0, 0
-    return np.mean(data), np.std(data)
+    return statistics.fmean(data), statistics.pstdev(data)
 
-def calculate_severity(z_score):
-    """Calculate severity level based on z-score"""
-    if z_score > 5:
-        return 5  # Critical
-    elif z_score > 4:
-        return 4  # High
-    elif z_score > 3:
-        return 3  # Medium
-    else:
-        return 2  # Low
+def create_anomaly_event(event_type, description, severity=3, source_ip=None, destination_ip=None, signature=None):
+    """Record an anomaly hit, grouping repeats of the same anomaly into one event
 
-def create_anomaly_event(event_type, description, severity=3, source_ip=None, destination_ip=None):
-    """Create a new anomaly event in the database"""
-    try:
-        # Check if a similar event already exists recently
-        recent_time = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
-        existing = AnomalyEvent.query.filter(
-            AnomalyEvent.event_type == event_type,
-            AnomalyEvent.description == description,
-            AnomalyEvent.timestamp >= recent_time,
-            AnomalyEvent.resolved == False
-        ).first()
+    Hits are keyed by (event_type, source, destination, signature) in an
+    in-memory index. A repeat within the dedup window only bumps the
+    occurrence count of the existing event; new events are buffered and
+    inserted in batches by flush_anomaly_events().
+    """
+    now = datetime.datetime.utcnow()
+    key = (event_type, source_ip, destination_ip, signature or description)
+    
+    with anomaly_index_lock:
+        load_anomaly_index(now)
+        expire_anomaly_index(now)
         
-        if existing:
-            logger.info(f"Similar anomaly already exists: {event_type}")
+        entry = anomaly_index.get(key)
+        if entry:
+            # Fold the repeated hit into the existing event
+            entry['count'] += 1
+            entry['last_seen'] = now
+            entry['severity'] = max(entry['severity'], severity)
+            if entry['event'] is not None:
+                # Still waiting for its insert, so update the pending row directly
+                entry['event']['occurrence_count'] = entry['count']
+                entry['event']['last_seen'] = now
+                entry['event']['severity'] = entry['severity']
+            else:
+                entry['dirty'] = True
+            logger.debug(f"Repeated anomaly {event_type} ({entry['count']} occurrences)")
             return
         
-        # Create new anomaly event
-        anomaly = AnomalyEvent(
-            event_type=event_type,
-            description=description,
-            severity=severity,
-            source_ip=source_ip,
-            destination_ip=destination_ip,
-            timestamp=datetime.datetime.utcnow(),
-            resolved=False
-        )
+        anomaly = {
+            'event_type': event_type,
+            'description': description,
+            'severity': severity,
+            'source_ip': source_ip,
+            'destination_ip': destination_ip,
+            'signature': key[3][:255],
+            'timestamp': now,
+            'last_seen': now,
+            'occurrence_count': 1,
+            'resolved': False
+        }
+        anomaly_index[key] = {
+            'id': None,
+            'event': anomaly,
+            'count': 1,
+            'severity': severity,
+            'stored_severity': severity,
+            'last_seen': now,
+            'dirty': False
+        }
+        pending_anomalies.append(anomaly)
+        flush_needed = len(pending_anomalies) >= Config.ANOMALY_FLUSH_BATCH
+    
+    # Repeats only bump a count, so a detector run reports the events it created
+    run_context.events = getattr(run_context, 'events', 0) + 1
+    
+    logger.info(f"New anomaly event: {event_type}, severity {severity}")
+    
+    if flush_needed:
+        flush_anomaly_events()
+
+def write_anomaly_events(new_events, snapshots, updates, counter_deltas):
+    """Insert new events, update repeated ones and adjust the counters, recording the new ids"""
+    ids = bulk_insert(AnomalyEvent, snapshots, return_ids=True)
+    if updates:
+        db.session.execute(db.update(AnomalyEvent), updates)
+    adjust_anomaly_counters(counter_deltas)
+    
+    inserted = {id(event): (event_id, snapshot) for event, event_id, snapshot in zip(new_events, ids, snapshots)}
+    with anomaly_index_lock:
+        for entry in anomaly_index.values():
+            event = entry['event']
+            if event is None or id(event) not in inserted:
+                continue
+            entry['id'], snapshot = inserted[id(event)]
+            entry['stored_severity'] = snapshot['severity']
+            entry['event'] = None
+            # Hits that arrived while the insert was running are written back by the next flush
+            if event['occurrence_count'] != snapshot['occurrence_count'] or event['severity'] != snapshot['severity']:
+                entry['dirty'] = True
+
+def flush_anomaly_events():
+    """Insert buffered anomaly events and write back occurrence counts in one transaction"""
+    with anomaly_index_lock:
+        new_events = pending_anomalies[:]
+        pending_anomalies.clear()
+        snapshots = [dict(event) for event in new_events]
+        pending_ids = {id(event) for event in new_events}
+        new_keys = [key for key, entry in anomaly_index.items()
+                    if entry['event'] is not None and id(entry['event']) in pending_ids]
         
-        db.session.add(anomaly)
-        db.session.commit()
+        # Statistics counters change in the same transaction as the events
+        counter_deltas = count_new_events(snapshots)
         
-        logger.info(f"Created new anomaly event: {event_type}, severity {severity}")
+        # Entries are claimed here so a concurrent flush does not write them twice,
+        # and handed back below if the write fails
+        updates = []
+        claimed = []
+        for entry in anomaly_index.values():
+            if entry['dirty'] and entry['id'] is not None:
+                updates.append({
+                    'id': entry['id'],
+                    'occurrence_count': entry['count'],
+                    'last_seen': entry['last_seen'],
+                    'severity': entry['severity']
+                })
+                claimed.append((entry, entry['stored_severity'], entry['severity']))
+                if entry['severity'] != entry['stored_severity']:
+                    counter_deltas[('severity', str(entry['stored_severity']))] -= 1
+                    counter_deltas[('severity', str(entry['severity']))] += 1
+                    entry['stored_severity'] = entry['severity']
+                entry['dirty'] = False
+    
+    if not new_events and not updates:
+        return 0
+    
+    try:
+        # Updates the dedup index as it goes, so this runs in a transaction of its own
+        submit_write(write_anomaly_events, new_events, snapshots, updates, counter_deltas, group=False).result()
+        logger.info(f"Flushed {len(new_events)} new and {len(updates)} repeated anomaly events")
     
     except Exception as e:
-        logger.error(f"Error creating anomaly event: {e}")
+        logger.error(f"Error flushing anomaly events: {e}")
         db.session.rollback()
+        
+        with anomaly_index_lock:
+            # Drop the failed events from the index so later hits can retry
+            # (including ones given an id by an insert that was then rolled back)
+            failed_keys = set(new_keys)
+            failed_keys.update(k for k, entry in anomaly_index.items() if entry['id'] is None)
+            for key in failed_keys:
+                anomaly_index.pop(key, None)
+            
+            # Repeats were not written: the next flush writes them and their severity change again
+            for entry, stored_severity, flushed_severity in claimed:
+                entry['dirty'] = True
+                if entry['stored_severity'] == flushed_severity:
+                    entry['stored_severity'] = stored_severity
+        
+        # Let the caller (and the detector scheduler's error counts) see the failure
+        raise
+    
+    return len(new_events)
+
+def load_anomaly_index(now):
+    """Seed the dedup index with recent unresolved events (once per process)"""
+    global anomaly_index_loaded
+    
+    if anomaly_index_loaded:
+        return
+    anomaly_index_loaded = True
+    
+    try:
+        recent_time = now - datetime.timedelta(seconds=Config.ANOMALY_DEDUP_WINDOW)
+        recent_events = AnomalyEvent.query.filter(
+            db.func.coalesce(AnomalyEvent.last_seen, AnomalyEvent.timestamp) >= recent_time,
+            AnomalyEvent.resolved == False
+        ).all()
+        
+        for event in recent_events:
+            key = (event.event_type, event.source_ip, event.destination_ip, event.signature or event.description)
+            anomaly_index[key] = {
+                'id': event.id,
+                'event': None,
+                'count': event.occurrence_count or 1,
+                'severity': event.severity,
+                'stored_severity': event.severity,
+                'last_seen': event.last_seen or event.timestamp,
+                'dirty': False
+            }
+    
+    except Exception as e:
+        logger.error(f"Error loading anomaly dedup index: {e}")
+
+def expire_anomaly_index(now):
+    """Drop index entries that have been quiet for longer than the dedup window"""
+    cutoff = now - datetime.timedelta(seconds=Config.ANOMALY_DEDUP_WINDOW)
+    expired = [
+        key for key, entry in anomaly_index.items()
+        if entry['last_seen'] < cutoff and entry['id'] is not None and not entry['dirty']
+    ]
+    for key in expired:
+        del anomaly_index[key]
+
+def forget_anomaly_event(anomaly_id):
+    """Remove a resolved event from the dedup index"""
+    with anomaly_index_lock:
+        for key in [k for k, entry in anomaly_index.items() if entry['id'] == anomaly_id]:
+            del anomaly_index[key]
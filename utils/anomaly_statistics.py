@@ -0,0 +1,109 @@
+"""
+Incrementally maintained anomaly statistics
+"""
+import logging
+import datetime
+from collections import Counter
+from app import db
+from models import AnomalyEvent, AnomalyStatistic
+from utils.db_writer import submit_write
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+def event_counter_keys(event_type, severity, resolved):
+    """Counter keys an event contributes to"""
+    return [
+        ('severity', str(severity)),
+        ('event_type', event_type),
+        ('resolved', 'true' if resolved else 'false')
+    ]
+
+def adjust_anomaly_counters(deltas):
+    """Apply {(dimension, key): delta} to the counters in the current transaction
+
+    The caller commits, so counters change atomically with the events they
+    describe.
+    """
+    now = datetime.datetime.utcnow()
+    for (dimension, key), delta in deltas.items():
+        if not delta:
+            continue
+        updated = db.session.execute(
+            db.update(AnomalyStatistic)
+            .where(AnomalyStatistic.dimension == dimension, AnomalyStatistic.key == key)
+            .values(count=AnomalyStatistic.count + delta, updated_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not updated:
+            db.session.add(AnomalyStatistic(dimension=dimension, key=key, count=delta, updated_at=now))
+
+def count_new_events(events):
+    """Counter deltas for newly inserted event rows"""
+    deltas = Counter()
+    for event in events:
+        for key in event_counter_keys(event['event_type'], event['severity'], event['resolved']):
+            deltas[key] += 1
+    return deltas
+
+def count_anomaly_events():
+    """Counter values computed from the AnomalyEvent table"""
+    counts = Counter()
+    
+    for severity, count in db.session.query(
+        AnomalyEvent.severity, db.func.count()
+    ).group_by(AnomalyEvent.severity).all():
+        counts[('severity', str(severity))] = count
+    
+    for event_type, count in db.session.query(
+        AnomalyEvent.event_type, db.func.count()
+    ).group_by(AnomalyEvent.event_type).all():
+        counts[('event_type', event_type)] = count
+    
+    for resolved, count in db.session.query(
+        AnomalyEvent.resolved, db.func.count()
+    ).group_by(AnomalyEvent.resolved).all():
+        counts[('resolved', 'true' if resolved else 'false')] = count
+    
+    return counts
+
+def rewrite_anomaly_counters():
+    """Replace the counters with fresh counts in the current transaction"""
+    counts = count_anomaly_events()
+    now = datetime.datetime.utcnow()
+    AnomalyStatistic.query.delete()
+    db.session.add_all([
+        AnomalyStatistic(dimension=dimension, key=key, count=count, updated_at=now)
+        for (dimension, key), count in counts.items()
+    ])
+    return counts
+
+def reconcile_anomaly_counters():
+    """Rebuild the counters from the AnomalyEvent table
+
+    The count and the rewrite run as one transaction on the database writer,
+    so no counter delta can be committed between them and then overwritten.
+    """
+    try:
+        counts = submit_write(rewrite_anomaly_counters, group=False).result()
+        logger.info(f"Reconciled {len(counts)} anomaly counters")
+    except Exception as e:
+        logger.error(f"Error reconciling anomaly counters: {e}")
+        raise
+    
+    return sum(count for (dimension, _), count in counts.items() if dimension == 'resolved')
+
+def get_anomaly_counters():
+    """Read all counters as {dimension: {key: count}}"""
+    counts = {(counter.dimension, counter.key): counter.count for counter in AnomalyStatistic.query.all()}
+    
+    # Databases that predate the counters are counted directly until the next reconcile builds them
+    if not counts:
+        counts = count_anomaly_events()
+    
+    result = {'severity': {}, 'event_type': {}, 'resolved': {}}
+    for (dimension, key), count in counts.items():
+        if count:
+            result.setdefault(dimension, {})[key] = count
+    return result
@@ -0,0 +1,329 @@
+"""
+Bandwidth accounting
+
+Populates the 'bandwidth' metrics series (BandwidthUsage rows with the SQL
+store) from three sources:
+
+- the kernel's per-interface counters in /sys/class/net/<iface>/statistics,
+  sampled by the agent every Config.BANDWIDTH_SAMPLE_INTERVAL seconds
+- sFlow counter samples received by the flow collector, one series per
+  exporting agent and ifIndex
+- packet captures on interfaces without sysfs counters (non-Linux hosts,
+  the 'any' pseudo interface), bucketed from the captured packets
+
+Each point holds the bytes and packets of one interval, not a running
+total. Sampled and sFlow points are kept in a per-series ring for the
+dashboard and written to the metrics store in batches.
+"""
+import datetime
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from app import app
+from config import Config
+from utils.interface_stats import SYSFS_NET, InterfaceCounterReader
+from utils.metrics_store import EPOCH, epoch_microseconds, get_metrics_store
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+MIN_SAMPLE_INTERVAL = 0.1  # seconds
+MAX_SAMPLE_INTERVAL = 60.0  # seconds
+
+bandwidth_sampler = None
+bandwidth_sampler_lock = threading.Lock()
+local_address_cache = []
+
+def counter_delta(current, previous, bits=64):
+    """Increase of a cumulative counter, or None if it was reset
+
+    32-bit counters (sFlow packet counts) wrap and are taken modulo 2**32;
+    a 64-bit counter going backwards means the interface was reset.
+    """
+    if current >= previous:
+        return current - previous
+    if bits == 32:
+        return (current - previous) % (1 << 32)
+    return None
+
+def local_addresses():
+    """Addresses of this host, used to tell inbound from outbound captured packets"""
+    if not local_address_cache:
+        addresses = {'127.0.0.1', '::1'}
+        try:
+            for info in socket.getaddrinfo(socket.gethostname(), None):
+                addresses.add(info[4][0])
+        except OSError as e:
+            logger.warning(f"Could not resolve local addresses: {e}")
+        local_address_cache.append(addresses)
+    return local_address_cache[0]
+
+class CaptureBandwidth:
+    """Per-interval traffic of one capture, for interfaces without kernel counters
+
+    Packets to a local address count as inbound, packets from one as
+    outbound; traffic between other hosts (mirror ports, promiscuous mode)
+    counts as inbound, since it arrived on the interface.
+    """
+
+    def __init__(self, interface, interval=None):
+        self.interface = interface
+        interval = interval or Config.BANDWIDTH_SAMPLE_INTERVAL or MAX_SAMPLE_INTERVAL
+        self.interval_us = int(min(max(interval, MIN_SAMPLE_INTERVAL), MAX_SAMPLE_INTERVAL) * 1000000)
+        self.buckets = {}  # bucket start (microseconds) -> [bytes_in, bytes_out, packets_in, packets_out]
+        self.local = local_addresses()
+
+    def add(self, rows):
+        """Fold a batch of Packet row mappings into their buckets"""
+        for row in rows:
+            timestamp_us = epoch_microseconds(row['timestamp'])
+            totals = self.buckets.setdefault(timestamp_us - timestamp_us % self.interval_us, [0, 0, 0, 0])
+            weight = row['sample_weight']
+            if row['source_ip'] in self.local and row['destination_ip'] not in self.local:
+                totals[1] += (row['length'] or 0) * weight
+                totals[3] += weight
+            else:
+                totals[0] += (row['length'] or 0) * weight
+                totals[2] += weight
+
+    def drain(self, final=False):
+        """Points for completed buckets (all buckets when final)
+
+        Rows arrive in capture order, so every bucket before the newest one
+        is complete.
+        """
+        if not self.buckets:
+            return []
+        newest = max(self.buckets)
+        points = []
+        for start in sorted(self.buckets):
+            if start == newest and not final:
+                break
+            bytes_in, bytes_out, packets_in, packets_out = self.buckets.pop(start)
+            points.append({
+                'timestamp': EPOCH + datetime.timedelta(microseconds=start),
+                'interface': self.interface,
+                'bytes_in': bytes_in,
+                'bytes_out': bytes_out,
+                'packets_in': packets_in,
+                'packets_out': packets_out
+            })
+        return points
+
+class BandwidthSampler:
+    """Thread sampling interface counters and batching bandwidth points to the metrics store"""
+
+    def __init__(self, interval=None, flush_interval=None, interfaces=None):
+        interval = Config.BANDWIDTH_SAMPLE_INTERVAL if interval is None else interval
+        # 0 turns sysfs sampling off; sFlow points are still batched and written
+        self.interval = min(max(interval, MIN_SAMPLE_INTERVAL), MAX_SAMPLE_INTERVAL) if interval else 0
+        self.flush_interval = flush_interval or Config.BANDWIDTH_FLUSH_INTERVAL
+        self.interfaces = interfaces if interfaces is not None else Config.BANDWIDTH_INTERFACES
+        self.readers = {}  # interface -> InterfaceCounterReader
+        self.previous = {}  # series -> last cumulative counters
+        self.rings = {}  # series -> recent points
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'samples': 0, 'points_written': 0, 'write_errors': 0}
+
+    def start(self):
+        """Start the sampling thread"""
+        self.thread = threading.Thread(target=self._run, name='bandwidth-sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Stop sampling and write what is pending"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+    def is_running(self):
+        """Whether the sampling thread is alive"""
+        return bool(self.thread and self.thread.is_alive())
+
+    def refresh_interfaces(self):
+        """Open counter readers for new interfaces and close those that disappeared"""
+        if self.interfaces:
+            names = set(self.interfaces)
+        else:
+            try:
+                names = set(os.listdir(SYSFS_NET))
+            except OSError:
+                names = set()
+
+        for interface in set(self.readers) - names:
+            self.readers.pop(interface).close()
+            self.previous.pop(interface, None)
+        for interface in names - set(self.readers):
+            try:
+                self.readers[interface] = InterfaceCounterReader(interface)
+            except OSError:
+                pass  # No sysfs statistics for this interface
+
+    def sample(self, timestamp=None):
+        """Read every interface's counters and record the change since the previous sample"""
+        timestamp = timestamp or datetime.datetime.utcnow()
+        points = []
+        for interface, reader in list(self.readers.items()):
+            try:
+                counters = reader.read()
+            except (OSError, ValueError):
+                # The interface went away; forget it until it reappears
+                self.readers.pop(interface).close()
+                self.previous.pop(interface, None)
+                continue
+            point = self.delta_point(interface, timestamp, counters['rx_bytes'], counters['tx_bytes'],
+                                     counters['rx_packets'], counters['tx_packets'])
+            if point:
+                points.append(point)
+        self.stats['samples'] += 1
+        self.record(points)
+
+    def delta_point(self, series, timestamp, bytes_in, bytes_out, packets_in, packets_out, packet_bits=64):
+        """Point for the counter increase since the series' previous reading (None for the first)"""
+        current = (bytes_in, bytes_out, packets_in, packets_out)
+        previous = self.previous.get(series)
+        self.previous[series] = current
+        if previous is None:
+            return None
+        deltas = [
+            counter_delta(value, last, bits)
+            for value, last, bits in zip(current, previous, (64, 64, packet_bits, packet_bits))
+        ]
+        if None in deltas:
+            return None  # Counters were reset; this reading is the new baseline
+        return {
+            'timestamp': timestamp,
+            'interface': series,
+            'bytes_in': deltas[0],
+            'bytes_out': deltas[1],
+            'packets_in': deltas[2],
+            'packets_out': deltas[3]
+        }
+
+    def record_sflow(self, agent, if_index, in_octets, out_octets, in_packets, out_packets, timestamp=None):
+        """Record an sFlow generic interface counter sample"""
+        with self.lock:
+            point = self.delta_point(f"{agent}:{if_index}", timestamp or datetime.datetime.utcnow(),
+                                     in_octets, out_octets, in_packets, out_packets, packet_bits=32)
+        if point:
+            self.record([point])
+
+    def record(self, points):
+        """Queue points for the next write and keep them in the live rings"""
+        if not points:
+            return
+        with self.lock:
+            self.pending.extend(points)
+            for point in points:
+                ring = self.rings.get(point['interface'])
+                if ring is None:
+                    ring = self.rings[point['interface']] = deque(maxlen=Config.BANDWIDTH_RING_SIZE)
+                ring.append(point)
+
+    def flush(self):
+        """Write the pending points in one batch"""
+        with self.lock:
+            points, self.pending = self.pending, []
+        if not points:
+            return 0
+        try:
+            with app.app_context():
+                get_metrics_store().write('bandwidth', points)
+        except Exception as e:
+            self.stats['write_errors'] += 1
+            logger.error(f"Error writing bandwidth samples: {e}")
+            return 0
+        self.stats['points_written'] += len(points)
+        return len(points)
+
+    def live(self, interface=None, limit=None):
+        """Recent points, oldest first, for one interface or all of them"""
+        with self.lock:
+            if interface:
+                points = list(self.rings.get(interface, ()))
+            else:
+                points = sorted(
+                    (point for ring in self.rings.values() for point in ring),
+                    key=lambda point: point['timestamp']
+                )
+        return points[-limit:] if limit else points
+
+    def _run(self):
+        """Sample on a fixed schedule and flush every flush_interval"""
+        self.refresh_interfaces()
+        if self.interval:
+            self.sample()  # Baseline readings
+        next_sample = time.monotonic() + (self.interval or self.flush_interval)
+        next_flush = time.monotonic() + self.flush_interval
+
+        while not self.stop_event.wait(max(min(next_sample, next_flush) - time.monotonic(), 0)):
+            now = time.monotonic()
+            if self.interval and now >= next_sample:
+                self.sample()
+                # Keep the schedule instead of drifting by the sampling time; skip missed ticks
+                next_sample += self.interval
+                if next_sample <= now:
+                    next_sample = now + self.interval
+            elif not self.interval:
+                next_sample = now + self.flush_interval
+            if now >= next_flush:
+                next_flush = now + self.flush_interval
+                self.flush()
+                self.refresh_interfaces()
+
+        self.flush()
+
+    def get_statistics(self):
+        """Sampler settings and counters"""
+        return dict(
+            self.stats,
+            running=self.is_running(),
+            interval=self.interval,
+            interfaces=sorted(self.readers),
+            pending=len(self.pending)
+        )
+
+def get_bandwidth_sampler():
+    """This process's sampler (created, not started, on first use)"""
+    global bandwidth_sampler
+    with bandwidth_sampler_lock:
+        if bandwidth_sampler is None:
+            bandwidth_sampler = BandwidthSampler()
+        return bandwidth_sampler
+
+def start_bandwidth_sampler():
+    """Start sampling in this process if it isn't already"""
+    sampler = get_bandwidth_sampler()
+    if sampler.is_running():
+        return False
+    sampler.start()
+    logger.info(f"Bandwidth sampler started ({sampler.interval or 'no'} s interface sampling)")
+    return True
+
+def stop_bandwidth_sampler():
+    """Stop sampling and write pending points"""
+    global bandwidth_sampler
+    with bandwidth_sampler_lock:
+        sampler, bandwidth_sampler = bandwidth_sampler, None
+    if sampler:
+        sampler.stop()
+
+def record_sflow_counters(agent, if_index, in_octets, out_octets, in_packets, out_packets):
+    """Feed an sFlow interface counter sample to this process's sampler"""
+    get_bandwidth_sampler().record_sflow(agent, if_index, in_octets, out_octets, in_packets, out_packets)
+
+def get_live_bandwidth(interface=None, limit=None):
+    """Recent points from the in-memory rings, JSON-ready, oldest first"""
+    points = get_bandwidth_sampler().live(interface, limit)
+    return [dict(point, timestamp=point['timestamp'].isoformat()) for point in points]
@@ -0,0 +1,172 @@
+"""
+Bulk row loading for the packet, flow and anomaly writers
+
+Rows are plain column mappings. On PostgreSQL (psycopg2) they are streamed with
+COPY FROM STDIN, in binary form where every column type has a binary
+encoder here and as CSV otherwise. Other databases (SQLite) get one
+executemany of the compiled INSERT. Everything runs in the session's
+current transaction; the caller commits.
+"""
+import csv
+import datetime
+import io
+import logging
+import struct
+from sqlalchemy import BigInteger, Boolean, DateTime, Float, Integer, String, Text
+from app import db
+from config import Config
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+PG_EPOCH = datetime.datetime(2000, 1, 1)
+CSV_NULL = '\\N'
+
+def encode_bigint(value):
+    """int8 field"""
+    return struct.pack('!iq', 8, int(value))
+
+def encode_integer(value):
+    """int4 field"""
+    return struct.pack('!ii', 4, int(value))
+
+def encode_float(value):
+    """float8 field"""
+    return struct.pack('!id', 8, float(value))
+
+def encode_boolean(value):
+    """bool field"""
+    return struct.pack('!i?', 1, bool(value))
+
+def encode_timestamp(value):
+    """timestamp field: microseconds since 2000-01-01"""
+    delta = value - PG_EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return struct.pack('!iq', 8, micros)
+
+def encode_text(value):
+    """text field, UTF-8"""
+    data = str(value).encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+# Binary COPY encoders by column type; subclasses first (BigInteger is an Integer, Text a String)
+BINARY_ENCODERS = (
+    (BigInteger, encode_bigint),
+    (Integer, encode_integer),
+    (Float, encode_float),
+    (Boolean, encode_boolean),
+    (DateTime, encode_timestamp),
+    (Text, encode_text),
+    (String, encode_text)
+)
+
+NULL_FIELD = struct.pack('!i', -1)
+
+def load_columns(table, rows):
+    """Columns to load: everything except a primary key the rows don't supply"""
+    return [
+        column for column in table.columns
+        if not (column.primary_key and column.autoincrement and column.key not in rows[0])
+    ]
+
+def column_default(column):
+    """Python-side default of a column, as INSERT would apply it"""
+    default = column.default
+    if default is None:
+        return None
+    if default.is_callable:
+        return default.arg(None)
+    if default.is_scalar:
+        return default.arg
+    return None
+
+def row_values(columns, rows):
+    """Yield each row's values in column order with Python-side defaults filled in"""
+    defaults = [column_default(column) for column in columns]
+    keys = [column.key for column in columns]
+    for row in rows:
+        yield [
+            row[key] if key in row else default
+            for key, default in zip(keys, defaults)
+        ]
+
+def binary_encoders(columns):
+    """Binary encoder for each column, or None if a column type has none"""
+    encoders = []
+    for column in columns:
+        for column_type, encoder in BINARY_ENCODERS:
+            if isinstance(column.type, column_type):
+                encoders.append(encoder)
+                break
+        else:
+            return None
+    return encoders
+
+def binary_copy_data(columns, rows, encoders):
+    """Encode rows in PostgreSQL's binary COPY format"""
+    out = io.BytesIO()
+    out.write(PGCOPY_HEADER)
+    field_count = struct.pack('!h', len(columns))
+    for values in row_values(columns, rows):
+        out.write(field_count)
+        for value, encoder in zip(values, encoders):
+            out.write(NULL_FIELD if value is None else encoder(value))
+    out.write(PGCOPY_TRAILER)
+    out.seek(0)
+    return out
+
+def csv_copy_data(columns, rows):
+    """Encode rows as CSV with \\N for NULL"""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    for values in row_values(columns, rows):
+        writer.writerow([CSV_NULL if value is None else value for value in values])
+    out.seek(0)
+    return out
+
+def copy_rows(model, rows):
+    """Stream rows into the model's table with COPY FROM STDIN"""
+    table = model.__table__
+    columns = load_columns(table, rows)
+    column_list = ', '.join(f'"{column.name}"' for column in columns)
+
+    encoders = binary_encoders(columns) if Config.BULK_COPY_FORMAT == 'binary' else None
+    if encoders:
+        data = binary_copy_data(columns, rows, encoders)
+        statement = f'COPY "{table.name}" ({column_list}) FROM STDIN WITH (FORMAT binary)'
+    else:
+        data = csv_copy_data(columns, rows)
+        statement = f"COPY \"{table.name}\" ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{CSV_NULL}')"
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(statement, data)
+    finally:
+        cursor.close()
+
+def bulk_insert(model, rows, return_ids=False):
+    """Insert row mappings into the model's table
+
+    With return_ids the generated primary keys are returned in row order;
+    COPY can't report them, so that path uses a batched INSERT ... RETURNING.
+    """
+    if not rows:
+        return [] if return_ids else 0
+
+    if return_ids:
+        result = db.session.execute(
+            db.insert(model).returning(model.id, sort_by_parameter_order=True),
+            rows
+        )
+        return list(result.scalars())
+
+    dialect = db.session.get_bind().dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        copy_rows(model, rows)
+    else:
+        # executemany of the compiled (and cached) INSERT
+        db.session.execute(db.insert(model), rows)
+    return len(rows)
@@ -0,0 +1,187 @@
+"""
+Bounded per-capture packet buffer
+
+Packets wait here between the capture callback and the database writer.
+Storage is preallocated column arrays indexed as a ring, so memory use is
+fixed at creation time no matter how far the database falls behind. When
+the ring is full the backpressure policy decides what happens:
+
+- block: the capture thread waits for the writer (the kernel drops instead)
+- drop-newest: the incoming packet is discarded
+- drop-oldest: the oldest buffered packet is overwritten
+"""
+import logging
+import threading
+from array import array
+from utils.packet_record import mask_to_flags, us_to_datetime
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Backpressure policies
+POLICY_BLOCK = 'block'
+POLICY_DROP_NEWEST = 'drop-newest'
+POLICY_DROP_OLDEST = 'drop-oldest'
+BUFFER_POLICIES = (POLICY_BLOCK, POLICY_DROP_NEWEST, POLICY_DROP_OLDEST)
+
+# Stand-in for NULL in the integer columns
+MISSING = -1
+
+class CaptureBuffer:
+    """Fixed-capacity ring of packet records with drop accounting"""
+
+    def __init__(self, capacity, policy=POLICY_BLOCK):
+        if policy not in BUFFER_POLICIES:
+            raise ValueError(f"Unknown buffer policy '{policy}'")
+        self.capacity = max(int(capacity), 1)
+        self.policy = policy
+
+        # Numeric columns
+        self.timestamps = array('q', bytes(8 * self.capacity))  # epoch microseconds
+        self.lengths = array('q', bytes(8 * self.capacity))
+        self.source_ports = array('l', [MISSING]) * self.capacity
+        self.destination_ports = array('l', [MISSING]) * self.capacity
+        self.pcap_offsets = array('q', [MISSING]) * self.capacity
+        self.pcap_segments = array('l', [MISSING]) * self.capacity
+        self.sample_weights = array('l', [1]) * self.capacity
+        self.tcp_flags = array('l', [MISSING]) * self.capacity  # bitmask
+
+        # String columns
+        self.protocols = [None] * self.capacity
+        self.source_ips = [None] * self.capacity
+        self.destination_ips = [None] * self.capacity
+        self.infos = [None] * self.capacity
+
+        self.head = 0  # Index of the oldest record
+        self.size = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.not_full = threading.Condition(self.lock)
+        self.not_empty = threading.Condition(self.lock)
+
+    def reserve(self):
+        """Make room for the next record per the policy; returns False if it is to be dropped
+
+        Lets the producer skip work (such as writing the raw frame) for a
+        packet the buffer won't take. The capture callback is the only
+        producer, so the room stays free until its put().
+        """
+        with self.lock:
+            return self._make_room()
+
+    def _make_room(self):
+        """Apply the backpressure policy when the ring is full (lock held)"""
+        if self.size < self.capacity:
+            return True
+        if self.policy == POLICY_BLOCK:
+            while self.size == self.capacity and not self.closed:
+                self.not_full.wait()
+            if self.closed:
+                self.dropped += 1
+                return False
+        elif self.policy == POLICY_DROP_NEWEST:
+            self.dropped += 1
+            return False
+        else:
+            # Overwrite the oldest record
+            self.head = (self.head + 1) % self.capacity
+            self.size -= 1
+            self.dropped += 1
+        return True
+
+    def put(self, record):
+        """Copy a PacketRecord into the ring; returns False if it was dropped"""
+        with self.lock:
+            if not self._make_room():
+                return False
+
+            i = (self.head + self.size) % self.capacity
+            self.timestamps[i] = record.timestamp_us
+            self.lengths[i] = record.length or 0
+            self.source_ports[i] = _int_or_missing(record.source_port)
+            self.destination_ports[i] = _int_or_missing(record.destination_port)
+            self.pcap_offsets[i] = _int_or_missing(record.pcap_offset)
+            self.pcap_segments[i] = _int_or_missing(record.pcap_segment)
+            self.sample_weights[i] = record.sample_weight
+            self.tcp_flags[i] = _int_or_missing(record.tcp_flags)
+            self.protocols[i] = record.protocol
+            self.source_ips[i] = record.source_ip
+            self.destination_ips[i] = record.destination_ip
+            self.infos[i] = record.info
+
+            self.size += 1
+            if self.size > self.high_water:
+                self.high_water = self.size
+            self.not_empty.notify()
+        return True
+
+    def drain(self, capture_id, limit=None):
+        """Remove up to `limit` of the oldest records, returned as Packet column mappings"""
+        with self.lock:
+            count = self.size if limit is None else min(limit, self.size)
+            rows = []
+            for n in range(count):
+                i = (self.head + n) % self.capacity
+                flags = self.tcp_flags[i]
+                rows.append({
+                    'capture_id': capture_id,
+                    'timestamp': us_to_datetime(self.timestamps[i]),
+                    'length': self.lengths[i],
+                    'source_port': _missing_to_none(self.source_ports[i]),
+                    'destination_port': _missing_to_none(self.destination_ports[i]),
+                    'pcap_offset': _missing_to_none(self.pcap_offsets[i]),
+                    'pcap_segment': _missing_to_none(self.pcap_segments[i]),
+                    'sample_weight': self.sample_weights[i],
+                    'protocol': self.protocols[i],
+                    'source_ip': self.source_ips[i],
+                    'destination_ip': self.destination_ips[i],
+                    'tcp_flags': mask_to_flags(flags) if flags != MISSING else None,
+                    'info': self.infos[i]
+                })
+                # Release string references held by the slot
+                self.protocols[i] = self.source_ips[i] = self.destination_ips[i] = self.infos[i] = None
+
+            self.head = (self.head + count) % self.capacity
+            self.size -= count
+            if count:
+                self.not_full.notify_all()
+        return rows
+
+    def wait(self, threshold, timeout):
+        """Wait until at least `threshold` records are buffered or the timeout expires"""
+        with self.lock:
+            if self.size < threshold and not self.closed:
+                self.not_empty.wait_for(lambda: self.size >= threshold or self.closed, timeout)
+            return self.size
+
+    def close(self):
+        """Wake any blocked producer and the writer"""
+        with self.lock:
+            self.closed = True
+            self.not_full.notify_all()
+            self.not_empty.notify_all()
+
+    def __len__(self):
+        return self.size
+
+    def get_statistics(self):
+        """Occupancy and drop counters"""
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'policy': self.policy,
+                'buffered': self.size,
+                'high_water': self.high_water,
+                'dropped': self.dropped
+            }
+
+def _int_or_missing(value):
+    """Encode an optional integer for the array columns"""
+    return MISSING if value is None else int(value)
+
+def _missing_to_none(value):
+    """Decode an optional integer from the array columns"""
+    return None if value == MISSING else value
@@ -0,0 +1,55 @@
+"""
+Running statistics of a capture
+
+Packet and byte totals, per-protocol counts and the first/last packet
+time are accumulated from each drained batch, so keeping them current
+costs the same whether the capture holds a thousand packets or a
+billion. They reach the PacketCapture row at checkpoints rather than on
+every flush.
+"""
+import json
+import time
+from collections import Counter
+from config import Config
+
+class CaptureCounters:
+    """Sample-weighted totals of the packets a capture has stored"""
+
+    def __init__(self, checkpoint_interval=None):
+        self.packets = 0
+        self.bytes = 0
+        self.protocols = Counter()
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.checkpoint_interval = Config.CAPTURE_CHECKPOINT_INTERVAL if checkpoint_interval is None else checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+
+    def add(self, rows):
+        """Fold a batch of Packet row mappings into the totals"""
+        if not rows:
+            return
+        for row in rows:
+            weight = row['sample_weight']
+            self.packets += weight
+            self.bytes += (row['length'] or 0) * weight
+            self.protocols[row['protocol'] or 'Unknown'] += weight
+
+        # Rows are drained in capture order
+        if self.first_timestamp is None:
+            self.first_timestamp = rows[0]['timestamp']
+        self.last_timestamp = rows[-1]['timestamp']
+
+    def checkpoint_due(self):
+        """Whether the checkpoint interval has passed since the last checkpoint"""
+        return time.monotonic() - self.last_checkpoint >= self.checkpoint_interval
+
+    def checkpoint(self):
+        """PacketCapture column values for the current totals; restarts the interval"""
+        self.last_checkpoint = time.monotonic()
+        return {
+            'packet_count': self.packets,
+            'byte_count': self.bytes,
+            'protocol_counts': json.dumps(dict(self.protocols.most_common())),
+            'first_packet_time': self.first_timestamp,
+            'last_packet_time': self.last_timestamp
+        }
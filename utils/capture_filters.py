@@ -0,0 +1,73 @@
+"""
+Capture (BPF) and display filter handling
+
+Capture filters are compiled to classic BPF and attached to the capture
+socket, so the kernel discards unwanted packets before they are copied to
+user space. Display filters are Wireshark expressions evaluated by tshark
+after decoding and only apply to the PyShark backend.
+"""
+import logging
+import shutil
+import struct
+import subprocess
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Linux socket options
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+
+def compile_capture_filter(expression, linktype=1):
+    """Compile a BPF expression to a list of (code, jt, jf, k) instructions
+
+    Raises ValueError if the expression is invalid. Returns None when no BPF
+    compiler (libpcap via Scapy, or tcpdump) is available.
+    """
+    if not expression:
+        return []
+
+    try:
+        from scapy.arch.common import compile_filter
+        try:
+            program = compile_filter(expression, linktype=linktype)
+        except Exception as e:
+            raise ValueError(f"Invalid capture filter '{expression}': {e}")
+        return [
+            (program.bf_insns[i].code, program.bf_insns[i].jt, program.bf_insns[i].jf, program.bf_insns[i].k)
+            for i in range(program.bf_len)
+        ]
+    except ImportError:
+        pass
+
+    tcpdump = shutil.which('tcpdump')
+    if tcpdump:
+        result = subprocess.run(
+            [tcpdump, '-y', 'EN10MB' if linktype == 1 else 'RAW', '-ddd', expression],
+            capture_output=True, text=True, timeout=10
+        )
+        if result.returncode != 0:
+            raise ValueError(f"Invalid capture filter '{expression}': {result.stderr.strip()}")
+        lines = result.stdout.split('\n')
+        return [tuple(int(field) for field in line.split()) for line in lines[1:int(lines[0]) + 1]]
+
+    logger.warning("No BPF compiler available; capture filter will be validated by the capture backend")
+    return None
+
+def validate_capture_filter(expression):
+    """Check a capture filter and return its compiled size in instructions (None if unknown)"""
+    program = compile_capture_filter(expression)
+    return len(program) if program is not None else None
+
+def read_socket_statistics(sock):
+    """Read and reset the kernel PACKET_STATISTICS of an AF_PACKET socket
+
+    Returns (packets delivered to the socket, packets dropped by the kernel),
+    or None if the socket does not support the option.
+    """
+    try:
+        packets, drops = struct.unpack('II', sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+        return packets, drops
+    except (OSError, AttributeError):
+        return None
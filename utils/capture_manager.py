@@ -0,0 +1,228 @@
+"""
+Capture manager: runs each capture in its own worker process
+
+Workers are started in their own session so they outlive the web worker
+that launched them. Everything needed to find and control a worker (its
+pid and CPU) is kept on the capture record, so any web process can stop a
+capture or report on it, including after a restart.
+"""
+import os
+import sys
+import json
+import signal
+import logging
+import subprocess
+import time
+import datetime
+from app import db
+from config import Config
+from models import PacketCapture
+from utils.packet_capture import create_capture_record, start_packet_capture, stop_packet_capture
+from utils.tcp_tracker import tcp_tracker, merge_snapshots
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+WORKER_MODULE = 'utils.capture_worker'
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Worker processes started by this process, kept so they can be reaped
+worker_processes = {}
+
+def workers_enabled():
+    """Whether captures run in worker processes (not possible from a frozen executable)"""
+    return Config.CAPTURE_WORKER_PROCESSES and not getattr(sys, 'frozen', False)
+
+def get_worker_cpus():
+    """CPUs available for capture workers
+
+    CPU 0 is left to the web server and database when there is more than one.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    return cpus[1:] if len(cpus) > 1 else cpus
+
+def choose_worker_cpu():
+    """Pick the CPU running the fewest active capture workers"""
+    cpus = get_worker_cpus()
+    load = {cpu: 0 for cpu in cpus}
+    active = PacketCapture.query.filter(
+        PacketCapture.end_time == None,
+        PacketCapture.worker_pid != None
+    ).all()
+    for capture in active:
+        if capture.worker_cpu in load:
+            load[capture.worker_cpu] += 1
+    return min(cpus, key=lambda cpu: (load[cpu], cpu))
+
+def start_capture(interface, name, filter_expr='', timeout=60, **options):
+    """Start a capture, in a worker process when enabled, and return its id"""
+    if not workers_enabled():
+        return start_packet_capture(interface, name, filter_expr, timeout, **options)
+    
+    capture_id = create_capture_record(interface, name, filter_expr, timeout, **options)
+    cpu = choose_worker_cpu()
+    
+    process = subprocess.Popen(
+        [sys.executable, '-m', WORKER_MODULE, str(capture_id), '--cpu', str(cpu)],
+        cwd=PROJECT_DIR,
+        start_new_session=True
+    )
+    worker_processes[process.pid] = process
+    
+    capture = PacketCapture.query.get(capture_id)
+    capture.worker_pid = process.pid
+    capture.worker_cpu = cpu
+    db.session.commit()
+    
+    logger.info(f"Started capture worker {process.pid} for capture {capture_id} on CPU {cpu}")
+    return capture_id
+
+def stop_capture(capture_id):
+    """Stop a capture, whichever process is running it"""
+    capture = PacketCapture.query.get(capture_id)
+    if capture is None or capture.end_time is not None:
+        return False
+    
+    if capture.worker_pid is None:
+        return stop_packet_capture(capture_id)
+    
+    pid = capture.worker_pid
+    if not is_worker_alive(pid, capture_id):
+        mark_worker_exited(capture)
+        return False
+    
+    os.kill(pid, signal.SIGTERM)
+    
+    # The worker flushes its buffer and closes the capture record on the way out
+    deadline = time.monotonic() + Config.CAPTURE_WORKER_STOP_TIMEOUT
+    while time.monotonic() < deadline and is_worker_alive(pid, capture_id):
+        time.sleep(0.1)
+    
+    if is_worker_alive(pid, capture_id):
+        logger.warning(f"Capture worker {pid} did not exit within {Config.CAPTURE_WORKER_STOP_TIMEOUT}s")
+    
+    db.session.expire_all()
+    return True
+
+def is_worker_alive(pid, capture_id):
+    """Whether pid is still the worker process for this capture"""
+    process = worker_processes.get(pid)
+    if process is not None and process.poll() is not None:
+        # Exited child of this process (now reaped)
+        del worker_processes[pid]
+        return False
+    
+    # Guard against the pid having been reused by an unrelated process
+    cmdline_path = f'/proc/{pid}/cmdline'
+    if os.path.exists('/proc'):
+        try:
+            with open(cmdline_path, 'rb') as f:
+                args = f.read().split(b'\0')
+        except OSError:
+            return False
+        return WORKER_MODULE.encode() in args and str(capture_id).encode() in args
+    
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+def mark_worker_exited(capture):
+    """Close the record of a capture whose worker died without closing it"""
+    capture.end_time = datetime.datetime.utcnow()
+    capture.description = f"{capture.description} (Capture worker exited)"
+    db.session.commit()
+    logger.warning(f"Capture worker {capture.worker_pid} for capture {capture.id} exited unexpectedly")
+
+def reap_dead_workers():
+    """Close open captures whose worker process is gone"""
+    open_captures = PacketCapture.query.filter(
+        PacketCapture.end_time == None,
+        PacketCapture.worker_pid != None
+    ).all()
+    
+    reaped = 0
+    for capture in open_captures:
+        if not is_worker_alive(capture.worker_pid, capture.id):
+            db.session.refresh(capture)
+            if capture.end_time is None:
+                mark_worker_exited(capture)
+                reaped += 1
+    return reaped
+
+def read_process_usage(pid):
+    """Resident memory (bytes) and CPU time (seconds) of a process, from /proc"""
+    usage = {'rss_bytes': None, 'cpu_seconds': None}
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # Fields after the parenthesised command name; utime and stime are 14 and 15
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = os.sysconf('SC_CLK_TCK')
+        usage['cpu_seconds'] = round((int(fields[11]) + int(fields[12])) / ticks, 2)
+        usage['rss_bytes'] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        pass
+    return usage
+
+def get_worker_status():
+    """Per-worker and aggregate statistics for active captures"""
+    reap_dead_workers()
+    
+    active = PacketCapture.query.filter(PacketCapture.end_time == None).order_by(
+        PacketCapture.start_time.asc()
+    ).all()
+    
+    workers = []
+    totals = {'packet_count': 0, 'packets_delivered': 0, 'kernel_drops': 0, 'app_drops': 0}
+    for capture in active:
+        worker = {
+            'capture_id': capture.id,
+            'name': capture.name,
+            'interface': capture.interface,
+            'pid': capture.worker_pid,
+            'cpu': capture.worker_cpu,
+            'in_process': capture.worker_pid is None,
+            'packet_count': capture.packet_count or 0,
+            'packets_delivered': capture.packets_delivered or 0,
+            'kernel_drops': capture.kernel_drops or 0,
+            'app_drops': capture.app_drops or 0
+        }
+        if capture.worker_pid is not None:
+            worker.update(read_process_usage(capture.worker_pid))
+        workers.append(worker)
+        for key in totals:
+            totals[key] += worker[key]
+    
+    return {
+        'workers_enabled': workers_enabled(),
+        'worker_cpus': get_worker_cpus(),
+        'active_captures': len(workers),
+        'interfaces': sorted(set(worker['interface'] for worker in workers)),
+        'totals': totals,
+        'workers': workers
+    }
+
+def get_tcp_handshakes(min_syns=1):
+    """Per-destination TCP handshake statistics of all running captures
+
+    Combines this process's tracker (in-process captures) with the snapshots
+    capture workers write at each statistics checkpoint.
+    """
+    snapshots = [tcp_tracker.snapshot()]
+    reported = db.session.query(PacketCapture.id, PacketCapture.tcp_handshakes).filter(
+        PacketCapture.end_time == None,
+        PacketCapture.worker_pid != None,
+        PacketCapture.tcp_handshakes != None
+    ).all()
+    for capture_id, data in reported:
+        try:
+            snapshots.append(json.loads(data))
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable handshake snapshot of capture {capture_id}: {e}")
+    
+    return merge_snapshots(snapshots, min_syns=min_syns)
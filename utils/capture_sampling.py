@@ -0,0 +1,149 @@
+"""
+Packet sampling for high-rate captures
+
+Sampling decisions are made on the raw frame, before the packet is parsed,
+so dropped packets cost almost nothing. Each kept packet stands in for
+`rate` packets; its sample weight is stored with it so counts and byte
+totals computed from the packet table can be scaled back up.
+"""
+import logging
+import socket
+import struct
+import zlib
+from utils.pcap_store import LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Sampling modes
+SAMPLING_NONE = 'none'
+SAMPLING_SYSTEMATIC = 'systematic'  # deterministic 1-in-N
+SAMPLING_FLOW = 'flow'  # consistent per-flow hash
+SAMPLING_MODES = (SAMPLING_NONE, SAMPLING_SYSTEMATIC, SAMPLING_FLOW)
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+
+def network_layer(data, linktype=LINKTYPE_ETHERNET):
+    """Ethertype and offset of the network header in a raw frame (None if there is none)
+
+    Handles Ethernet (with 802.1Q/802.1ad tags), Linux cooked and raw IP frames.
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        offset = 12
+        ethertype = struct.unpack_from('!H', data, offset)[0]
+        while ethertype in ETHERTYPE_VLAN and len(data) >= offset + 6:
+            offset += 4
+            ethertype = struct.unpack_from('!H', data, offset)[0]
+        return ethertype, offset + 2
+    if linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        return struct.unpack_from('!H', data, 14)[0], 16
+    if linktype == LINKTYPE_RAW:
+        if not data:
+            return None
+        return (ETHERTYPE_IPV4 if data[0] >> 4 == 4 else ETHERTYPE_IPV6), 0
+    return None
+
+def frame_flow_key(data, linktype=LINKTYPE_ETHERNET):
+    """Extract a direction-independent flow key from a raw frame
+
+    Returns bytes identifying (protocol, endpoint pair), or None for frames
+    that are not IP.
+    """
+    network = network_layer(data, linktype)
+    if network is None:
+        return None
+    ethertype, offset = network
+
+    if ethertype == ETHERTYPE_IPV4 and len(data) >= offset + 20:
+        header_length = (data[offset] & 0x0f) * 4
+        protocol = data[offset + 9]
+        src = data[offset + 12:offset + 16]
+        dst = data[offset + 16:offset + 20]
+        transport = offset + header_length
+    elif ethertype == ETHERTYPE_IPV6 and len(data) >= offset + 40:
+        protocol = data[offset + 6]
+        src = data[offset + 8:offset + 24]
+        dst = data[offset + 24:offset + 40]
+        transport = offset + 40
+    else:
+        return None
+
+    if protocol in (6, 17) and len(data) >= transport + 4:
+        src += data[transport:transport + 2]
+        dst += data[transport + 2:transport + 4]
+
+    # Order the endpoints so both directions of a flow hash the same
+    if src > dst:
+        src, dst = dst, src
+    return bytes((protocol,)) + src + dst
+
+def frame_tcp_header(data, linktype=LINKTYPE_ETHERNET):
+    """(source ip, source port, destination ip, destination port, flag bits) of a raw frame's TCP header
+
+    A cheap look at the headers only, so packets that sampling skips can
+    still be fed to the handshake tracker. None for anything but unfragmented
+    TCP over IPv4, or TCP directly after the IPv6 header.
+    """
+    network = network_layer(data, linktype)
+    if network is None:
+        return None
+    ethertype, offset = network
+
+    if ethertype == ETHERTYPE_IPV4 and len(data) >= offset + 20:
+        if data[offset + 9] != 6 or struct.unpack_from('!H', data, offset + 6)[0] & 0x1fff:
+            return None
+        source = socket.inet_ntoa(data[offset + 12:offset + 16])
+        destination = socket.inet_ntoa(data[offset + 16:offset + 20])
+        transport = offset + (data[offset] & 0x0f) * 4
+    elif ethertype == ETHERTYPE_IPV6 and len(data) >= offset + 40:
+        if data[offset + 6] != 6:
+            return None
+        source = socket.inet_ntop(socket.AF_INET6, data[offset + 8:offset + 24])
+        destination = socket.inet_ntop(socket.AF_INET6, data[offset + 24:offset + 40])
+        transport = offset + 40
+    else:
+        return None
+
+    if len(data) < transport + 14:
+        return None
+    source_port, destination_port = struct.unpack_from('!HH', data, transport)
+    return source, source_port, destination, destination_port, data[transport + 13]
+
+class PacketSampler:
+    """Decide which packets of a capture to keep"""
+
+    def __init__(self, mode=SAMPLING_NONE, rate=1, linktype=LINKTYPE_ETHERNET):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode '{mode}'")
+        rate = int(rate or 1)
+        if rate < 1:
+            raise ValueError("Sampling rate must be at least 1")
+        self.mode = mode if rate > 1 else SAMPLING_NONE
+        self.rate = rate if self.mode != SAMPLING_NONE else 1
+        self.linktype = linktype  # Link type of the frames, for flow sampling
+        self.seen = 0
+        self.kept = 0
+
+    def keep(self, data):
+        """Whether to keep the packet whose raw frame is `data`"""
+        self.seen += 1
+
+        if self.mode == SAMPLING_SYSTEMATIC:
+            keep = self.seen % self.rate == 1 % self.rate
+        elif self.mode == SAMPLING_FLOW:
+            key = frame_flow_key(data, self.linktype)
+            # Non-IP frames have no flow; fall back to 1-in-N
+            keep = (zlib.crc32(key) if key is not None else self.seen) % self.rate == 0
+        else:
+            keep = True
+
+        if keep:
+            self.kept += 1
+        return keep
@@ -0,0 +1,81 @@
+"""
+Capture worker process
+
+Runs a single capture, described by its PacketCapture record, in its own
+process pinned to one CPU. Started by the capture manager as
+
+    python -m utils.capture_worker CAPTURE_ID [--cpu N]
+
+and stopped with SIGTERM, which flushes buffered packets and closes the
+capture record before exiting. Its TCP handshake tracker is reported to
+the agent with each statistics checkpoint, where SYN flood detection runs
+on the combined trackers.
+"""
+import os
+import sys
+import signal
+import logging
+import argparse
+import threading
+from app import app
+from utils import packet_capture
+from utils.packet_capture import run_packet_capture, stop_packet_capture, active_captures
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+stop_event = threading.Event()
+
+def parse_arguments():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description='NativeProbe capture worker')
+    parser.add_argument('capture_id', type=int, help='Capture record to run')
+    parser.add_argument('--cpu', type=int, default=None, help='CPU to pin the worker to')
+    return parser.parse_args()
+
+def pin_to_cpu(cpu):
+    """Restrict this process to a single CPU where the platform allows it"""
+    if cpu is None or not hasattr(os, 'sched_setaffinity'):
+        return
+    try:
+        os.sched_setaffinity(0, {cpu})
+        logger.info(f"Capture worker {os.getpid()} pinned to CPU {cpu}")
+    except OSError as e:
+        logger.warning(f"Could not pin capture worker to CPU {cpu}: {e}")
+
+def handle_signal(signum, frame):
+    """Request a clean shutdown"""
+    logger.info(f"Capture worker received signal {signum}, stopping")
+    stop_event.set()
+
+def main():
+    """Main entry point"""
+    args = parse_arguments()
+    
+    pin_to_cpu(args.cpu)
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    
+    packet_capture.report_tcp_handshakes = True
+    
+    capture = threading.Thread(target=run_packet_capture, args=(args.capture_id,), name='capture')
+    capture.daemon = True
+    capture.start()
+    
+    # Signals are delivered to the main thread, so wait here rather than in the capture
+    while capture.is_alive() and not stop_event.is_set():
+        stop_event.wait(1.0)
+    
+    if capture.is_alive():
+        with app.app_context():
+            if args.capture_id in active_captures:
+                stop_packet_capture(args.capture_id)
+        capture.join(timeout=30)
+    
+    stop_event.set()
+    logger.info(f"Capture worker for capture {args.capture_id} exiting")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
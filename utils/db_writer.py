@@ -0,0 +1,156 @@
+"""
+Single database writer for SQLite
+
+SQLite allows one writer at a time, so capture flushers, the flow
+collector and the anomaly detector writing through their own sessions
+end up waiting on each other's locks and paying an fsync per commit.
+With the writer enabled, those writes are queued to one thread per
+process, which runs them back to back and commits each group in a single
+transaction. Readers are not involved and, with WAL, proceed concurrently.
+
+A write is a function executed in the writer's session. It must not
+commit. Grouped writes are re-run on their own if their group fails, so
+they should take plain data (row mappings) rather than ORM objects;
+writes that can't be re-run are submitted with group=False.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app import app, db
+from config import Config
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+db_writer = None
+db_writer_lock = threading.Lock()
+
+def writer_enabled():
+    """Whether writes go through the writer thread (Config.DB_WRITER; 'auto' means SQLite only)"""
+    if Config.DB_WRITER == 'auto':
+        return app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+    return Config.DB_WRITER == 'on'
+
+class DatabaseWriter:
+    """Thread applying queued writes in grouped transactions"""
+
+    def __init__(self, max_batch=None, max_delay=None):
+        self.max_batch = max_batch or Config.DB_WRITER_MAX_BATCH
+        self.max_delay = Config.DB_WRITER_MAX_DELAY if max_delay is None else max_delay
+        self.jobs = queue.Queue()
+        self.stats = {'writes': 0, 'transactions': 0, 'failed': 0}
+        self.thread = threading.Thread(target=self._run, name='db-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, fn, *args, group=True):
+        """Queue fn(*args) and return a Future for its result"""
+        future = Future()
+        self.jobs.put((fn, args, group, future))
+        return future
+
+    def stop(self, timeout=10):
+        """Apply everything already queued, then stop the thread"""
+        self.jobs.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        """Collect queued writes into groups and apply them"""
+        with app.app_context():
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    return
+                batch = [job]
+                stopping = False
+
+                # Gather what is already queued, or arrives within max_delay
+                deadline = time.monotonic() + self.max_delay
+                while job[2] and len(batch) < self.max_batch:
+                    try:
+                        job = self.jobs.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        stopping = True
+                        break
+                    if not job[2]:
+                        # Ungrouped writes run in their own transaction, after this group
+                        self._apply(batch)
+                        batch = [job]
+                        break
+                    batch.append(job)
+
+                self._apply(batch)
+                if stopping:
+                    return
+
+    def _apply(self, batch):
+        """Run a group of writes in one transaction, falling back to one at a time on failure"""
+        try:
+            results = [fn(*args) for fn, args, group, future in batch]
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                self.stats['failed'] += 1
+                logger.error(f"Database write failed: {e}")
+                batch[0][3].set_exception(e)
+                return
+
+            # Isolate the failing write so the rest of the group still lands
+            for job in batch:
+                self._apply([job])
+            return
+
+        self.stats['writes'] += len(batch)
+        self.stats['transactions'] += 1
+        for (fn, args, group, future), result in zip(batch, results):
+            future.set_result(result)
+
+def get_db_writer():
+    """Start this process's writer thread on first use"""
+    global db_writer
+    with db_writer_lock:
+        if db_writer is None:
+            db_writer = DatabaseWriter()
+            atexit.register(stop_db_writer)
+        return db_writer
+
+def stop_db_writer():
+    """Flush and stop the writer thread"""
+    global db_writer
+    with db_writer_lock:
+        writer, db_writer = db_writer, None
+    if writer:
+        writer.stop()
+
+def submit_write(fn, *args, group=True):
+    """Run a write on the writer thread, or inline with its own commit when the writer is off
+
+    Returns a Future; call result() to wait for the commit and see any error.
+    """
+    if writer_enabled():
+        return get_db_writer().submit(fn, *args, group=group)
+
+    future = Future()
+    try:
+        result = fn(*args)
+        db.session.commit()
+        future.set_result(result)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Database write failed: {e}")
+        future.set_exception(e)
+    return future
+
+def get_writer_statistics():
+    """Writes and transactions applied by this process's writer"""
+    writer = db_writer
+    if writer is None:
+        return {'enabled': writer_enabled(), 'running': False}
+    return dict(writer.stats, enabled=True, running=writer.thread.is_alive(), queued=writer.jobs.qsize())
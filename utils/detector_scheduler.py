@@ -0,0 +1,146 @@
+"""
+Scheduler that runs anomaly detectors on independent cadences in a thread pool
+"""
+import logging
+import threading
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+class DetectorScheduler:
+    """Run each registered detector every `interval` seconds without overlap
+
+    A detector that is still running when it next falls due is skipped, and a
+    run that exceeds its timeout is reported as timed out. Python threads
+    cannot be killed, so a timed-out run keeps its worker until it returns but
+    never blocks the other detectors.
+    """
+
+    def __init__(self, max_workers=4, tick=1.0):
+        self.max_workers = max_workers
+        self.tick = tick
+        self.detectors = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.executor = None
+
+    def register(self, name, func, interval, timeout):
+        """Register a detector; func() returns (rows scanned, new events) and raises on failure"""
+        self.detectors[name] = {
+            'func': func,
+            'interval': interval,
+            'timeout': timeout,
+            'next_run': 0.0,
+            'future': None,
+            'started': None,
+            'timed_out': False,
+            'stats': {
+                'interval': interval,
+                'timeout': timeout,
+                'running': False,
+                'runs': 0,
+                'errors': 0,
+                'timeouts': 0,
+                'skipped_overlaps': 0,
+                'last_started': None,
+                'last_duration_ms': None,
+                'last_rows_scanned': None,
+                'last_events_raised': None,
+                'last_error': None,
+                'total_events_raised': 0
+            }
+        }
+
+    def start(self):
+        """Start the scheduling loop"""
+        if self.thread and self.thread.is_alive():
+            return False
+
+        self.stop_event.clear()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='detector')
+        self.thread = threading.Thread(target=self._loop, name='detector-scheduler')
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def stop(self, timeout=5.0):
+        """Stop scheduling new runs and wait briefly for running ones"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=timeout)
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        stopped = not (self.thread and self.thread.is_alive())
+        self.thread = None
+        self.executor = None
+        return stopped
+
+    def is_running(self):
+        """Whether the scheduling loop is alive"""
+        return bool(self.thread and self.thread.is_alive())
+
+    def _loop(self):
+        """Submit due detectors and watch running ones for timeouts"""
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+
+            with self.lock:
+                for name, detector in self.detectors.items():
+                    future = detector['future']
+
+                    if future is not None and not future.done():
+                        # Still running: check the timeout, never start an overlapping run
+                        if not detector['timed_out'] and now - detector['started'] > detector['timeout']:
+                            detector['timed_out'] = True
+                            detector['stats']['timeouts'] += 1
+                            logger.warning(f"Anomaly detector {name} exceeded its {detector['timeout']}s timeout")
+                        if now >= detector['next_run']:
+                            detector['stats']['skipped_overlaps'] += 1
+                            detector['next_run'] = now + detector['interval']
+                        continue
+
+                    if now >= detector['next_run']:
+                        detector['next_run'] = now + detector['interval']
+                        detector['started'] = now
+                        detector['timed_out'] = False
+                        detector['stats']['running'] = True
+                        detector['stats']['last_started'] = datetime.datetime.utcnow().isoformat()
+                        detector['future'] = self.executor.submit(self._run, name, detector)
+
+            self.stop_event.wait(self.tick)
+
+    def _run(self, name, detector):
+        """Run one detector and record its statistics"""
+        started = time.perf_counter()
+        rows_scanned, events_raised, error = None, None, None
+
+        try:
+            rows_scanned, events_raised = detector['func']()
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Error in anomaly detector {name}: {e}")
+
+        duration_ms = (time.perf_counter() - started) * 1000
+
+        with self.lock:
+            stats = detector['stats']
+            stats['running'] = False
+            stats['runs'] += 1
+            stats['last_duration_ms'] = round(duration_ms, 2)
+            stats['last_rows_scanned'] = rows_scanned
+            stats['last_events_raised'] = events_raised
+            if events_raised:
+                stats['total_events_raised'] += events_raised
+            if error:
+                stats['errors'] += 1
+                stats['last_error'] = error
+
+    def get_statistics(self):
+        """Per-detector run statistics"""
+        with self.lock:
+            return {name: dict(detector['stats']) for name, detector in self.detectors.items()}
@@ -0,0 +1,136 @@
+"""
+Server-side downsampling of chart series
+
+Time-series endpoints return at most a requested number of points per
+series instead of every stored row. Two shape-preserving selections are
+available, both picking existing points rather than averaging them:
+
+- 'lttb' (Largest-Triangle-Three-Buckets): one point per bucket, the one
+  forming the largest triangle with the previously selected point and the
+  next bucket's average. Buckets are visited in order because each choice
+  depends on the previous one; the work inside a bucket is vectorized.
+- 'minmax': the minimum and maximum of each bucket, fully vectorized, so
+  spikes are never dropped.
+
+numpy is imported on first use to keep it out of application startup.
+"""
+import datetime
+
+DOWNSAMPLING_METHODS = ('lttb', 'minmax', 'none')
+
+def seconds(value):
+    """A point's time (datetime or ISO string) as float seconds"""
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return (value - datetime.datetime(1970, 1, 1)).total_seconds()
+
+def lttb_indices(x, y, target):
+    """Indices of the target points LTTB keeps from x/y (sorted by x)"""
+    import numpy as np
+    n = len(x)
+    if target >= n or target < 3:
+        return np.arange(n)
+
+    # The first and last points are always kept; the rest form target - 2 buckets
+    edges = np.linspace(1, n - 1, target - 1).astype(int)
+    selected = np.empty(target, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+
+    previous = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        average_x = x[next_start:next_end].mean()
+        average_y = y[next_start:next_end].mean()
+
+        # Twice the triangle area for every candidate in the bucket at once
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        selected[i + 1] = previous
+
+    return selected
+
+def minmax_indices(y, target):
+    """Indices of the minimum and maximum of each of target / 2 equal buckets, plus both ends"""
+    import numpy as np
+    n = len(y)
+    if target >= n:
+        return np.arange(n)
+
+    buckets = max(target // 2 - 1, 1)
+    bucket_ids = (np.arange(n) * buckets) // n
+    # Sort by bucket, then value: each bucket's first entry is its minimum, its last the maximum
+    order = np.lexsort((y, bucket_ids))
+    starts = np.searchsorted(bucket_ids, np.arange(buckets))
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate(([0, n - 1], order[starts], order[ends])))
+
+def downsample(points, fields, target, method='lttb', time_key='timestamp'):
+    """Keep at most target of the time-ordered points, preserving the shape of each field
+
+    Each field is downsampled separately and the union of the chosen points
+    is returned, so every field's peaks survive and each returned point is
+    a complete original row. Fields start with an equal share of the
+    target; when their choices overlap the shares grow to use the rest.
+    With too many fields for a share each, points are chosen on the fields'
+    total instead. The result never exceeds target points.
+    """
+    if not target or method == 'none' or len(points) <= target:
+        return points
+    import numpy as np
+
+    x = np.array([seconds(point[time_key]) for point in points])
+    values = [np.array([point.get(field) or 0 for point in points], dtype=float) for field in fields]
+
+    def select(share):
+        keep = np.array([0, len(points) - 1])
+        for y in values:
+            if method == 'minmax':
+                keep = np.union1d(keep, minmax_indices(y, share))
+            else:
+                keep = np.union1d(keep, lttb_indices(x, y, share))
+        return keep
+
+    share = target // max(len(values), 1)
+    keep = select(share) if share >= 3 else None
+    if keep is None or len(keep) > target:
+        # No room for a share per field: keep the shape (and peaks) of their total
+        total = np.sum(values, axis=0) if values else np.zeros(len(points))
+        keep = minmax_indices(total, target) if method == 'minmax' else lttb_indices(x, total, target)
+    else:
+        for _ in range(3):
+            if len(keep) >= target * 0.9 or share >= target:
+                break
+            wider_share = min(target, share * target // len(keep))
+            wider = select(wider_share)
+            if len(wider) > target:
+                break
+            share, keep = wider_share, wider
+
+    if len(keep) > target:
+        # Targets too small for either method (a couple of points): spread them evenly
+        keep = keep[np.linspace(0, len(keep) - 1, target).astype(int)]
+
+    return [points[i] for i in keep]
+
+def downsample_series(points, fields, target, method='lttb', tag=None, time_key='timestamp'):
+    """Downsample each tag value's series to target points, returning them in time order"""
+    if not tag:
+        return downsample(points, fields, target, method, time_key)
+
+    series = {}
+    for point in points:
+        series.setdefault(point[tag], []).append(point)
+
+    result = []
+    for values in series.values():
+        result.extend(downsample(values, fields, target, method, time_key))
+    result.sort(key=lambda point: point[time_key])
+    return result
@@ -0,0 +1,229 @@
+"""
+Streaming export of packets and flows
+
+Exports read their rows through a server-side cursor (yield_per) in
+batches of EXPORT_BATCH_SIZE and encode each batch as it arrives, so the
+response is sent in chunks and memory stays flat however many rows match:
+
+- 'csv': a header row, then one line per row with ISO timestamps
+- 'parquet': one row group per batch (needs pyarrow)
+- 'pcap' (packets only): the stored frame of every packet, read by offset
+  from the capture's pcap files and merged into one file in query order
+"""
+import csv
+import datetime
+import io
+import itertools
+import logging
+import os
+import struct
+from flask import Response, stream_with_context
+from config import Config
+from models import CaptureSegment
+from utils.pcap_store import LINKTYPE_ETHERNET, PCAP_RECORD_HEADER, pcap_global_header, read_pcap_header, segment_file_path
+from utils.serialization import get_optional_module
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'parquet', 'pcap')
+
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'pcap': 'application/vnd.tcpdump.pcap'
+}
+
+def check_export_format(export_format, allowed=EXPORT_FORMATS):
+    """Raise ValueError unless the format is allowed and its encoder is available"""
+    if export_format not in allowed:
+        raise ValueError(f"Unsupported export format: {export_format} (expected one of {', '.join(allowed)})")
+    if export_format == 'parquet' and get_optional_module('pyarrow') is None:
+        raise ValueError("Parquet export requires the pyarrow package")
+
+def iter_batches(query):
+    """Yield lists of up to EXPORT_BATCH_SIZE rows, fetched through a server-side cursor"""
+    rows = iter(query.yield_per(Config.EXPORT_BATCH_SIZE))
+    while True:
+        batch = list(itertools.islice(rows, Config.EXPORT_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+def stream_csv(query):
+    """Yield a CSV file of the query's rows, one chunk per batch"""
+    columns = [column['name'] for column in query.column_descriptions]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+
+    for batch in iter_batches(query):
+        writer.writerows(
+            [value.isoformat() if isinstance(value, datetime.datetime) else value for value in row]
+            for row in batch
+        )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header only when nothing matched
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands back what was written since the last take()"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        """Bytes written since the last call"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def arrow_type(column_type):
+    """Arrow type for a SQLAlchemy column type"""
+    import pyarrow as pa
+    python_type = column_type.python_type
+    if python_type is datetime.datetime:
+        return pa.timestamp('us')
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    return pa.string()
+
+def stream_parquet(query):
+    """Yield a Parquet file of the query's rows, one row group per batch"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        (column['name'], arrow_type(column['type'])) for column in query.column_descriptions
+    ])
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for batch in iter_batches(query):
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+class FrameReader:
+    """Reads stored frames of one capture by (segment, offset), one file open at a time"""
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.segment_paths = {
+            segment.sequence: segment.file_path
+            for segment in CaptureSegment.query.filter_by(capture_id=capture.id)
+        }
+        self.current = None  # (segment, file, record header struct)
+        self.linktype = None
+
+    def path(self, segment):
+        """Pcap file holding the frames of a segment (None for a single-file capture)"""
+        if segment is None:
+            return self.capture.file_path
+        # The segment being written may not be synced yet
+        return self.segment_paths.get(segment) or segment_file_path(self.capture.id, segment)
+
+    def open(self, segment):
+        """Switch to a segment's file; False if it is gone"""
+        if self.current and self.current[0] == segment:
+            return True
+        self.close()
+        path = self.path(segment)
+        if not path or not os.path.exists(path):
+            return False
+        f = open(path, 'rb')
+        order, linktype = read_pcap_header(f)
+        if self.linktype is None:
+            self.linktype = linktype
+        self.current = (segment, f, struct.Struct(order + 'IIII'))
+        return True
+
+    def read(self, segment, offset):
+        """A frame's record (header in little-endian order, then data), or None if unavailable"""
+        if not self.open(segment):
+            return None
+        _, f, record_header = self.current
+        f.seek(offset)
+        header = f.read(record_header.size)
+        if len(header) < record_header.size:
+            return None
+        seconds, microseconds, captured_length, original_length = record_header.unpack(header)
+        data = f.read(captured_length)
+        if len(data) < captured_length:
+            return None
+        return PCAP_RECORD_HEADER.pack(seconds, microseconds, captured_length, original_length) + data
+
+    def close(self):
+        """Close the open file"""
+        if self.current:
+            self.current[1].close()
+            self.current = None
+
+def stream_frames(capture, query, chunk_size=1 << 20):
+    """Yield a pcap file of the frames of the query's (pcap_segment, pcap_offset) rows"""
+    reader = FrameReader(capture)
+    chunk = []
+    chunk_bytes = 0
+    header_written = False
+    missing = 0
+
+    try:
+        for batch in iter_batches(query):
+            for segment, offset in batch:
+                record = reader.read(segment, offset) if offset is not None else None
+                if record is None:
+                    missing += 1
+                    continue
+                if not header_written:
+                    chunk.append(pcap_global_header('<', reader.linktype, capture.snap_length))
+                    header_written = True
+                chunk.append(record)
+                chunk_bytes += len(record)
+                if chunk_bytes >= chunk_size:
+                    yield b''.join(chunk)
+                    chunk, chunk_bytes = [], 0
+    finally:
+        reader.close()
+
+    if missing:
+        logger.info(f"Pcap export of capture {capture.id} skipped {missing} packets without a stored frame")
+    if not header_written:
+        # No frames: still return a valid, empty pcap file
+        chunk.append(pcap_global_header('<', capture.linktype or LINKTYPE_ETHERNET, capture.snap_length))
+    yield b''.join(chunk)
+
+def export_response(chunks, export_format, filename):
+    """Chunked download response for an export generator"""
+    return Response(
+        stream_with_context(chunks),
+        mimetype=EXPORT_MIMETYPES[export_format],
+        headers={'Content-Disposition': f'attachment; filename={filename}.{export_format}'}
+    )
@@ -10,6 +10,17 @@ import time
 import os
 from app import db, app
 from models import FlowRecord
+from utils.db_writer import submit_write
+from utils.bulk_loader import bulk_insert
+from utils.bandwidth import record_sflow_counters
+from utils.packet_record import EPOCH
+from utils.flow_exporter import (
+    V9_HEADER, IPFIX_HEADER, SET_HEADER, V9_TEMPLATE_SET_ID, V9_OPTIONS_SET_ID, IPFIX_TEMPLATE_SET_ID,
+    IPFIX_OPTIONS_SET_ID, MIN_DATA_SET_ID, IN_BYTES, IN_PKTS, PROTOCOL, SRC_TOS, TCP_FLAGS, L4_SRC_PORT,
+    IPV4_SRC_ADDR, INPUT_SNMP, L4_DST_PORT, IPV4_DST_ADDR, OUTPUT_SNMP, LAST_SWITCHED, FIRST_SWITCHED,
+    IPV6_SRC_ADDR, IPV6_DST_ADDR, OCTET_TOTAL_COUNT, PACKET_TOTAL_COUNT, FLOW_START_SECONDS,
+    FLOW_END_SECONDS, FLOW_START_MILLISECONDS, FLOW_END_MILLISECONDS
+)
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -20,6 +31,16 @@ collector_thread = None
 stop_collector = False
 collector_socket = None
 flow_collector_thread = None # Added global variable
+collector_config = {}  # flow_type and port of the running collector
+flow_templates = {}  # v9/IPFIX templates by (exporter address, version, source id, template id)
+
+# Template fields decoded into FlowRecord columns
+FLOW_FIELDS = {
+    IN_BYTES, IN_PKTS, PROTOCOL, SRC_TOS, TCP_FLAGS, L4_SRC_PORT, IPV4_SRC_ADDR, INPUT_SNMP,
+    L4_DST_PORT, IPV4_DST_ADDR, OUTPUT_SNMP, LAST_SWITCHED, FIRST_SWITCHED, IPV6_SRC_ADDR,
+    IPV6_DST_ADDR, OCTET_TOTAL_COUNT, PACKET_TOTAL_COUNT, FLOW_START_SECONDS, FLOW_END_SECONDS,
+    FLOW_START_MILLISECONDS, FLOW_END_MILLISECONDS
+}
 
 
 def start_flow_collector(flow_type='netflow', port=9995):
@@ -28,14 +49,13 @@ def start_flow_collector(flow_type='netflow', port=9995):
     
     logger.info(f"Starting {flow_type} collector on port {port}")
     try:
-        # Check permissions
-        if os.geteuid() != 0:
-            raise PermissionError("Root privileges required for flow collection")
+        # Only privileged ports need root
+        if port < 1024 and hasattr(os, 'geteuid') and os.geteuid() != 0:
+            raise PermissionError(f"Root privileges required to listen on port {port}")
 
         if flow_collector_thread and flow_collector_thread.is_alive():
             logger.warning("Flow collector already running")
             return False
-        return False
     except PermissionError as e:
         logger.error(f"Permission error: {e}")
         return False
@@ -44,6 +64,7 @@ def start_flow_collector(flow_type='netflow', port=9995):
         return False
 
     stop_collector = False
+    collector_config.update({'flow_type': flow_type, 'port': port})
 
     def collect_flows():
         global stop_collector, collector_socket
@@ -113,8 +134,18 @@ def stop_flow_collector():
         logger.info("Flow collector stopped successfully")
 
     flow_collector_thread = None
+    collector_config.clear()
     return True
 
+def get_flow_collector_status():
+    """Whether the flow collector is running, and on which port"""
+    running = bool(flow_collector_thread and flow_collector_thread.is_alive())
+    return {
+        'running': running,
+        'flow_type': collector_config.get('flow_type') if running else None,
+        'port': collector_config.get('port') if running else None
+    }
+
 def process_netflow(data, addr):
     """Process NetFlow data"""
     try:
@@ -125,6 +156,8 @@ def process_netflow(data, addr):
             process_netflow_v5(data, addr)
         elif version == 9:
             process_netflow_v9(data, addr)
+        elif version == 10:
+            process_ipfix(data, addr)
         else:
             logger.warning(f"Unsupported NetFlow version: {version}")
 
@@ -147,12 +180,13 @@ def process_netflow_v5(data, addr):
         sampling_interval = header[8]
 
         # Process each flow record
+        flow_records = []
         for i in range(count):
             # Calculate record offset
             offset = 24 + (i * 48)  # 24-byte header + 48-byte records
 
             # Parse record fields
-            record = struct.unpack('!IIIIHH', data[offset:offset+16])
+            record = struct.unpack('!IIIHH', data[offset:offset+16])
             src_addr = socket.inet_ntoa(data[offset:offset+4])
             dst_addr = socket.inet_ntoa(data[offset+4:offset+8])
             next_hop = socket.inet_ntoa(data[offset+8:offset+12])
@@ -160,128 +194,274 @@ def process_netflow_v5(data, addr):
             output_if = record[4]
 
             # More fields
-            record2 = struct.unpack('!IIIIIHBB', data[offset+16:offset+36])
+            record2 = struct.unpack('!IIIIHHBBBB', data[offset+16:offset+40])
             d_pkts = record2[0]
             d_octets = record2[1]
             first_time = record2[2]
             last_time = record2[3]
-            src_port = record2[4] >> 16
-            dst_port = record2[4] & 0xFFFF
-            tcp_flags = record2[6]
-            protocol = record2[7]
-
-            # Create a FlowRecord
-            flow_record = FlowRecord(
-                timestamp=datetime.datetime.utcnow(),
-                flow_type='NetFlow-v5',
-                source_ip=src_addr,
-                destination_ip=dst_addr,
-                source_port=src_port,
-                destination_port=dst_port,
-                protocol=protocol,
-                bytes=d_octets,
-                packets=d_pkts,
-                start_time=datetime.datetime.fromtimestamp(unix_secs - (sys_uptime - first_time) / 1000),
-                end_time=datetime.datetime.fromtimestamp(unix_secs - (sys_uptime - last_time) / 1000),
-                tcp_flags=tcp_flags,
-                input_interface=input_if,
-                output_interface=output_if
-            )
-
-            db.session.add(flow_record)
-
-        db.session.commit()
+            src_port = record2[4]
+            dst_port = record2[5]
+            tcp_flags = record2[7]
+            protocol = record2[8]
+
+            # Create a FlowRecord row
+            flow_records.append({
+                'timestamp': datetime.datetime.utcnow(),
+                'flow_type': 'NetFlow-v5',
+                'source_ip': src_addr,
+                'destination_ip': dst_addr,
+                'source_port': src_port,
+                'destination_port': dst_port,
+                'protocol': protocol,
+                'bytes': d_octets,
+                'packets': d_pkts,
+                'start_time': EPOCH + datetime.timedelta(seconds=unix_secs - (sys_uptime - first_time) / 1000),
+                'end_time': EPOCH + datetime.timedelta(seconds=unix_secs - (sys_uptime - last_time) / 1000),
+                'tcp_flags': tcp_flags,
+                'input_interface': input_if,
+                'output_interface': output_if
+            })
+
+        # Queued without waiting so the collector keeps draining its socket
+        if flow_records:
+            submit_write(store_flow_records, flow_records)
 
     except Exception as e:
         logger.error(f"Error processing NetFlow v5 data: {e}")
-        db.session.rollback()
+
+def store_flow_records(rows):
+    """Bulk load flow record rows"""
+    bulk_insert(FlowRecord, rows)
 
 def process_netflow_v9(data, addr):
-    """Process NetFlow v9 data (simplified implementation)"""
+    """Process a NetFlow v9 export packet: learn its templates and decode its data FlowSets"""
     try:
-        # This is a simplified implementation - full NetFlow v9 parsing is complex
-        # due to templates and variable field definitions
-
-        # Parse NetFlow v9 header
-        header = struct.unpack('!HHIIII', data[0:20])
-        version = header[0]
-        count = header[1]  # Number of FlowSets in this packet
-        sys_uptime = header[2]
-        unix_secs = header[3]
-        package_sequence = header[4]
-        source_id = header[5]
-
-        logger.info(f"Received NetFlow v9 packet with {count} FlowSets")
-
-        # In a real implementation, you would:
-        # 1. Parse template FlowSets and store templates
-        # 2. Parse data FlowSets using the appropriate templates
-        # 3. Convert the data to FlowRecord objects
-
-        # For now, just log the reception of the packet
-        # Implementation of full NetFlow v9 parsing is beyond the scope of this example
-
+        version, count, sys_uptime, unix_secs, package_sequence, source_id = V9_HEADER.unpack(data[:V9_HEADER.size])
+        
+        # Uptime-relative timestamps become absolute through the header's clock
+        def switched_time(uptime_ms):
+            return EPOCH + datetime.timedelta(seconds=unix_secs - (sys_uptime - uptime_ms) / 1000)
+        
+        flow_records = process_template_sets(
+            data, V9_HEADER.size, len(data), (addr[0], 9, source_id),
+            V9_TEMPLATE_SET_ID, V9_OPTIONS_SET_ID, 'NetFlow-v9', switched_time
+        )
+        
+        # Queued without waiting so the collector keeps draining its socket
+        if flow_records:
+            submit_write(store_flow_records, flow_records)
+    
     except Exception as e:
         logger.error(f"Error processing NetFlow v9 data: {e}")
 
 def process_ipfix(data, addr):
-    """Process IPFIX data (simplified implementation)"""
+    """Process an IPFIX message: learn its templates and decode its data sets"""
     try:
-        # This is a simplified implementation - full IPFIX parsing is complex
-        # IPFIX is based on NetFlow v9 but with some differences
-
-        # Parse IPFIX header
-        header = struct.unpack('!HHHIIQ', data[0:16])
-        version = header[0]
-        length = header[1]
-        export_time = header[2]
-        sequence_number = header[3]
-        observation_domain_id = header[4]
-
-        logger.info(f"Received IPFIX packet of length {length}")
-
-        # In a real implementation, you would:
-        # 1. Parse template sets and store templates
-        # 2. Parse data sets using the appropriate templates
-        # 3. Convert the data to FlowRecord objects
-
-        # For now, just log the reception of the packet
-        # Implementation of full IPFIX parsing is beyond the scope of this example
-
+        version, length, export_time, sequence_number, observation_domain_id = IPFIX_HEADER.unpack(data[:IPFIX_HEADER.size])
+        if version != 10:
+            logger.warning(f"Unsupported IPFIX version: {version}")
+            return
+        
+        flow_records = process_template_sets(
+            data, IPFIX_HEADER.size, min(length, len(data)), (addr[0], 10, observation_domain_id),
+            IPFIX_TEMPLATE_SET_ID, IPFIX_OPTIONS_SET_ID, 'IPFIX', None
+        )
+        
+        if flow_records:
+            submit_write(store_flow_records, flow_records)
+    
     except Exception as e:
         logger.error(f"Error processing IPFIX data: {e}")
 
+def process_template_sets(data, offset, end, domain, template_set_id, options_set_id, flow_type, switched_time):
+    """Walk the sets of a v9/IPFIX packet, storing templates and returning FlowRecord rows
+
+    Templates are kept per (exporter address, version, source/domain id) so
+    exporters and observation domains never share template ids.
+    """
+    flow_records = []
+    while offset + SET_HEADER.size <= end:
+        set_id, set_length = SET_HEADER.unpack(data[offset:offset + SET_HEADER.size])
+        if set_length < SET_HEADER.size:
+            break  # Malformed; the rest of the packet can't be located
+        body = data[offset + SET_HEADER.size:min(offset + set_length, end)]
+        offset += set_length
+        
+        if set_id == template_set_id:
+            parse_templates(body, domain, ipfix=flow_type == 'IPFIX')
+        elif set_id == options_set_id:
+            continue  # Options (exporter metadata) are not used
+        elif set_id >= MIN_DATA_SET_ID:
+            template = flow_templates.get(domain + (set_id,))
+            if template is None:
+                logger.debug(f"Data set for unknown template {set_id} from {domain[0]}")
+                continue
+            flow_records.extend(decode_data_set(body, template, flow_type, switched_time))
+    return flow_records
+
+def parse_templates(body, domain, ipfix=False):
+    """Store the templates of a template set as [(field type, length), ...]"""
+    offset = 0
+    while offset + 4 <= len(body):
+        template_id, field_count = struct.unpack('!HH', body[offset:offset + 4])
+        offset += 4
+        if template_id < MIN_DATA_SET_ID:
+            break  # Padding
+        fields = []
+        for _ in range(field_count):
+            field_type, length = struct.unpack('!HH', body[offset:offset + 4])
+            offset += 4
+            # IPFIX enterprise-specific elements carry an enterprise number; they are skipped when decoding
+            if ipfix and field_type & 0x8000:
+                offset += 4
+                field_type = None
+            fields.append((field_type, length))
+        flow_templates[domain + (template_id,)] = fields
+
+def decode_data_set(body, fields, flow_type, switched_time):
+    """FlowRecord rows for the records of a data set"""
+    fixed_size = None if any(length == 0xffff for _, length in fields) else sum(length for _, length in fields)
+    if fixed_size == 0:
+        return []
+    
+    rows = []
+    offset = 0
+    while offset < len(body):
+        if fixed_size is not None and offset + fixed_size > len(body):
+            break  # Padding
+        values = {}
+        for field_type, length in fields:
+            if length == 0xffff:
+                # IPFIX variable-length field
+                if offset >= len(body):
+                    break
+                length = body[offset]
+                offset += 1
+                if length == 255:
+                    length = struct.unpack('!H', body[offset:offset + 2])[0]
+                    offset += 2
+            if field_type in FLOW_FIELDS:
+                values[field_type] = body[offset:offset + length]
+            offset += length
+        if offset > len(body):
+            break
+        
+        row = flow_record_row(values, flow_type, switched_time)
+        if row:
+            rows.append(row)
+    return rows
+
+def flow_record_row(values, flow_type, switched_time):
+    """FlowRecord column mapping from a record's raw field values, or None without addresses"""
+    def number(*field_types):
+        for field_type in field_types:
+            if field_type in values:
+                return int.from_bytes(values[field_type], 'big')
+        return None
+    
+    def address(*field_types):
+        for field_type in field_types:
+            value = values.get(field_type)
+            if value and len(value) in (4, 16):
+                return socket.inet_ntop(socket.AF_INET if len(value) == 4 else socket.AF_INET6, value)
+        return None
+    
+    source_ip = address(IPV4_SRC_ADDR, IPV6_SRC_ADDR)
+    destination_ip = address(IPV4_DST_ADDR, IPV6_DST_ADDR)
+    if not source_ip or not destination_ip:
+        return None
+    
+    # Flow times: uptime-relative (v9) or absolute (IPFIX)
+    start_time = end_time = None
+    if switched_time and FIRST_SWITCHED in values:
+        start_time = switched_time(number(FIRST_SWITCHED))
+        end_time = switched_time(number(LAST_SWITCHED)) if LAST_SWITCHED in values else start_time
+    elif FLOW_START_MILLISECONDS in values:
+        start_time = EPOCH + datetime.timedelta(milliseconds=number(FLOW_START_MILLISECONDS))
+        if FLOW_END_MILLISECONDS in values:
+            end_time = EPOCH + datetime.timedelta(milliseconds=number(FLOW_END_MILLISECONDS))
+    elif FLOW_START_SECONDS in values:
+        start_time = EPOCH + datetime.timedelta(seconds=number(FLOW_START_SECONDS))
+        if FLOW_END_SECONDS in values:
+            end_time = EPOCH + datetime.timedelta(seconds=number(FLOW_END_SECONDS))
+    
+    return {
+        'timestamp': datetime.datetime.utcnow(),
+        'flow_type': flow_type,
+        'source_ip': source_ip,
+        'destination_ip': destination_ip,
+        'source_port': number(L4_SRC_PORT),
+        'destination_port': number(L4_DST_PORT),
+        'protocol': number(PROTOCOL),
+        'bytes': number(IN_BYTES, OCTET_TOTAL_COUNT),
+        'packets': number(IN_PKTS, PACKET_TOTAL_COUNT),
+        'start_time': start_time,
+        'end_time': end_time,
+        'tcp_flags': number(TCP_FLAGS),
+        'tos': number(SRC_TOS),
+        'input_interface': number(INPUT_SNMP),
+        'output_interface': number(OUTPUT_SNMP)
+    }
+
 def process_sflow(data, addr):
-    """Process sFlow data (simplified implementation)"""
+    """Process sFlow v5 data: interface counter samples feed bandwidth accounting"""
     try:
-        # This is a simplified implementation - full sFlow parsing is complex
-
-        # Parse sFlow header
-        version = struct.unpack('!i', data[0:4])[0]
-
-        if version == 5:
-            header = struct.unpack('!iiiii', data[0:20])
-            version = header[0]
-            ip_version = header[1]
-            agent_ip = header[2]  # This is the IP address in raw format
-            sub_agent_id = header[3]
-            sequence_number = header[4]
-
-            logger.info(f"Received sFlow v5 packet from {addr[0]}")
-
-            # In a real implementation, you would:
-            # 1. Parse sample data
-            # 2. Extract flow records
-            # 3. Convert the data to FlowRecord objects
-
-            # For now, just log the reception of the packet
-            # Implementation of full sFlow parsing is beyond the scope of this example
-        else:
+        version = struct.unpack('!I', data[0:4])[0]
+        if version != 5:
             logger.warning(f"Unsupported sFlow version: {version}")
-
+            return
+        
+        # Datagram header; the agent address is IPv4 (type 1) or IPv6 (type 2)
+        address_type = struct.unpack('!I', data[4:8])[0]
+        if address_type == 1:
+            agent = socket.inet_ntop(socket.AF_INET, data[8:12])
+            offset = 12
+        elif address_type == 2:
+            agent = socket.inet_ntop(socket.AF_INET6, data[8:24])
+            offset = 24
+        else:
+            logger.warning(f"Unknown sFlow agent address type {address_type} from {addr[0]}")
+            return
+        sub_agent_id, sequence_number, uptime, sample_count = struct.unpack('!IIII', data[offset:offset + 16])
+        offset += 16
+        
+        for _ in range(sample_count):
+            sample_format, sample_length = struct.unpack('!II', data[offset:offset + 8])
+            sample = data[offset + 8:offset + 8 + sample_length]
+            offset += 8 + sample_length
+            
+            # Counter samples (enterprise 0): format 2, or 4 for the expanded form
+            if sample_format == 2:
+                record_count = struct.unpack('!I', sample[8:12])[0]
+                process_sflow_counter_records(agent, sample, 12, record_count)
+            elif sample_format == 4:
+                record_count = struct.unpack('!I', sample[12:16])[0]
+                process_sflow_counter_records(agent, sample, 16, record_count)
+            # Flow samples (packet headers) are not parsed yet
+    
     except Exception as e:
         logger.error(f"Error processing sFlow data: {e}")
 
+def process_sflow_counter_records(agent, sample, offset, record_count):
+    """Feed the generic interface counter records of a counter sample to bandwidth accounting"""
+    for _ in range(record_count):
+        record_format, record_length = struct.unpack('!II', sample[offset:offset + 8])
+        record = sample[offset + 8:offset + 8 + record_length]
+        offset += 8 + record_length
+        
+        # Generic interface counters (enterprise 0, format 1)
+        if record_format != 1 or len(record) < 88:
+            continue
+        counters = struct.unpack('!IIQIIQIIIIIIQIIIIII', record[:88])
+        if_index = counters[0]
+        in_octets, in_ucast, in_multicast, in_broadcast = counters[5:9]
+        out_octets, out_ucast, out_multicast, out_broadcast = counters[12:16]
+        record_sflow_counters(
+            agent, if_index, in_octets, out_octets,
+            (in_ucast + in_multicast + in_broadcast) % (1 << 32),
+            (out_ucast + out_multicast + out_broadcast) % (1 << 32)
+        )
+
 def analyze_flow_data(start_time=None, end_time=None):
     """Analyze flow data from the database"""
     query = db.session.query(FlowRecord)
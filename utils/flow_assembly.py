@@ -0,0 +1,260 @@
+"""
+Bidirectional flow assembly from captured packets
+
+Captured packets are grouped into conversations keyed by their normalized
+5-tuple (protocol plus both endpoints, lower endpoint first), so both
+directions of a connection land in the same flow. The side that sent the
+first packet is the initiator (for TCP, the sender of the SYN when the
+SYN-ACK was seen first); the other side's packets, bytes and TCP flags
+are kept in the reverse counters.
+
+A flow is emitted as a FlowRecord row (flow_type 'Capture') when it has
+been idle for FLOW_IDLE_TIMEOUT, when it has been active for
+FLOW_ACTIVE_TIMEOUT (long conversations are reported in slices, as a
+NetFlow exporter would), when TCP closes it with a RST or the ACK of the
+second FIN, when it is evicted from a full table, or when the capture ends.
+Timeouts run on packet time, so replaying a stored capture gives the same
+flows as assembling it live.
+"""
+import logging
+from collections import OrderedDict
+from app import db
+from config import Config
+from models import FlowRecord, Packet
+from utils.bulk_loader import bulk_insert
+from utils.db_writer import submit_write
+from utils.protocol_dissection import PROTOCOL_MAP
+from utils.tcp_tracker import TCP_ACK, TCP_FIN, TCP_RST, TCP_SYN, flags_to_mask
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+FLOW_TYPE = 'Capture'
+
+# IP protocol numbers by the names the capture parsers report
+PROTOCOL_NUMBERS = {name: number for number, name in PROTOCOL_MAP.items()}
+PROTOCOL_NUMBERS['ICMPV6'] = 58
+
+def ip_protocol(row):
+    """IP protocol number of a Packet row mapping (None if it can't be told)"""
+    if row['tcp_flags'] is not None:
+        return 6
+    number = PROTOCOL_NUMBERS.get((row['protocol'] or '').upper())
+    if number is not None:
+        return number
+    # Application protocols over UDP (DNS, NTP, ...) keep their ports
+    if row['source_port'] is not None:
+        return 17
+    return None
+
+class Flow:
+    """Counters of one bidirectional conversation"""
+    __slots__ = ('key', 'source_ip', 'source_port', 'destination_ip', 'destination_port', 'protocol',
+                 'start_time', 'end_time', 'packets', 'bytes', 'tcp_flags',
+                 'reverse_packets', 'reverse_bytes', 'reverse_tcp_flags', 'fins')
+
+    def __init__(self, key, row, protocol):
+        self.key = key
+        self.source_ip = row['source_ip']
+        self.source_port = row['source_port']
+        self.destination_ip = row['destination_ip']
+        self.destination_port = row['destination_port']
+        self.protocol = protocol
+        self.start_time = row['timestamp']
+        self.end_time = row['timestamp']
+        self.packets = self.bytes = self.tcp_flags = 0
+        self.reverse_packets = self.reverse_bytes = self.reverse_tcp_flags = 0
+        self.fins = 0  # Directions that have sent a FIN (bit 1 initiator, bit 2 responder)
+
+    def swap(self):
+        """Make the other endpoint the initiator"""
+        self.source_ip, self.destination_ip = self.destination_ip, self.source_ip
+        self.source_port, self.destination_port = self.destination_port, self.source_port
+        self.packets, self.reverse_packets = self.reverse_packets, self.packets
+        self.bytes, self.reverse_bytes = self.reverse_bytes, self.bytes
+        self.tcp_flags, self.reverse_tcp_flags = self.reverse_tcp_flags, self.tcp_flags
+        self.fins = ((self.fins & 1) << 1) | ((self.fins & 2) >> 1)
+
+    def to_row(self, capture_id=None):
+        """FlowRecord column mapping"""
+        tcp = self.protocol == 6
+        return {
+            'timestamp': self.end_time,
+            'flow_type': FLOW_TYPE,
+            'capture_id': capture_id,
+            'source_ip': self.source_ip,
+            'destination_ip': self.destination_ip,
+            'source_port': self.source_port,
+            'destination_port': self.destination_port,
+            'protocol': self.protocol,
+            'bytes': self.bytes,
+            'packets': self.packets,
+            'reverse_bytes': self.reverse_bytes,
+            'reverse_packets': self.reverse_packets,
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'tcp_flags': self.tcp_flags if tcp else None,
+            'reverse_tcp_flags': self.reverse_tcp_flags if tcp else None
+        }
+
+class FlowTable:
+    """Bounded hash table of active conversations
+
+    Flows are kept in order of their last packet, so idle ones are found
+    at the front and the least recently active flow is the one evicted
+    when the table is full. Completed flows collect in a pending list
+    until drained.
+    """
+
+    def __init__(self, capture_id=None, idle_timeout=None, active_timeout=None, max_flows=None):
+        self.capture_id = capture_id
+        self.idle_timeout = idle_timeout or Config.FLOW_IDLE_TIMEOUT
+        self.active_timeout = active_timeout or Config.FLOW_ACTIVE_TIMEOUT
+        self.max_flows = max_flows or Config.FLOW_TABLE_MAX_FLOWS
+        self.flows = OrderedDict()
+        self.pending = []
+        self.clock = None  # Timestamp of the latest packet seen
+        self.packets = 0
+        self.emitted = 0
+        self.evictions = 0
+
+    def add(self, rows):
+        """Fold a batch of Packet row mappings (in capture order) into the table"""
+        for row in rows:
+            if not row['source_ip'] or not row['destination_ip']:
+                continue  # Not IP traffic
+            self.packets += 1
+            timestamp = row['timestamp']
+            if self.clock is None or timestamp > self.clock:
+                self.clock = timestamp
+
+            protocol = ip_protocol(row)
+            source = (row['source_ip'], row['source_port'] or 0)
+            destination = (row['destination_ip'], row['destination_port'] or 0)
+            key = (protocol,) + (source + destination if source <= destination else destination + source)
+
+            flow = self.flows.get(key)
+            if flow is not None and (timestamp - flow.end_time).total_seconds() >= self.idle_timeout:
+                # Idle past the timeout before this batch expired it
+                self.emit(self.flows.pop(key))
+                flow = None
+            if flow is None:
+                flow = Flow(key, row, protocol)
+                self.flows[key] = flow
+                if len(self.flows) > self.max_flows:
+                    self.emit(self.flows.popitem(last=False)[1])
+                    self.evictions += 1
+            else:
+                self.flows.move_to_end(key)
+
+            weight = row['sample_weight'] or 1
+            length = (row['length'] or 0) * weight
+            flags = flags_to_mask(row['tcp_flags']) if row['tcp_flags'] is not None else 0
+            forward = row['source_ip'] == flow.source_ip and (row['source_port'] or 0) == (flow.source_port or 0)
+
+            # A SYN-ACK seen before anything else means the other side initiated
+            if not flow.packets and not flow.reverse_packets and forward and flags & TCP_SYN and flags & TCP_ACK:
+                flow.swap()
+                forward = False
+
+            if forward:
+                flow.packets += weight
+                flow.bytes += length
+                flow.tcp_flags |= flags
+                if flags & TCP_FIN:
+                    flow.fins |= 1
+            else:
+                flow.reverse_packets += weight
+                flow.reverse_bytes += length
+                flow.reverse_tcp_flags |= flags
+                if flags & TCP_FIN:
+                    flow.fins |= 2
+            flow.end_time = max(flow.end_time, timestamp)
+
+            if flags & TCP_RST:
+                self.emit(self.flows.pop(key))
+            elif flow.fins == 3 and not flags & TCP_FIN:
+                # The ACK of the second FIN closes the connection
+                self.emit(self.flows.pop(key))
+            elif (flow.end_time - flow.start_time).total_seconds() >= self.active_timeout:
+                # Report long conversations in slices; the next packet starts a new one
+                self.emit(self.flows.pop(key))
+
+    def emit(self, flow):
+        """Move a completed flow to the pending list"""
+        self.pending.append(flow.to_row(self.capture_id))
+        self.emitted += 1
+
+    def drain(self, final=False):
+        """Expire idle flows (or every flow when final) and return the pending FlowRecord rows"""
+        if final:
+            while self.flows:
+                self.emit(self.flows.popitem(last=False)[1])
+        elif self.clock is not None:
+            while self.flows:
+                flow = next(iter(self.flows.values()))
+                if (self.clock - flow.end_time).total_seconds() < self.idle_timeout:
+                    break
+                self.emit(self.flows.popitem(last=False)[1])
+
+        rows, self.pending = self.pending, []
+        return rows
+
+    def get_statistics(self):
+        """Table occupancy and counters"""
+        return {
+            'active_flows': len(self.flows),
+            'packets': self.packets,
+            'emitted': self.emitted,
+            'evictions': self.evictions,
+            'max_flows': self.max_flows
+        }
+
+def delete_capture_flows(capture_id):
+    """Delete the conversations previously assembled from a capture"""
+    FlowRecord.query.filter_by(capture_id=capture_id, flow_type=FLOW_TYPE).delete(synchronize_session=False)
+
+def store_flow_rows(rows):
+    """Bulk load assembled flow rows"""
+    bulk_insert(FlowRecord, rows)
+
+def assemble_capture_flows(capture_id):
+    """Rebuild a capture's conversations from its stored packets; returns the number of flows"""
+    table = FlowTable(capture_id)
+    submit_write(delete_capture_flows, capture_id).result()
+
+    # Read on a connection of its own so the writer's commits don't end the cursor
+    statement = db.select(
+        Packet.timestamp,
+        Packet.protocol,
+        Packet.source_ip,
+        Packet.destination_ip,
+        Packet.source_port,
+        Packet.destination_port,
+        Packet.length,
+        Packet.tcp_flags,
+        Packet.sample_weight
+    ).where(
+        Packet.capture_id == capture_id
+    ).order_by(
+        Packet.timestamp.asc(), Packet.id.asc()
+    )
+
+    total = 0
+    with db.engine.connect() as connection:
+        result = connection.execution_options(yield_per=Config.EXPORT_BATCH_SIZE).execute(statement)
+        for batch in result.mappings().partitions():
+            table.add(batch)
+            rows = table.drain()
+            if rows:
+                submit_write(store_flow_rows, rows).result()
+                total += len(rows)
+
+    rows = table.drain(final=True)
+    if rows:
+        submit_write(store_flow_rows, rows).result()
+        total += len(rows)
+
+    logger.info(f"Assembled {total} flows from {table.packets} packets of capture {capture_id}")
+    return total
@@ -0,0 +1,328 @@
+"""
+NetFlow v5/v9 and IPFIX export of assembled flows
+
+The conversations a capture's FlowTable emits are sent over UDP to the
+collectors in FLOW_EXPORT_COLLECTORS (NativeProbe's own collector
+included), making the capture a flow probe. NetFlow and IPFIX records are
+unidirectional, so every conversation becomes a record for the initiator's
+direction plus one for the responder's when it sent anything.
+
+- 'netflow5': fixed 48-byte records, at most 30 per datagram; IPv4 only
+- 'netflow9' and 'ipfix': one template for IPv4 and one for IPv6 flows,
+  sent with the first datagram and again every
+  FLOW_EXPORT_TEMPLATE_INTERVAL seconds; datagrams are filled up to
+  FLOW_EXPORT_MTU bytes
+
+Each capture exports as its own observation domain (source ID, or engine
+ID for v5), so sequence numbers and templates of concurrent captures
+don't mix at the collector.
+"""
+import logging
+import socket
+import struct
+import time
+from config import Config
+from utils.packet_record import EPOCH
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+EXPORT_PROTOCOLS = ('netflow5', 'netflow9', 'ipfix')
+
+# NetFlow v5
+V5_HEADER = struct.Struct('!HHIIIIBBH')
+V5_RECORD = struct.Struct('!4s4s4sHHIIIIHHBBBBHHBBH')
+V5_MAX_RECORDS = 30
+
+# NetFlow v9 / IPFIX
+V9_HEADER = struct.Struct('!HHIIII')
+IPFIX_HEADER = struct.Struct('!HHIII')
+SET_HEADER = struct.Struct('!HH')
+V9_TEMPLATE_SET_ID = 0
+V9_OPTIONS_SET_ID = 1
+IPFIX_TEMPLATE_SET_ID = 2
+IPFIX_OPTIONS_SET_ID = 3
+MIN_DATA_SET_ID = 256
+
+# Field types (NetFlow v9 numbers, which IPFIX information elements share)
+IN_BYTES = 1
+IN_PKTS = 2
+PROTOCOL = 4
+SRC_TOS = 5
+TCP_FLAGS = 6
+L4_SRC_PORT = 7
+IPV4_SRC_ADDR = 8
+INPUT_SNMP = 10
+L4_DST_PORT = 11
+IPV4_DST_ADDR = 12
+OUTPUT_SNMP = 14
+LAST_SWITCHED = 21
+FIRST_SWITCHED = 22
+IPV6_SRC_ADDR = 27
+IPV6_DST_ADDR = 28
+OCTET_TOTAL_COUNT = 85
+PACKET_TOTAL_COUNT = 86
+FLOW_START_SECONDS = 150
+FLOW_END_SECONDS = 151
+FLOW_START_MILLISECONDS = 152
+FLOW_END_MILLISECONDS = 153
+
+IPV4_TEMPLATE_ID = 256
+IPV6_TEMPLATE_ID = 257
+
+def build_templates(protocol):
+    """{template id: [(field type, length), ...]} for the IPv4 and IPv6 records"""
+    if protocol == 'ipfix':
+        times = [(FLOW_START_MILLISECONDS, 8), (FLOW_END_MILLISECONDS, 8)]
+    else:
+        times = [(FIRST_SWITCHED, 4), (LAST_SWITCHED, 4)]
+    common = [
+        (L4_SRC_PORT, 2), (L4_DST_PORT, 2), (PROTOCOL, 1), (TCP_FLAGS, 1), (SRC_TOS, 1),
+        (IN_BYTES, 8), (IN_PKTS, 8)
+    ] + times + [(INPUT_SNMP, 2), (OUTPUT_SNMP, 2)]
+    return {
+        IPV4_TEMPLATE_ID: [(IPV4_SRC_ADDR, 4), (IPV4_DST_ADDR, 4)] + common,
+        IPV6_TEMPLATE_ID: [(IPV6_SRC_ADDR, 16), (IPV6_DST_ADDR, 16)] + common
+    }
+
+# struct formats of the unsigned integer lengths used in the templates
+INTEGER_FORMATS = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+ADDRESS_FIELDS = (IPV4_SRC_ADDR, IPV4_DST_ADDR, IPV6_SRC_ADDR, IPV6_DST_ADDR)
+
+def field_format(field_type, length):
+    """struct format of a template field: addresses as bytes, everything else as an unsigned integer"""
+    return f"{length}s" if field_type in ADDRESS_FIELDS else INTEGER_FORMATS[length]
+
+def parse_collectors(collectors):
+    """[(host, port), ...] from 'host:port' strings; '[v6]:port' for IPv6, port defaults to FLOW_COLLECTOR_PORT"""
+    parsed = []
+    for collector in collectors:
+        collector = collector.strip()
+        if not collector:
+            continue
+        if collector.startswith('['):
+            host, _, port = collector[1:].partition(']')
+            port = port.lstrip(':')
+        elif collector.count(':') == 1:
+            host, _, port = collector.partition(':')
+        else:
+            host, port = collector, ''
+        parsed.append((host, int(port) if port else Config.FLOW_COLLECTOR_PORT))
+    return parsed
+
+def epoch_seconds(value):
+    """Naive UTC datetime to float seconds since the Unix epoch"""
+    return (value - EPOCH).total_seconds()
+
+def unidirectional(rows):
+    """Split bidirectional FlowRecord rows into one record per direction that carried packets"""
+    records = []
+    for row in rows:
+        if row['packets']:
+            records.append((
+                row['source_ip'], row['destination_ip'], row['source_port'], row['destination_port'],
+                row['protocol'], row['tcp_flags'], row['bytes'], row['packets'],
+                row['start_time'], row['end_time']
+            ))
+        if row.get('reverse_packets'):
+            records.append((
+                row['destination_ip'], row['source_ip'], row['destination_port'], row['source_port'],
+                row['protocol'], row.get('reverse_tcp_flags'), row['reverse_bytes'], row['reverse_packets'],
+                row['start_time'], row['end_time']
+            ))
+    return records
+
+class FlowExporter:
+    """Encodes flows as NetFlow v5, v9 or IPFIX and sends them to a set of collectors"""
+
+    def __init__(self, collectors=None, protocol=None, domain_id=0, mtu=None, template_interval=None):
+        self.protocol = protocol or Config.FLOW_EXPORT_PROTOCOL
+        if self.protocol not in EXPORT_PROTOCOLS:
+            raise ValueError(f"Unknown flow export protocol '{self.protocol}'")
+        self.collectors = parse_collectors(Config.FLOW_EXPORT_COLLECTORS if collectors is None else collectors)
+        self.domain_id = domain_id
+        self.mtu = mtu or Config.FLOW_EXPORT_MTU
+        self.template_interval = template_interval or Config.FLOW_EXPORT_TEMPLATE_INTERVAL
+        self.templates = build_templates(self.protocol)
+        self.record_structs = {
+            template_id: struct.Struct('!' + ''.join(field_format(*field) for field in fields))
+            for template_id, fields in self.templates.items()
+        }
+        self.boot_time = time.time()  # sysUptime zero for NetFlow timestamps; moved back to the earliest flow
+        self.sequence = 0
+        self.last_template = None
+        self.stats = {'datagrams': 0, 'records': 0, 'bytes': 0, 'skipped': 0, 'errors': 0}
+
+        # One socket per address family of the collectors
+        self.destinations = []
+        self.sockets = {}
+        for host, port in self.collectors:
+            try:
+                family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+            except socket.gaierror as e:
+                logger.error(f"Cannot resolve flow collector {host}:{port}: {e}")
+                continue
+            if family not in self.sockets:
+                self.sockets[family] = socket.socket(family, socket.SOCK_DGRAM)
+            self.destinations.append((self.sockets[family], address))
+
+    def uptime_ms(self, timestamp):
+        """NetFlow sysUptime in milliseconds at an epoch time (clamped to 32 bits)"""
+        return min(max(int((timestamp - self.boot_time) * 1000), 0), 0xffffffff)
+
+    def export(self, rows):
+        """Encode FlowRecord rows and send them to every collector; returns the datagrams sent"""
+        records = unidirectional(rows)
+        if not records or not self.destinations:
+            return 0
+
+        # Flows can start before the exporter did (captured before it was created, or
+        # replayed); their uptime-relative times would clamp to 0. Moving sysUptime
+        # zero earlier only makes the uptime jump forward, never look like a reboot.
+        self.boot_time = min(self.boot_time, min(epoch_seconds(record[8]) for record in records))
+
+        if self.protocol == 'netflow5':
+            datagrams = self.encode_v5(records)
+        else:
+            datagrams = self.encode_templated(records)
+
+        sent = 0
+        for datagram in datagrams:
+            for sock, address in self.destinations:
+                try:
+                    sock.sendto(datagram, address)
+                except OSError as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Error sending flows to {address}: {e}")
+            self.stats['datagrams'] += 1
+            self.stats['bytes'] += len(datagram)
+            sent += 1
+        return sent
+
+    def encode_v5(self, records):
+        """NetFlow v5 datagrams for the IPv4 records"""
+        encoded = []
+        for record in records:
+            source_ip, destination_ip, source_port, destination_port, protocol, flags, octets, packets, start, end = record
+            if ':' in source_ip or ':' in destination_ip:
+                self.stats['skipped'] += 1
+                continue
+            encoded.append(V5_RECORD.pack(
+                socket.inet_aton(source_ip), socket.inet_aton(destination_ip), b'\0\0\0\0',
+                0, 0, min(packets, 0xffffffff), min(octets, 0xffffffff),
+                self.uptime_ms(epoch_seconds(start)), self.uptime_ms(epoch_seconds(end)),
+                source_port or 0, destination_port or 0, 0, flags or 0, protocol or 0, 0,
+                0, 0, 0, 0, 0
+            ))
+
+        datagrams = []
+        for i in range(0, len(encoded), V5_MAX_RECORDS):
+            chunk = encoded[i:i + V5_MAX_RECORDS]
+            # sysUptime at the whole second in unix_secs, so collectors recover flow times exactly
+            now = int(time.time())
+            header = V5_HEADER.pack(
+                5, len(chunk), self.uptime_ms(now), now, 0,
+                self.sequence, 0, self.domain_id & 0xff, 0
+            )
+            # v5 counts flows
+            self.sequence = (self.sequence + len(chunk)) & 0xffffffff
+            self.stats['records'] += len(chunk)
+            datagrams.append(header + b''.join(chunk))
+        return datagrams
+
+    def encode_record(self, template_id, record):
+        """One data record in a template's layout"""
+        source_ip, destination_ip, source_port, destination_port, protocol, flags, octets, packets, start, end = record
+        family = socket.AF_INET6 if template_id == IPV6_TEMPLATE_ID else socket.AF_INET
+        start, end = epoch_seconds(start), epoch_seconds(end)
+        if self.protocol == 'ipfix':
+            times = (int(start * 1000), int(end * 1000))
+        else:
+            times = (self.uptime_ms(start), self.uptime_ms(end))
+        return self.record_structs[template_id].pack(
+            socket.inet_pton(family, source_ip), socket.inet_pton(family, destination_ip),
+            source_port or 0, destination_port or 0, protocol or 0, flags or 0, 0,
+            octets, packets, times[0], times[1], 0, 0
+        )
+
+    def template_set(self):
+        """Template set announcing both templates"""
+        body = b''.join(
+            SET_HEADER.pack(template_id, len(fields)) + b''.join(SET_HEADER.pack(*field) for field in fields)
+            for template_id, fields in self.templates.items()
+        )
+        set_id = IPFIX_TEMPLATE_SET_ID if self.protocol == 'ipfix' else V9_TEMPLATE_SET_ID
+        return SET_HEADER.pack(set_id, SET_HEADER.size + len(body)) + body
+
+    def encode_templated(self, records):
+        """NetFlow v9 or IPFIX datagrams, filled up to the MTU"""
+        by_template = {IPV4_TEMPLATE_ID: [], IPV6_TEMPLATE_ID: []}
+        for record in records:
+            template_id = IPV6_TEMPLATE_ID if ':' in record[0] else IPV4_TEMPLATE_ID
+            by_template[template_id].append(self.encode_record(template_id, record))
+
+        header_size = IPFIX_HEADER.size if self.protocol == 'ipfix' else V9_HEADER.size
+        datagrams = []
+        sets = []
+        size = header_size
+        counts = {'records': 0, 'templates': 0}
+
+        def finish():
+            nonlocal sets, size
+            if sets:
+                datagrams.append(self.message(b''.join(sets), counts['records'], counts['templates']))
+            sets, size = [], header_size
+            counts.update(records=0, templates=0)
+
+        now = time.monotonic()
+        if self.last_template is None or now - self.last_template >= self.template_interval:
+            self.last_template = now
+            template = self.template_set()
+            sets.append(template)
+            size += len(template)
+            counts['templates'] = len(self.templates)
+
+        for template_id, encoded in by_template.items():
+            record_size = self.record_structs[template_id].size
+            i = 0
+            while i < len(encoded):
+                room = (self.mtu - size - SET_HEADER.size) // record_size
+                if room <= 0:
+                    finish()
+                    continue
+                chunk = encoded[i:i + room]
+                i += len(chunk)
+                body = b''.join(chunk)
+                padding = b'\0' * (-len(body) % 4)
+                sets.append(SET_HEADER.pack(template_id, SET_HEADER.size + len(body) + len(padding)) + body + padding)
+                size += SET_HEADER.size + len(body) + len(padding)
+                counts['records'] += len(chunk)
+        finish()
+        return datagrams
+
+    def message(self, body, records, templates):
+        """Wrap sets in a v9 or IPFIX header and advance the sequence number"""
+        now = int(time.time())  # v9 sysUptime matches unix_secs, as for v5
+        self.stats['records'] += records
+        if self.protocol == 'ipfix':
+            # IPFIX counts data records sent before this message
+            header = IPFIX_HEADER.pack(10, IPFIX_HEADER.size + len(body), now, self.sequence, self.domain_id)
+            self.sequence = (self.sequence + records) & 0xffffffff
+        else:
+            # v9 counts export packets; its count field covers template and data records
+            header = V9_HEADER.pack(9, records + templates, self.uptime_ms(now), now, self.sequence, self.domain_id)
+            self.sequence = (self.sequence + 1) & 0xffffffff
+        return header + body
+
+    def get_statistics(self):
+        """Export counters"""
+        return dict(self.stats, protocol=self.protocol,
+                    collectors=[f"{host}:{port}" for host, port in self.collectors])
+
+    def close(self):
+        """Close the sockets"""
+        for sock in self.sockets.values():
+            sock.close()
+        self.sockets = {}
+        self.destinations = []
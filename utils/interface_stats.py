@@ -0,0 +1,102 @@
+"""
+Network interface counter helpers
+"""
+import logging
+import os
+from utils.pcap_store import LINKTYPE_ETHERNET, LINKTYPE_RAW, LINKTYPE_LINUX_SLL
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+SYSFS_NET = '/sys/class/net'
+
+COUNTERS = (
+    'rx_packets',
+    'tx_packets',
+    'rx_bytes',
+    'tx_bytes',
+    'rx_dropped',
+    'tx_dropped'
+)
+
+def read_interface_counters(interface):
+    """Read the kernel's cumulative counters for an interface
+
+    Returns a dict of counter name to value, or None if the interface has
+    no sysfs statistics (non-Linux systems, pseudo interfaces such as 'any').
+    """
+    stats_dir = os.path.join(SYSFS_NET, interface, 'statistics')
+    if not os.path.isdir(stats_dir):
+        return None
+
+    counters = {}
+    for name in COUNTERS:
+        try:
+            with open(os.path.join(stats_dir, name)) as f:
+                counters[name] = int(f.read())
+        except (OSError, ValueError):
+            counters[name] = 0
+    return counters
+
+# Pcap link types by the ARPHRD_* device type in /sys/class/net/<iface>/type
+ARPHRD_LINKTYPES = {
+    1: LINKTYPE_ETHERNET,  # ARPHRD_ETHER
+    772: LINKTYPE_ETHERNET,  # ARPHRD_LOOPBACK (Linux loopback frames carry an Ethernet header)
+    768: LINKTYPE_RAW,  # ARPHRD_TUNNEL
+    776: LINKTYPE_RAW,  # ARPHRD_SIT
+    65534: LINKTYPE_RAW  # ARPHRD_NONE (tun devices, WireGuard)
+}
+
+def interface_linktype(interface):
+    """Pcap link-layer header type of the frames captured on an interface
+
+    'any' delivers Linux cooked (SLL) frames, as do device types with no
+    link-layer header of their own that libpcap knows, so unknown types
+    fall back to cooked capture the way libpcap does. Interfaces without
+    sysfs (non-Linux systems) are assumed to be Ethernet.
+    """
+    if interface == 'any':
+        return LINKTYPE_LINUX_SLL
+    try:
+        with open(os.path.join(SYSFS_NET, interface, 'type')) as f:
+            device_type = int(f.read())
+    except (OSError, ValueError):
+        return LINKTYPE_ETHERNET
+    return ARPHRD_LINKTYPES.get(device_type, LINKTYPE_LINUX_SLL)
+
+def packets_seen_since(interface, baseline):
+    """Packets that crossed the interface since a baseline counter snapshot"""
+    current = read_interface_counters(interface)
+    if current is None or baseline is None:
+        return None
+    return (current['rx_packets'] - baseline['rx_packets']) + (current['tx_packets'] - baseline['tx_packets'])
+
+class InterfaceCounterReader:
+    """Keeps an interface's sysfs counter files open for cheap repeated reads
+
+    sysfs regenerates an attribute on every read from offset 0, so a pread
+    on a held descriptor replaces an open/read/close per counter per sample.
+    Raises OSError if the interface has no sysfs statistics.
+    """
+
+    def __init__(self, interface, names=('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets')):
+        self.interface = interface
+        self.fds = {}
+        stats_dir = os.path.join(SYSFS_NET, interface, 'statistics')
+        try:
+            for name in names:
+                self.fds[name] = os.open(os.path.join(stats_dir, name), os.O_RDONLY)
+        except OSError:
+            self.close()
+            raise
+
+    def read(self):
+        """Current counter values; raises OSError if the interface went away"""
+        return {name: int(os.pread(fd, 32, 0)) for name, fd in self.fds.items()}
+
+    def close(self):
+        """Release the counter file descriptors"""
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
@@ -0,0 +1,430 @@
+"""
+Storage for the numeric time series (bandwidth and protocol distribution)
+
+A metrics store writes points and answers time-range queries, optionally
+aggregated into fixed time buckets. Points are flat mappings of a
+timestamp, the measurement's tags and its fields, e.g.
+{'timestamp': ..., 'interface': 'eth0', 'bytes_in': 1200, ...}.
+
+SqlMetricsStore keeps them in the BandwidthUsage and ProtocolDistribution
+tables. InfluxMetricsStore sends InfluxDB line protocol to an InfluxDB 1.x
+HTTP API (or anything that speaks /write and /query) and reads back with
+InfluxQL. Config.METRICS_BACKEND selects one for the process.
+
+Both apply the same retention: points older than each
+Config.METRICS_DOWNSAMPLING age are compacted to that resolution, and
+points older than Config.METRICS_RETENTION are deleted.
+"""
+import datetime
+import json
+import logging
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from app import db
+from config import Config
+from models import BandwidthUsage, ProtocolDistribution
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Tags and fields of each measurement; fields map to (aggregate, type)
+MEASUREMENTS = {
+    'bandwidth': {
+        'tags': ('interface',),
+        'fields': {
+            'bytes_in': ('sum', int),
+            'bytes_out': ('sum', int),
+            'packets_in': ('sum', int),
+            'packets_out': ('sum', int)
+        }
+    },
+    'protocol_distribution': {
+        'tags': ('protocol',),
+        'fields': {
+            'packet_count': ('sum', int),
+            'byte_count': ('sum', int),
+            'percentage': ('mean', float)
+        }
+    }
+}
+
+metrics_store = None
+metrics_store_lock = threading.Lock()
+
+class MetricsStoreError(Exception):
+    """Raised when the metrics backend rejects a write or query"""
+
+def epoch_microseconds(timestamp):
+    """Naive UTC datetime to microseconds since the Unix epoch"""
+    return (timestamp - EPOCH) // datetime.timedelta(microseconds=1)
+
+def align(timestamp, interval):
+    """Start of the interval-second bucket containing timestamp"""
+    seconds = (timestamp - EPOCH) // datetime.timedelta(seconds=1)
+    return EPOCH + datetime.timedelta(seconds=seconds - seconds % interval)
+
+def coerce_point(measurement, point):
+    """Copy of a point with its fields cast to the measurement's field types"""
+    fields = MEASUREMENTS[measurement]['fields']
+    coerced = dict(point)
+    for name, (aggregate, field_type) in fields.items():
+        if coerced.get(name) is not None:
+            coerced[name] = field_type(coerced[name])
+    return coerced
+
+class MetricsStore:
+    """Interface shared by the metrics backends"""
+
+    def __init__(self):
+        # End of the last compacted range per (measurement, resolution); None until the first run
+        self.compacted = {}
+
+    def write(self, measurement, points):
+        """Store points; returns once they are durable"""
+        raise NotImplementedError
+
+    def query(self, measurement, start=None, end=None, tags=None, interval=None,
+              descending=False, limit=None):
+        """Points with start <= timestamp < end, oldest first unless descending
+
+        tags filters on tag values. With interval (seconds) the points are
+        aggregated per tag set into buckets of that length, each stamped with
+        the bucket start.
+        """
+        raise NotImplementedError
+
+    def summarize(self, measurement, start=None, end=None, tags=None):
+        """One aggregated point per tag set over the whole range (timestamp is start)"""
+        raise NotImplementedError
+
+    def delete(self, measurement, start=None, end=None):
+        """Remove points with start <= timestamp < end"""
+        raise NotImplementedError
+
+    def latest(self, measurement, tags=None, limit=1):
+        """The most recent points, newest first"""
+        return self.query(measurement, tags=tags, descending=True, limit=limit)
+
+    def compact(self, measurement, start, end, interval):
+        """Replace the points in [start, end) with their interval-second aggregates"""
+        points = self.query(measurement, start=start, end=end, interval=interval)
+        self.delete(measurement, start=start, end=end)
+        self.write(measurement, points)
+        return len(points)
+
+    def apply_retention(self, now=None):
+        """Downsample aged points and drop expired ones; returns the downsampled points written"""
+        now = now or datetime.datetime.utcnow()
+        expiry = now - datetime.timedelta(seconds=Config.METRICS_RETENTION)
+        compacted = 0
+
+        for measurement in MEASUREMENTS:
+            self.delete(measurement, end=expiry)
+            for age, interval in Config.METRICS_DOWNSAMPLING:
+                end = align(now - datetime.timedelta(seconds=age), interval)
+                start = align(self.compacted.get((measurement, interval)) or expiry, interval)
+                if start < end:
+                    compacted += self.compact(measurement, start, end, interval)
+                self.compacted[(measurement, interval)] = end
+
+        return compacted
+
+class SqlMetricsStore(MetricsStore):
+    """Metrics kept in the application database"""
+
+    MODELS = {
+        'bandwidth': BandwidthUsage,
+        'protocol_distribution': ProtocolDistribution
+    }
+
+    AGGREGATES = {
+        'sum': db.func.sum,
+        'mean': db.func.avg,
+        'max': db.func.max,
+        'min': db.func.min
+    }
+
+    def write(self, measurement, points):
+        """Insert the points through the database writer"""
+        from utils.bulk_loader import bulk_insert
+        from utils.db_writer import submit_write
+
+        if not points:
+            return
+        rows = [coerce_point(measurement, point) for point in points]
+        submit_write(bulk_insert, self.MODELS[measurement], rows).result()
+
+    def filtered(self, query, model, start, end, tags):
+        """Apply the time range and tag filters"""
+        if start:
+            query = query.filter(model.timestamp >= start)
+        if end:
+            query = query.filter(model.timestamp < end)
+        for tag, value in (tags or {}).items():
+            query = query.filter(getattr(model, tag) == value)
+        return query
+
+    def bucket(self, model, interval):
+        """SQL expression for the Unix time of a row's interval-second bucket"""
+        if db.session.get_bind().dialect.name == 'sqlite':
+            seconds = db.cast(db.func.strftime('%s', model.timestamp), db.BigInteger)
+        else:
+            seconds = db.cast(db.func.floor(db.extract('epoch', model.timestamp)), db.BigInteger)
+        return seconds // interval * interval
+
+    def aggregated_columns(self, measurement, model):
+        """Aggregate expressions for each field, labelled with the field name"""
+        return [
+            self.AGGREGATES[aggregate](getattr(model, name)).label(name)
+            for name, (aggregate, field_type) in MEASUREMENTS[measurement]['fields'].items()
+        ]
+
+    def query(self, measurement, start=None, end=None, tags=None, interval=None,
+              descending=False, limit=None):
+        """Points from the measurement's table, bucketed in SQL when interval is given"""
+        model = self.MODELS[measurement]
+        definition = MEASUREMENTS[measurement]
+        tag_columns = [getattr(model, tag) for tag in definition['tags']]
+
+        if interval:
+            bucket = self.bucket(model, interval).label('bucket')
+            query = db.session.query(bucket, *tag_columns, *self.aggregated_columns(measurement, model))
+            query = self.filtered(query, model, start, end, tags).group_by(bucket, *tag_columns)
+            order = bucket
+        else:
+            field_columns = [getattr(model, name) for name in definition['fields']]
+            query = db.session.query(model.timestamp, *tag_columns, *field_columns)
+            query = self.filtered(query, model, start, end, tags)
+            order = model.timestamp
+
+        query = query.order_by(order.desc() if descending else order.asc())
+        if limit:
+            query = query.limit(limit)
+
+        points = []
+        for row in query.all():
+            point = row._asdict()
+            if interval:
+                point['timestamp'] = EPOCH + datetime.timedelta(seconds=point.pop('bucket'))
+            points.append(coerce_point(measurement, point))
+        return points
+
+    def summarize(self, measurement, start=None, end=None, tags=None):
+        """Aggregate per tag set in SQL"""
+        model = self.MODELS[measurement]
+        tag_columns = [getattr(model, tag) for tag in MEASUREMENTS[measurement]['tags']]
+        query = db.session.query(*tag_columns, *self.aggregated_columns(measurement, model))
+        query = self.filtered(query, model, start, end, tags).group_by(*tag_columns)
+        return [
+            coerce_point(measurement, dict(row._asdict(), timestamp=start))
+            for row in query.all()
+        ]
+
+    def delete_rows(self, measurement, start, end):
+        """Delete a time range in the current transaction"""
+        model = self.MODELS[measurement]
+        statement = db.delete(model)
+        if start:
+            statement = statement.where(model.timestamp >= start)
+        if end:
+            statement = statement.where(model.timestamp < end)
+        return db.session.execute(statement.execution_options(synchronize_session=False)).rowcount
+
+    def delete(self, measurement, start=None, end=None):
+        """Delete a time range through the database writer"""
+        from utils.db_writer import submit_write
+        return submit_write(self.delete_rows, measurement, start, end, group=False).result()
+
+    def compact_rows(self, measurement, start, end, interval):
+        """Aggregate, delete and re-insert a range in the current transaction"""
+        from utils.bulk_loader import bulk_insert
+        points = self.query(measurement, start=start, end=end, interval=interval)
+        self.delete_rows(measurement, start, end)
+        bulk_insert(self.MODELS[measurement], points)
+        return len(points)
+
+    def compact(self, measurement, start, end, interval):
+        """Compact a range in one transaction so a failure leaves it untouched"""
+        from utils.db_writer import submit_write
+        return submit_write(self.compact_rows, measurement, start, end, interval, group=False).result()
+
+def escape_key(value):
+    """Escape a measurement name, tag key, tag value or field key for line protocol"""
+    return str(value).replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+def encode_field(value):
+    """Line protocol field value"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def line_protocol(measurement, point):
+    """Encode a point as one line of InfluxDB line protocol with microsecond precision"""
+    definition = MEASUREMENTS[measurement]
+    key = escape_key(measurement)
+    for tag in sorted(definition['tags']):
+        if point.get(tag) not in (None, ''):
+            key += f",{escape_key(tag)}={escape_key(point[tag])}"
+    fields = ','.join(
+        f"{escape_key(name)}={encode_field(point[name])}"
+        for name in definition['fields'] if point.get(name) is not None
+    )
+    return f"{key} {fields} {epoch_microseconds(point['timestamp'])}"
+
+def quote_identifier(name):
+    """InfluxQL double-quoted identifier"""
+    return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def quote_string(value):
+    """InfluxQL single-quoted string literal"""
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+class InfluxMetricsStore(MetricsStore):
+    """Metrics kept in InfluxDB, over its 1.x HTTP API"""
+
+    def __init__(self, url=None, database=None, username=None, password=None):
+        super().__init__()
+        self.url = (url or Config.INFLUXDB_URL).rstrip('/')
+        self.database = database or Config.INFLUXDB_DATABASE
+        self.username = Config.INFLUXDB_USERNAME if username is None else username
+        self.password = Config.INFLUXDB_PASSWORD if password is None else password
+        self.database_ready = False
+
+    def request(self, path, params, body=None):
+        """POST to the HTTP API and return the decoded JSON response (None for 204)"""
+        if self.username:
+            params = dict(params, u=self.username, p=self.password)
+        url = f"{self.url}{path}?{urllib.parse.urlencode(params)}"
+        request = urllib.request.Request(url, data=body or b'', method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=Config.INFLUXDB_TIMEOUT) as response:
+                data = response.read()
+        except urllib.error.HTTPError as e:
+            raise MetricsStoreError(f"InfluxDB {path} returned {e.code}: {e.read().decode(errors='replace')}")
+        except OSError as e:
+            raise MetricsStoreError(f"InfluxDB at {self.url} unreachable: {e}")
+        return json.loads(data) if data else None
+
+    def influxql(self, statement):
+        """Run an InfluxQL statement; returns the series of its result"""
+        response = self.request('/query', {'db': self.database, 'q': statement, 'epoch': 'u'})
+        result = response['results'][0] if response and response.get('results') else {}
+        if 'error' in result:
+            raise MetricsStoreError(f"InfluxQL error: {result['error']}")
+        return result.get('series', [])
+
+    def ensure_database(self):
+        """Create the database on first use (a no-op if it exists)"""
+        if not self.database_ready:
+            self.request('/query', {'q': f"CREATE DATABASE {quote_identifier(self.database)}"})
+            self.database_ready = True
+
+    def write(self, measurement, points):
+        """POST the points as line protocol in batches"""
+        fields = MEASUREMENTS[measurement]['fields']
+        # A line needs at least one field; empty aggregates carry none
+        lines = [
+            line_protocol(measurement, coerce_point(measurement, point))
+            for point in points if any(point.get(name) is not None for name in fields)
+        ]
+        if not lines:
+            return
+        self.ensure_database()
+        batch_size = Config.INFLUXDB_BATCH_SIZE
+        for i in range(0, len(lines), batch_size):
+            body = '\n'.join(lines[i:i + batch_size]).encode('utf-8')
+            self.request('/write', {'db': self.database, 'precision': 'u'}, body)
+
+    def where(self, start, end, tags):
+        """InfluxQL WHERE clause for a time range and tag filters"""
+        conditions = []
+        if start:
+            conditions.append(f"time >= {epoch_microseconds(start)}u")
+        if end:
+            conditions.append(f"time < {epoch_microseconds(end)}u")
+        for tag, value in (tags or {}).items():
+            conditions.append(f"{quote_identifier(tag)} = {quote_string(value)}")
+        return f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    def aggregated_columns(self, measurement):
+        """InfluxQL aggregate for each field, aliased to the field name"""
+        return ', '.join(
+            f"{aggregate}({quote_identifier(name)}) AS {quote_identifier(name)}"
+            for name, (aggregate, field_type) in MEASUREMENTS[measurement]['fields'].items()
+        )
+
+    def series_points(self, measurement, series):
+        """Flatten query series into points"""
+        points = []
+        for entry in series:
+            tags = entry.get('tags', {})
+            columns = entry['columns']
+            for values in entry.get('values', []):
+                point = dict(tags)
+                point.update(zip(columns, values))
+                point['timestamp'] = EPOCH + datetime.timedelta(microseconds=point.pop('time'))
+                points.append(coerce_point(measurement, point))
+        return points
+
+    def query(self, measurement, start=None, end=None, tags=None, interval=None,
+              descending=False, limit=None):
+        """Raw or GROUP BY time() query"""
+        self.ensure_database()
+        definition = MEASUREMENTS[measurement]
+        tag_list = ', '.join(quote_identifier(tag) for tag in definition['tags'])
+
+        if interval:
+            statement = (
+                f"SELECT {self.aggregated_columns(measurement)} FROM {quote_identifier(measurement)}"
+                f"{self.where(start, end, tags)} GROUP BY time({int(interval)}s), {tag_list} fill(none)"
+            )
+        else:
+            columns = ', '.join(quote_identifier(name) for name in (*definition['fields'], *definition['tags']))
+            statement = f"SELECT {columns} FROM {quote_identifier(measurement)}{self.where(start, end, tags)}"
+        if descending:
+            statement += " ORDER BY time DESC"
+        if limit:
+            statement += f" LIMIT {int(limit)}"
+
+        # Grouped series come back one per tag set; merge them into one time order
+        points = self.series_points(measurement, self.influxql(statement))
+        points.sort(key=lambda point: point['timestamp'], reverse=descending)
+        return points[:limit] if limit else points
+
+    def summarize(self, measurement, start=None, end=None, tags=None):
+        """GROUP BY the tags with no time buckets"""
+        self.ensure_database()
+        tag_list = ', '.join(quote_identifier(tag) for tag in MEASUREMENTS[measurement]['tags'])
+        statement = (
+            f"SELECT {self.aggregated_columns(measurement)} FROM {quote_identifier(measurement)}"
+            f"{self.where(start, end, tags)} GROUP BY {tag_list}"
+        )
+        points = self.series_points(measurement, self.influxql(statement))
+        for point in points:
+            point['timestamp'] = start
+        return points
+
+    def delete(self, measurement, start=None, end=None):
+        """DELETE a time range of the measurement"""
+        self.ensure_database()
+        self.influxql(f"DELETE FROM {quote_identifier(measurement)}{self.where(start, end, None)}")
+
+def get_metrics_store():
+    """The process's metrics store, chosen by Config.METRICS_BACKEND"""
+    global metrics_store
+    with metrics_store_lock:
+        if metrics_store is None:
+            if Config.METRICS_BACKEND == 'influxdb':
+                metrics_store = InfluxMetricsStore()
+            else:
+                metrics_store = SqlMetricsStore()
+        return metrics_store
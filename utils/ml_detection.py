@@ -0,0 +1,364 @@
+"""
+Machine-learning anomaly detection utility functions
+
+Hosts are described by per-window feature vectors built from captured packets
+and flow records, and scored in batches by an unsupervised isolation forest
+implemented with NumPy.
+"""
+import logging
+import os
+import threading
+import time
+import datetime
+import numpy as np
+from app import db
+from config import Config
+from models import FlowRecord, Packet
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Feature vector layout (one row per host per window)
+FEATURE_NAMES = [
+    'packets_sent',
+    'bytes_sent',
+    'mean_packet_size',
+    'distinct_destinations',
+    'distinct_destination_ports',
+    'syn_packets',
+    'rst_packets',
+    'flows',
+    'flow_bytes',
+    'flow_packets'
+]
+
+# Global variables
+model_lock = threading.Lock()
+active_model = None
+model_stats = {
+    'trained_at': None,
+    'training_time_ms': None,
+    'training_samples': 0,
+    'training_windows': 0,
+    'last_scored_at': None,
+    'last_scoring_latency_ms': None,
+    'last_hosts_scored': 0,
+    'last_anomalies': 0
+}
+
+def average_path_length(n):
+    """Average path length of an unsuccessful BST search over n points"""
+    n = np.asarray(n, dtype=np.float64)
+    result = np.zeros_like(n)
+    large = n > 2
+    result[large] = 2.0 * (np.log(n[large] - 1.0) + np.euler_gamma) - 2.0 * (n[large] - 1.0) / n[large]
+    result[n == 2] = 1.0
+    return result
+
+class IsolationForest:
+    """Isolation forest with array-backed trees and vectorized batch scoring"""
+
+    def __init__(self, n_trees=100, sample_size=256, contamination=0.01, random_state=None):
+        self.n_trees = n_trees
+        self.sample_size = sample_size
+        self.contamination = contamination
+        self.random_state = random_state
+        self.trees = []
+        self.threshold = None
+        self.effective_sample_size = None
+
+    def fit(self, X):
+        """Build the forest from a (samples x features) matrix"""
+        X = np.asarray(X, dtype=np.float64)
+        rng = np.random.default_rng(self.random_state)
+        n_samples = X.shape[0]
+        self.effective_sample_size = min(self.sample_size, n_samples)
+        height_limit = int(np.ceil(np.log2(max(self.effective_sample_size, 2))))
+
+        self.trees = []
+        for _ in range(self.n_trees):
+            indices = rng.choice(n_samples, self.effective_sample_size, replace=False)
+            self.trees.append(self._build_tree(X[indices], height_limit, rng))
+
+        # Score threshold so that `contamination` of the training data is flagged
+        scores = self.score_samples(X)
+        self.threshold = float(np.quantile(scores, 1.0 - self.contamination))
+        return self
+
+    def _build_tree(self, X, height_limit, rng):
+        """Build a single isolation tree as parallel node arrays"""
+        feature, threshold, left, right, size, depth = [], [], [], [], [], []
+
+        def new_node(node_size, node_depth):
+            feature.append(-1)
+            threshold.append(0.0)
+            left.append(-1)
+            right.append(-1)
+            size.append(node_size)
+            depth.append(node_depth)
+            return len(feature) - 1
+
+        stack = [(new_node(len(X), 0), X)]
+        while stack:
+            node, data = stack.pop()
+            if depth[node] >= height_limit or len(data) <= 1:
+                continue
+
+            # Only split on features that still vary within this node
+            mins = data.min(axis=0)
+            maxs = data.max(axis=0)
+            candidates = np.flatnonzero(maxs > mins)
+            if len(candidates) == 0:
+                continue
+
+            split_feature = int(rng.choice(candidates))
+            split_value = rng.uniform(mins[split_feature], maxs[split_feature])
+            mask = data[:, split_feature] < split_value
+
+            feature[node] = split_feature
+            threshold[node] = split_value
+            left[node] = new_node(int(mask.sum()), depth[node] + 1)
+            right[node] = new_node(int((~mask).sum()), depth[node] + 1)
+            stack.append((left[node], data[mask]))
+            stack.append((right[node], data[~mask]))
+
+        # Leaves add the expected remaining depth of the points they hold
+        size = np.array(size, dtype=np.int64)
+        path = np.array(depth, dtype=np.float64) + average_path_length(size)
+        return {
+            'feature': np.array(feature, dtype=np.int64),
+            'threshold': np.array(threshold, dtype=np.float64),
+            'left': np.array(left, dtype=np.int64),
+            'right': np.array(right, dtype=np.int64),
+            'path': path
+        }
+
+    def score_samples(self, X):
+        """Anomaly score in (0, 1] for every row; higher is more anomalous"""
+        X = np.asarray(X, dtype=np.float64)
+        rows = np.arange(X.shape[0])
+        total_path = np.zeros(X.shape[0], dtype=np.float64)
+
+        for tree in self.trees:
+            # Walk all samples down the tree together, one level per step
+            nodes = np.zeros(X.shape[0], dtype=np.int64)
+            active = tree['feature'][nodes] >= 0
+            while active.any():
+                current = nodes[active]
+                go_left = X[rows[active], tree['feature'][current]] < tree['threshold'][current]
+                nodes[active] = np.where(go_left, tree['left'][current], tree['right'][current])
+                active = tree['feature'][nodes] >= 0
+            total_path += tree['path'][nodes]
+
+        mean_path = total_path / max(len(self.trees), 1)
+        normalizer = average_path_length(np.array([self.effective_sample_size]))[0] or 1.0
+        return np.power(2.0, -mean_path / normalizer)
+
+    def save(self, path):
+        """Persist the forest to a .npz file"""
+        arrays = {
+            'params': np.array([self.n_trees, self.sample_size, self.effective_sample_size], dtype=np.int64),
+            'settings': np.array([self.contamination, self.threshold], dtype=np.float64)
+        }
+        for i, tree in enumerate(self.trees):
+            for key, value in tree.items():
+                arrays[f'tree{i}_{key}'] = value
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """Load a forest saved with save()"""
+        with np.load(path) as data:
+            n_trees, sample_size, effective_sample_size = (int(v) for v in data['params'])
+            contamination, threshold = (float(v) for v in data['settings'])
+            forest = cls(n_trees=n_trees, sample_size=sample_size, contamination=contamination)
+            forest.effective_sample_size = effective_sample_size
+            forest.threshold = threshold
+            forest.trees = [
+                {key: data[f'tree{i}_{key}'] for key in ('feature', 'threshold', 'left', 'right', 'path')}
+                for i in range(n_trees)
+            ]
+        return forest
+
+def extract_host_features(start_time, end_time, window_seconds=None):
+    """Build per-host, per-window feature vectors from packets and flows
+
+    Returns (keys, matrix) where keys is a list of (window_start, host) tuples
+    aligned with the rows of the feature matrix.
+    """
+    window_seconds = window_seconds or Config.ML_WINDOW_SECONDS
+    window = datetime.timedelta(seconds=window_seconds)
+    features = {}
+
+    def row_for(timestamp, host):
+        window_index = int((timestamp - start_time) / window)
+        key = (window_index, host)
+        if key not in features:
+            features[key] = {
+                'values': np.zeros(len(FEATURE_NAMES), dtype=np.float64),
+                'destinations': set(),
+                'ports': set()
+            }
+        return features[key]
+
+    # Packet-derived features
+    packets = db.session.query(
+        Packet.timestamp,
+        Packet.source_ip,
+        Packet.destination_ip,
+        Packet.destination_port,
+        Packet.length,
+        Packet.tcp_flags,
+        Packet.sample_weight
+    ).filter(
+        Packet.timestamp >= start_time,
+        Packet.timestamp < end_time,
+        Packet.source_ip != None
+    ).yield_per(10000)
+
+    for packet in packets:
+        row = row_for(packet.timestamp, packet.source_ip)
+        values = row['values']
+        weight = packet.sample_weight or 1
+        values[0] += weight
+        values[1] += (packet.length or 0) * weight
+        if packet.destination_ip:
+            row['destinations'].add(packet.destination_ip)
+        if packet.destination_port is not None:
+            row['ports'].add(packet.destination_port)
+        if packet.tcp_flags == 'S':
+            values[5] += weight
+        elif packet.tcp_flags and 'R' in packet.tcp_flags:
+            values[6] += weight
+
+    # Flow-derived features
+    flows = db.session.query(
+        FlowRecord.timestamp,
+        FlowRecord.source_ip,
+        FlowRecord.destination_ip,
+        FlowRecord.destination_port,
+        FlowRecord.bytes,
+        FlowRecord.packets
+    ).filter(
+        FlowRecord.timestamp >= start_time,
+        FlowRecord.timestamp < end_time
+    ).yield_per(10000)
+
+    for flow in flows:
+        row = row_for(flow.timestamp, flow.source_ip)
+        values = row['values']
+        row['destinations'].add(flow.destination_ip)
+        if flow.destination_port is not None:
+            row['ports'].add(flow.destination_port)
+        values[7] += 1
+        values[8] += flow.bytes or 0
+        values[9] += flow.packets or 0
+
+    keys = sorted(features)
+    matrix = np.zeros((len(keys), len(FEATURE_NAMES)), dtype=np.float64)
+    for i, key in enumerate(keys):
+        row = features[key]
+        values = row['values']
+        values[2] = values[1] / values[0] if values[0] else 0.0
+        values[3] = len(row['destinations'])
+        values[4] = len(row['ports'])
+        matrix[i] = values
+
+    # Counts are heavy-tailed, so the model works on log-scaled features
+    matrix = np.log1p(matrix)
+    window_keys = [(start_time + window * index, host) for index, host in keys]
+    return window_keys, matrix
+
+def train_model(days=None, save=True):
+    """Train the isolation forest offline on stored traffic history"""
+    global active_model
+
+    days = days or Config.ML_TRAINING_DAYS
+    end_time = datetime.datetime.utcnow()
+    start_time = end_time - datetime.timedelta(days=days)
+
+    started = time.perf_counter()
+    keys, matrix = extract_host_features(start_time, end_time)
+
+    if len(keys) < Config.ML_MIN_TRAINING_SAMPLES:
+        logger.info(f"Not enough history to train anomaly model ({len(keys)} samples)")
+        return None
+
+    forest = IsolationForest(
+        n_trees=Config.ML_TREES,
+        sample_size=Config.ML_SAMPLE_SIZE,
+        contamination=Config.ML_CONTAMINATION
+    ).fit(matrix)
+    training_time_ms = (time.perf_counter() - started) * 1000
+
+    with model_lock:
+        active_model = forest
+        model_stats['trained_at'] = datetime.datetime.utcnow().isoformat()
+        model_stats['training_time_ms'] = round(training_time_ms, 2)
+        model_stats['training_samples'] = len(keys)
+        model_stats['training_windows'] = len(set(window for window, _ in keys))
+
+    logger.info(f"Trained anomaly model on {len(keys)} samples in {training_time_ms:.1f} ms")
+
+    if save and Config.ML_MODEL_PATH:
+        try:
+            forest.save(Config.ML_MODEL_PATH)
+        except Exception as e:
+            logger.error(f"Error saving anomaly model: {e}")
+
+    return model_stats.copy()
+
+def get_model():
+    """Get the active model, loading a saved one from disk if needed"""
+    global active_model
+
+    with model_lock:
+        if active_model is None and Config.ML_MODEL_PATH and os.path.exists(Config.ML_MODEL_PATH):
+            try:
+                active_model = IsolationForest.load(Config.ML_MODEL_PATH)
+                logger.info(f"Loaded anomaly model from {Config.ML_MODEL_PATH}")
+            except Exception as e:
+                logger.error(f"Error loading anomaly model: {e}")
+        return active_model
+
+def score_hosts(current_time, window_seconds=None):
+    """Score every host active in the latest window in a single batch
+
+    Returns a list of (host, score) tuples for hosts above the model threshold.
+    """
+    model = get_model()
+    if model is None:
+        return []
+
+    window_seconds = window_seconds or Config.ML_WINDOW_SECONDS
+    start_time = current_time - datetime.timedelta(seconds=window_seconds)
+
+    started = time.perf_counter()
+    keys, matrix = extract_host_features(start_time, current_time, window_seconds)
+    scores = model.score_samples(matrix) if len(keys) else np.zeros(0)
+    latency_ms = (time.perf_counter() - started) * 1000
+
+    anomalies = [
+        (host, float(score))
+        for (_, host), score in zip(keys, scores)
+        if score > model.threshold
+    ]
+
+    with model_lock:
+        model_stats['last_scored_at'] = current_time.isoformat()
+        model_stats['last_scoring_latency_ms'] = round(latency_ms, 2)
+        model_stats['last_hosts_scored'] = len(keys)
+        model_stats['last_anomalies'] = len(anomalies)
+
+    return anomalies
+
+def get_model_statistics():
+    """Get training and scoring statistics for the active model"""
+    model = get_model()
+    with model_lock:
+        stats = model_stats.copy()
+    stats['trained'] = model is not None
+    stats['threshold'] = model.threshold if model is not None else None
+    stats['features'] = FEATURE_NAMES
+    return stats
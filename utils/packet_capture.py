@@ -5,10 +5,26 @@ import logging
 import threading
 import time
 import datetime
+import json
 import os
-import tempfile
 from app import db, app
-from models import PacketCapture, Packet, CaptureInterface
+from config import Config
+from models import PacketCapture, Packet, CaptureInterface, CaptureSegment, FlowRecord
+from utils.tcp_tracker import tcp_tracker
+from utils.packet_record import PacketRecord, seconds_to_us
+from utils.pcap_store import LINKTYPE_ETHERNET, PcapWriter, RotatingPcapWriter, capture_file_path, read_frame
+from utils.protocol_dissection import dissect_frame
+from utils.capture_filters import validate_capture_filter, read_socket_statistics
+from utils.capture_buffer import CaptureBuffer, BUFFER_POLICIES
+from utils.interface_stats import interface_linktype, read_interface_counters, packets_seen_since
+from utils.capture_sampling import PacketSampler, frame_tcp_header
+from utils.db_writer import submit_write
+from utils.bulk_loader import bulk_insert
+from utils.capture_counters import CaptureCounters
+from utils.bandwidth import CaptureBandwidth
+from utils.flow_assembly import FlowTable
+from utils.flow_exporter import FlowExporter
+from utils.metrics_store import get_metrics_store
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -16,58 +32,74 @@ logger = logging.getLogger(__name__)
 
 # Global variables
 active_captures = {}  # Dictionary to store active capture threads
-capture_data = {}  # Dictionary to store captured packets temporarily
-
-try:
-    import pyshark
-    PYSHARK_AVAILABLE = True
-except ImportError:
-    logger.warning("PyShark not available. Limited functionality.")
-    PYSHARK_AVAILABLE = False
-
-try:
-    from scapy.all import get_if_list, conf, sniff
-    SCAPY_AVAILABLE = True
-except ImportError:
-    logger.warning("Scapy not available. Limited functionality.")
-    SCAPY_AVAILABLE = False
+capture_buffers = {}  # Dictionary of bounded packet buffers for active captures
+capture_flushers = {}  # Dictionary of database writer threads for active captures
+capture_writers = {}  # Dictionary of pcap writers for active captures
+capture_stats = {}  # Dictionary of filter statistics for active captures
+capture_counters = {}  # Dictionary of running packet statistics for active captures
+capture_bandwidth = {}  # Dictionary of bandwidth accumulators for captures on interfaces without kernel counters
+capture_flows = {}  # Dictionary of conversation tables for active captures
+capture_exporters = {}  # Dictionary of NetFlow/IPFIX exporters for active captures
+capture_libraries = {}  # Capture library modules, imported on first use (None if missing)
+
+# Set in capture worker processes, whose handshake tracker the agent cannot read directly
+report_tcp_handshakes = False
+
+def get_pyshark():
+    """Import PyShark the first time a capture needs it"""
+    if 'pyshark' not in capture_libraries:
+        try:
+            import pyshark
+            capture_libraries['pyshark'] = pyshark
+        except ImportError:
+            logger.warning("PyShark not available. Limited functionality.")
+            capture_libraries['pyshark'] = None
+    return capture_libraries['pyshark']
+
+def get_scapy():
+    """Import Scapy the first time a capture needs it"""
+    if 'scapy' not in capture_libraries:
+        try:
+            import scapy.all as scapy
+            capture_libraries['scapy'] = scapy
+        except ImportError:
+            logger.warning("Scapy not available. Limited functionality.")
+            capture_libraries['scapy'] = None
+    return capture_libraries['scapy']
 
 def get_available_interfaces():
     """Get available network interfaces"""
     interfaces = []
     
-    if SCAPY_AVAILABLE:
+    # On Linux, list /sys/class/net so page loads don't have to import a capture library
+    if os.path.exists('/sys/class/net'):
         try:
-            # Get interfaces from Scapy
-            scapy_interfaces = get_if_list()
-            for iface in scapy_interfaces:
+            for iface in sorted(os.listdir('/sys/class/net')):
+                is_up = os.path.exists(f'/sys/class/net/{iface}/carrier')
                 interface_info = {
                     'name': iface,
-                    'description': f'Scapy interface: {iface}',
-                    'is_up': True  # Assuming interface is up if listed
+                    'description': f'System interface: {iface}',
+                    'is_up': is_up
                 }
                 interfaces.append(interface_info)
-        except Exception as e:
-            logger.error(f"Error getting interfaces from Scapy: {e}")
-    
-    if PYSHARK_AVAILABLE:
-        try:
-            # This is platform-dependent - we'll use a workaround
-            # On Linux, we can check /sys/class/net
-            if os.path.exists('/sys/class/net'):
-                for iface in os.listdir('/sys/class/net'):
-                    # Check if interface is already in the list
-                    if not any(i['name'] == iface for i in interfaces):
-                        is_up = os.path.exists(f'/sys/class/net/{iface}/carrier')
-                        interface_info = {
-                            'name': iface,
-                            'description': f'System interface: {iface}',
-                            'is_up': is_up
-                        }
-                        interfaces.append(interface_info)
         except Exception as e:
             logger.error(f"Error getting interfaces from system: {e}")
     
+    else:
+        scapy = get_scapy()
+        if scapy:
+            try:
+                # Get interfaces from Scapy
+                for iface in scapy.get_if_list():
+                    interface_info = {
+                        'name': iface,
+                        'description': f'Scapy interface: {iface}',
+                        'is_up': True  # Assuming interface is up if listed
+                    }
+                    interfaces.append(interface_info)
+            except Exception as e:
+                logger.error(f"Error getting interfaces from Scapy: {e}")
+    
     # If no interfaces were found, provide a default loopback
     if not interfaces:
         interfaces.append({
@@ -104,12 +136,58 @@ def refresh_interfaces():
     
     return len(interfaces)
 
-def start_packet_capture(interface, name, filter_expr='', timeout=60):
-    global SCAPY_AVAILABLE
-    if not SCAPY_AVAILABLE:
-        from scapy.all import get_if_list, conf, sniff
-        SCAPY_AVAILABLE = True
-    """Start a packet capture on the specified interface"""
+def start_packet_capture(interface, name, filter_expr='', timeout=60, continuous=False,
+                         segment_size=None, disk_budget=None, display_filter='',
+                         sampling_mode='none', sampling_rate=1, snap_length=None, buffer_policy=None,
+                         store_packets=True):
+    """Start a packet capture on the specified interface in a background thread"""
+    capture_id = create_capture_record(
+        interface, name, filter_expr, timeout, continuous, segment_size, disk_budget,
+        display_filter, sampling_mode, sampling_rate, snap_length, buffer_policy, store_packets
+    )
+    
+    thread = threading.Thread(target=run_packet_capture, args=(capture_id,))
+    thread.daemon = True
+    thread.start()
+    
+    return capture_id
+
+def create_capture_record(interface, name, filter_expr='', timeout=60, continuous=False,
+                          segment_size=None, disk_budget=None, display_filter='',
+                          sampling_mode='none', sampling_rate=1, snap_length=None, buffer_policy=None,
+                          store_packets=True):
+    """Validate capture options and create the capture's database record
+
+    A continuous capture runs until stopped and writes a ring of rotating pcap
+    segments bounded by `disk_budget` bytes. `filter_expr` is a BPF capture
+    filter applied in the kernel; `display_filter` is a Wireshark display
+    filter applied after decoding (PyShark backend only).
+    
+    `sampling_mode` ('none', 'systematic' 1-in-N or 'flow' hash) keeps one in
+    `sampling_rate` packets, and `snap_length` truncates stored frames.
+    `buffer_policy` decides what happens when the database falls behind and
+    the packet buffer fills up (block, drop-newest or drop-oldest).
+    
+    With `store_packets` False neither packet rows nor frames are stored;
+    the capture only feeds its statistics, conversations and flow export.
+    """
+    
+    # Reject invalid capture filters before anything is started
+    filter_size = validate_capture_filter(filter_expr)
+    if filter_size is not None and filter_expr:
+        logger.info(f"Capture filter '{filter_expr}' compiled to {filter_size} BPF instructions")
+    
+    # Construct once to validate the options
+    sampler = PacketSampler(sampling_mode, sampling_rate)
+    buffer_policy = buffer_policy or Config.CAPTURE_BUFFER_POLICY
+    if buffer_policy not in BUFFER_POLICIES:
+        raise ValueError(f"Unknown buffer policy '{buffer_policy}'")
+    snap_length = min(int(snap_length), Config.MAX_PACKET_SIZE) if snap_length else None
+    
+    if continuous:
+        timeout = None
+        segment_size = segment_size or Config.CAPTURE_SEGMENT_SIZE
+        disk_budget = disk_budget or Config.CAPTURE_DISK_BUDGET
     
     # Create a new capture record in the database
     capture = PacketCapture(
@@ -117,107 +195,209 @@ def start_packet_capture(interface, name, filter_expr='', timeout=60):
         interface=interface,
         start_time=datetime.datetime.utcnow(),
         filter_expression=filter_expr,
-        description=f"Capture on {interface}"
+        display_filter=display_filter,
+        description=f"Continuous capture on {interface}" if continuous else f"Capture on {interface}",
+        continuous=continuous,
+        segment_size=segment_size,
+        disk_budget=disk_budget,
+        sampling_mode=sampler.mode,
+        sampling_rate=sampler.rate,
+        snap_length=snap_length,
+        linktype=interface_linktype(interface),
+        buffer_policy=buffer_policy,
+        store_packets=bool(store_packets),
+        timeout=timeout
     )
     
     db.session.add(capture)
     db.session.commit()
     
-    capture_id = capture.id
+    return capture.id
+
+def run_packet_capture(capture_id):
+    """Run the capture described by a capture record until it times out or is stopped
+
+    Blocks the calling thread; used by start_packet_capture and by capture
+    worker processes.
+    """
+    with app.app_context():
+        capture = PacketCapture.query.get(capture_id)
+        interface = capture.interface
+        filter_expr = capture.filter_expression or ''
+        display_filter = capture.display_filter or ''
+        timeout = capture.timeout
+        continuous = bool(capture.continuous)
+        linktype = capture.linktype or LINKTYPE_ETHERNET
+        sampler = PacketSampler(capture.sampling_mode or 'none', capture.sampling_rate or 1, linktype)
+        buffer = CaptureBuffer(Config.MAX_PACKET_BUFFER, capture.buffer_policy or Config.CAPTURE_BUFFER_POLICY)
+        store_packets = capture.store_packets is not False
+        
+        # Raw frames go to the managed pcap store so packet details can be read back
+        if store_packets and continuous:
+            capture_writers[capture_id] = RotatingPcapWriter(
+                capture_id, capture.segment_size, capture.disk_budget, linktype, capture.snap_length
+            )
+        elif store_packets:
+            pcap_file = capture_file_path(capture_id)
+            capture_writers[capture_id] = PcapWriter(pcap_file, linktype, capture.snap_length)
+            capture.file_path = pcap_file
+            db.session.commit()
     
     # Initialize storage for captured packets
-    capture_data[capture_id] = []
+    capture_buffers[capture_id] = buffer
+    capture_counters[capture_id] = CaptureCounters()
+    
+    # Interface counters tell how many packets the filter let through
+    capture_stats[capture_id] = {
+        'interface': interface,
+        'baseline': read_interface_counters(interface),
+        'delivered': 0,
+        'socket': None,
+        'kernel_drops': None,
+        'store_packets': store_packets
+    }
     
-    # Create temporary file for saving pcap
-    temp_dir = tempfile.gettempdir()
-    pcap_file = os.path.join(temp_dir, f"capture_{capture_id}.pcap")
+    # The bandwidth sampler covers interfaces with kernel counters; account the rest from the packets
+    if capture_stats[capture_id]['baseline'] is None:
+        capture_bandwidth[capture_id] = CaptureBandwidth(interface)
+    
+    # Group the packets into bidirectional conversations as they are flushed, to store and/or export
+    if Config.FLOW_ASSEMBLY or Config.FLOW_EXPORT_COLLECTORS:
+        capture_flows[capture_id] = FlowTable(capture_id)
+    if Config.FLOW_EXPORT_COLLECTORS:
+        try:
+            capture_exporters[capture_id] = FlowExporter(domain_id=capture_id)
+        except ValueError as e:
+            logger.error(f"Flow export disabled for capture {capture_id}: {e}")
     
     # Define packet callback function
     def packet_callback(packet):
         if capture_id not in active_captures:
             return
         
+        capture_stats[capture_id]['delivered'] += 1
+        
+        timestamp, frame = raw_frame(packet)
+        
+        # Track TCP handshakes for per-destination SYN flood detection; the
+        # tracker sees every segment, sampling only thins out stored packets
+        tcp_header = frame_tcp_header(frame, linktype)
+        if tcp_header:
+            tcp_tracker.observe(*tcp_header)
+        
+        # Sample on the raw frame so skipped packets are never parsed
+        if not sampler.keep(frame):
+            return
+        
         # Process packet and extract relevant information
-        packet_info = parse_packet(packet)
-        if packet_info:
-            # Store in temporary buffer
-            capture_data[capture_id].append(packet_info)
+        record = parse_packet(packet)
+        if record:
+            record.sample_weight = sampler.rate
             
-            # Update packet count in database periodically
-            if len(capture_data[capture_id]) % 100 == 0:
-                update_packet_count(capture_id, len(capture_data[capture_id]))
+            # Make room in the database writer's buffer; may block or drop when full
+            if not buffer.reserve():
+                return
             
-            # Save packets to database periodically to avoid memory issues
-            if len(capture_data[capture_id]) >= 1000:
-                save_packets_to_db(capture_id)
+            # Keep the raw frame of accepted packets only and remember where it was written
+            store_raw_frame(capture_id, timestamp, frame, record)
+            buffer.put(record)
+    
+    # Write buffered packets to the database off the capture thread
+    def flusher_thread():
+        with app.app_context():
+            while not buffer.closed:
+                buffer.wait(Config.CAPTURE_FLUSH_BATCH, Config.CAPTURE_FLUSH_INTERVAL)
+                try:
+                    save_packets_to_db(capture_id)
+                except Exception as e:
+                    logger.error(f"Error saving packets for capture {capture_id}: {e}")
+                    db.session.rollback()
     
-    # Start the capture in a separate thread
+    # Run the capture
     def capture_thread():
-        logger.info(f"Starting capture on interface {interface} with filter '{filter_expr}'")
+        logger.info(f"Starting capture on interface {interface} with capture filter '{filter_expr}'"
+                    f" and display filter '{display_filter}'")
         
         try:
             # Use Flask application context in this thread
             with app.app_context():
-                if PYSHARK_AVAILABLE:
-                    # Use PyShark for capture
+                pyshark = get_pyshark()
+                scapy = None if pyshark else get_scapy()
+                
+                if pyshark:
+                    # Use PyShark for capture; dumpcap attaches the BPF filter in the kernel
                     cap = pyshark.LiveCapture(
                         interface=interface,
-                        display_filter=filter_expr,
-                        output_file=pcap_file
+                        bpf_filter=filter_expr or None,
+                        display_filter=display_filter or None,
+                        include_raw=True,
+                        use_json=True
                     )
                     active_captures[capture_id] = cap
                     
                     # Capture packets
                     cap.apply_on_packets(packet_callback, timeout=timeout)
                 
-                elif SCAPY_AVAILABLE:
-                    # Use Scapy for capture
-                    active_captures[capture_id] = True
-                    sniff(
-                        iface=interface,
-                        filter=filter_expr,
-                        prn=packet_callback,
-                        timeout=timeout,
-                        store=0
-                    )
+                elif scapy:
+                    if display_filter:
+                        logger.warning("Display filters are not supported by the Scapy backend; ignoring")
+                    
+                    # Use Scapy for capture; the BPF filter is attached to the listening socket
+                    sock = scapy.conf.L2listen(iface=interface, filter=filter_expr or None)
+                    active_captures[capture_id] = sock
+                    capture_stats[capture_id]['socket'] = getattr(sock, 'ins', sock)
+                    try:
+                        scapy.sniff(
+                            opened_socket=sock,
+                            prn=packet_callback,
+                            timeout=timeout,
+                            stop_filter=lambda packet: capture_id not in active_captures,
+                            store=0
+                        )
+                    finally:
+                        # Collect the final kernel drop count before the socket goes away
+                        read_kernel_drops(capture_id)
+                        capture_stats[capture_id]['socket'] = None
+                        sock.close()
                 
                 else:
                     logger.error("No packet capture library available")
                     update_capture_status(capture_id, end=True, error="No packet capture library available")
+                    release_capture(capture_id)
                     return
                 
                 # Capture finished normally
                 if capture_id in active_captures:
                     # Save any remaining packets
-                    save_packets_to_db(capture_id)
+                    stop_capture_flusher(capture_id)
+                    save_packets_to_db(capture_id, final=True)
                     
                     # Update capture status
                     update_capture_status(capture_id, end=True)
                     
                     # Cleanup
-                    del active_captures[capture_id]
-                    del capture_data[capture_id]
+                    release_capture(capture_id)
                     
                     logger.info(f"Capture {capture_id} completed")
         
         except Exception as e:
-            logger.error(f"Error in capture thread: {e}")
-            # Use Flask application context to update capture status
-            with app.app_context():
-                update_capture_status(capture_id, end=True, error=str(e))
+            # Stopping a capture closes its backend, which may surface here as an error
+            if capture_id in active_captures:
+                logger.error(f"Error in capture thread: {e}")
+                # Use Flask application context to update capture status
+                with app.app_context():
+                    update_capture_status(capture_id, end=True, error=str(e))
             
             # Cleanup
-            if capture_id in active_captures:
-                del active_captures[capture_id]
-            if capture_id in capture_data:
-                del capture_data[capture_id]
+            release_capture(capture_id)
     
-    # Start capture thread
-    thread = threading.Thread(target=capture_thread)
-    thread.daemon = True
-    thread.start()
+    # Start the database writer, then capture on this thread
+    flusher = threading.Thread(target=flusher_thread)
+    flusher.daemon = True
+    capture_flushers[capture_id] = flusher
+    flusher.start()
     
-    return capture_id
+    capture_thread()
 
 def stop_packet_capture(capture_id):
     """Stop an active packet capture"""
@@ -226,33 +406,140 @@ def stop_packet_capture(capture_id):
     
     logger.info(f"Stopping capture {capture_id}")
     
-    # Stop the capture
+    # Stop the capture (PyShark capture or Scapy socket)
     try:
-        if PYSHARK_AVAILABLE and hasattr(active_captures[capture_id], 'close'):
+        if hasattr(active_captures[capture_id], 'close'):
             active_captures[capture_id].close()
     except Exception as e:
         logger.error(f"Error stopping capture: {e}")
     
     # Save any remaining packets
-    save_packets_to_db(capture_id)
+    stop_capture_flusher(capture_id)
+    save_packets_to_db(capture_id, final=True)
     
     # Update capture status
     update_capture_status(capture_id, end=True)
     
     # Cleanup
-    del active_captures[capture_id]
-    if capture_id in capture_data:
-        del capture_data[capture_id]
+    release_capture(capture_id)
     
     return True
 
+def release_capture(capture_id):
+    """Drop all per-capture state of an ended capture, closing its writer thread, pcap writer and flow exporter"""
+    active_captures.pop(capture_id, None)
+    stop_capture_flusher(capture_id)
+    for state in (capture_buffers, capture_stats, capture_counters, capture_bandwidth, capture_flows):
+        state.pop(capture_id, None)
+    close_flow_exporter(capture_id)
+    close_capture_writer(capture_id)
+
+def stop_capture_flusher(capture_id):
+    """Release anything blocked on a capture's buffer and wait for its writer to finish"""
+    buffer = capture_buffers.get(capture_id)
+    if buffer is not None:
+        buffer.close()
+    flusher = capture_flushers.pop(capture_id, None)
+    if flusher and flusher is not threading.current_thread():
+        flusher.join(timeout=30)
+
+def read_kernel_drops(capture_id):
+    """Accumulate kernel drop counters from a capture's packet socket"""
+    stats = capture_stats.get(capture_id)
+    if not stats or stats['socket'] is None:
+        return
+    
+    # PACKET_STATISTICS resets on every read
+    counters = read_socket_statistics(stats['socket'])
+    if counters:
+        stats['kernel_drops'] = (stats['kernel_drops'] or 0) + counters[1]
+
+def raw_frame(packet):
+    """Get (timestamp, raw frame bytes) of a captured packet"""
+    try:
+        if hasattr(packet, 'get_raw_packet'):
+            # PyShark packet captured with include_raw
+            return float(packet.sniff_timestamp), packet.get_raw_packet()
+        return float(packet.time), bytes(packet)
+    except Exception as e:
+        logger.error(f"Error reading raw frame: {e}")
+        return time.time(), b''
+
+def store_raw_frame(capture_id, timestamp, frame, record):
+    """Write a packet's raw frame to the capture's pcap store and record where it went"""
+    writer = capture_writers.get(capture_id)
+    if writer is None or not frame:
+        return
+    
+    try:
+        record.pcap_offset = writer.write(timestamp, frame)
+        record.pcap_segment = getattr(writer, 'segment', None)
+    except Exception as e:
+        logger.error(f"Error storing raw frame: {e}")
+
+def get_flow_export_status():
+    """Flow export settings and the counters of this process's exporters"""
+    return {
+        'protocol': Config.FLOW_EXPORT_PROTOCOL,
+        'collectors': Config.FLOW_EXPORT_COLLECTORS,
+        'captures': {capture_id: exporter.get_statistics() for capture_id, exporter in list(capture_exporters.items())}
+    }
+
+def close_flow_exporter(capture_id):
+    """Close the flow exporter of a capture"""
+    exporter = capture_exporters.pop(capture_id, None)
+    if exporter:
+        exporter.close()
+
+def close_capture_writer(capture_id):
+    """Close the pcap writer of a capture and sync its final segments"""
+    writer = capture_writers.pop(capture_id, None)
+    if writer:
+        writer.close()
+        if isinstance(writer, RotatingPcapWriter):
+            try:
+                submit_write(sync_capture_segments, capture_id, writer.take_changes()).result()
+            except Exception as e:
+                logger.error(f"Error syncing capture segments: {e}")
+
+def sync_capture_segments(capture_id, changes):
+    """Mirror the ring buffer's segment changes (from take_changes) into the database
+
+    Metadata of deleted segments (including their packets) is removed so the
+    database only describes frames that are still on disk.
+    """
+    current, closed, deleted = changes
+    
+    for segment in closed + ([current] if current else []):
+        record = CaptureSegment.query.filter_by(capture_id=capture_id, sequence=segment['sequence']).first()
+        if record is None:
+            record = CaptureSegment(capture_id=capture_id, sequence=segment['sequence'])
+            db.session.add(record)
+        record.file_path = segment['file_path']
+        record.start_time = datetime.datetime.utcfromtimestamp(segment['start_time']) if segment['start_time'] else None
+        record.end_time = datetime.datetime.utcfromtimestamp(segment['end_time']) if segment['end_time'] else None
+        record.packet_count = segment['packet_count']
+        record.byte_size = segment['byte_size']
+        record.closed = segment is not current
+    
+    if deleted:
+        Packet.query.filter(
+            Packet.capture_id == capture_id,
+            Packet.pcap_segment.in_(deleted)
+        ).delete(synchronize_session=False)
+        CaptureSegment.query.filter(
+            CaptureSegment.capture_id == capture_id,
+            CaptureSegment.sequence.in_(deleted)
+        ).delete(synchronize_session=False)
+        logger.info(f"Dropped {len(deleted)} expired segments of capture {capture_id}")
+
 def parse_packet(packet):
-    """Parse a packet and extract relevant information"""
+    """Parse a packet into a PacketRecord"""
     try:
-        if PYSHARK_AVAILABLE and hasattr(packet, 'layers'):
+        if capture_libraries.get('pyshark') and hasattr(packet, 'layers'):
             # PyShark packet
             return parse_pyshark_packet(packet)
-        elif SCAPY_AVAILABLE and hasattr(packet, 'summary'):
+        elif capture_libraries.get('scapy') and hasattr(packet, 'summary'):
             # Scapy packet
             return parse_scapy_packet(packet)
         else:
@@ -263,158 +550,218 @@ def parse_packet(packet):
         return None
 
 def parse_pyshark_packet(packet):
-    """Parse a PyShark packet and extract relevant information"""
-    packet_info = {
-        'timestamp': datetime.datetime.fromtimestamp(float(packet.sniff_timestamp)),
-        'length': int(packet.length),
-        'info': packet.info if hasattr(packet, 'info') else None
-    }
-    
-    # Extract protocol information
-    if hasattr(packet, 'highest_layer'):
-        packet_info['protocol'] = packet.highest_layer
+    """Parse a PyShark packet into a PacketRecord"""
+    record = PacketRecord(
+        seconds_to_us(packet.sniff_timestamp),
+        int(packet.length),
+        protocol=packet.highest_layer if hasattr(packet, 'highest_layer') else None,
+        info=packet.info if hasattr(packet, 'info') else None
+    )
     
     # Extract IP information
     if hasattr(packet, 'ip'):
-        packet_info['source_ip'] = packet.ip.src
-        packet_info['destination_ip'] = packet.ip.dst
+        record.source_ip = packet.ip.src
+        record.destination_ip = packet.ip.dst
     
     # Extract port information
     if hasattr(packet, 'tcp'):
-        packet_info['source_port'] = int(packet.tcp.srcport)
-        packet_info['destination_port'] = int(packet.tcp.dstport)
+        record.source_port = int(packet.tcp.srcport)
+        record.destination_port = int(packet.tcp.dstport)
         
-        # Extract TCP flags
-        tcp_flags = ''
-        if int(packet.tcp.flags_syn) == 1:
-            tcp_flags += 'S'
-        if int(packet.tcp.flags_ack) == 1:
-            tcp_flags += 'A'
-        if int(packet.tcp.flags_fin) == 1:
-            tcp_flags += 'F'
-        if int(packet.tcp.flags_reset) == 1:
-            tcp_flags += 'R'
-        if int(packet.tcp.flags_push) == 1:
-            tcp_flags += 'P'
-        if int(packet.tcp.flags_urg) == 1:
-            tcp_flags += 'U'
-        
-        packet_info['tcp_flags'] = tcp_flags
+        # tshark reports the flags byte as hex, e.g. 0x0012
+        record.tcp_flags = int(packet.tcp.flags, 16) & 0xff
     
     elif hasattr(packet, 'udp'):
-        packet_info['source_port'] = int(packet.udp.srcport)
-        packet_info['destination_port'] = int(packet.udp.dstport)
+        record.source_port = int(packet.udp.srcport)
+        record.destination_port = int(packet.udp.dstport)
     
-    return packet_info
+    return record
 
 def parse_scapy_packet(packet):
-    """Parse a Scapy packet and extract relevant information"""
-    packet_info = {
-        'timestamp': datetime.datetime.utcnow(),  # Scapy doesn't provide timestamp by default
-        'length': len(packet),
-        'info': packet.summary()
-    }
+    """Parse a Scapy packet into a PacketRecord"""
+    record = PacketRecord(seconds_to_us(packet.time), len(packet), info=packet.summary())
     
     # Extract protocol information
     if packet.haslayer('TCP'):
-        packet_info['protocol'] = 'TCP'
+        record.protocol = 'TCP'
     elif packet.haslayer('UDP'):
-        packet_info['protocol'] = 'UDP'
+        record.protocol = 'UDP'
     elif packet.haslayer('ICMP'):
-        packet_info['protocol'] = 'ICMP'
+        record.protocol = 'ICMP'
     elif packet.haslayer('IP'):
-        packet_info['protocol'] = 'IP'
+        record.protocol = 'IP'
     else:
-        packet_info['protocol'] = packet.name
+        record.protocol = packet.name
     
     # Extract IP information
     if packet.haslayer('IP'):
-        packet_info['source_ip'] = packet['IP'].src
-        packet_info['destination_ip'] = packet['IP'].dst
+        record.source_ip = packet['IP'].src
+        record.destination_ip = packet['IP'].dst
     
     # Extract port information
     if packet.haslayer('TCP'):
-        packet_info['source_port'] = packet['TCP'].sport
-        packet_info['destination_port'] = packet['TCP'].dport
-        
-        # Extract TCP flags
-        flags = packet['TCP'].flags
-        tcp_flags = ''
-        if flags & 0x02:  # SYN
-            tcp_flags += 'S'
-        if flags & 0x10:  # ACK
-            tcp_flags += 'A'
-        if flags & 0x01:  # FIN
-            tcp_flags += 'F'
-        if flags & 0x04:  # RST
-            tcp_flags += 'R'
-        if flags & 0x08:  # PSH
-            tcp_flags += 'P'
-        if flags & 0x20:  # URG
-            tcp_flags += 'U'
-        
-        packet_info['tcp_flags'] = tcp_flags
+        record.source_port = packet['TCP'].sport
+        record.destination_port = packet['TCP'].dport
+        record.tcp_flags = int(packet['TCP'].flags) & 0xff
     
     elif packet.haslayer('UDP'):
-        packet_info['source_port'] = packet['UDP'].sport
-        packet_info['destination_port'] = packet['UDP'].dport
+        record.source_port = packet['UDP'].sport
+        record.destination_port = packet['UDP'].dport
     
-    return packet_info
+    return record
 
-def save_packets_to_db(capture_id):
-    """Save captured packets to the database"""
-    if capture_id not in capture_data or not capture_data[capture_id]:
+def save_packets_to_db(capture_id, final=False):
+    """Save buffered packets to the database; final forces a statistics checkpoint"""
+    buffer = capture_buffers.get(capture_id)
+    if buffer is None:
         return
     
-    packets_to_save = capture_data[capture_id]
-    capture_data[capture_id] = []  # Clear the buffer
-    
-    # Create packet records in bulk
-    packet_objects = []
-    for packet_info in packets_to_save:
-        packet = Packet(
-            capture_id=capture_id,
-            timestamp=packet_info.get('timestamp', datetime.datetime.utcnow()),
-            protocol=packet_info.get('protocol'),
-            source_ip=packet_info.get('source_ip'),
-            destination_ip=packet_info.get('destination_ip'),
-            source_port=packet_info.get('source_port'),
-            destination_port=packet_info.get('destination_port'),
-            length=packet_info.get('length'),
-            info=packet_info.get('info'),
-            tcp_flags=packet_info.get('tcp_flags')
-        )
-        packet_objects.append(packet)
+    read_kernel_drops(capture_id)
+    
+    # Frames must be on disk before their offsets become visible
+    if capture_id in capture_writers:
+        capture_writers[capture_id].flush()
+    
+    rows = buffer.drain(capture_id)
+    
+    # Running totals replace re-counting the capture's stored packets
+    counters = capture_counters.get(capture_id)
+    checkpoint = None
+    if counters is not None:
+        counters.add(rows)
+        if final or counters.checkpoint_due():
+            checkpoint = counters.checkpoint()
+            checkpoint.update(capture_statistics(capture_id))
+    
+    # Segments that rotated or expired since the last batch
+    writer = capture_writers.get(capture_id)
+    changes = writer.take_changes() if rows and isinstance(writer, RotatingPcapWriter) else None
+    
+    # Conversations that ended, went idle or (when final) are still open
+    flows = capture_flows.get(capture_id)
+    flow_rows = None
+    if flows is not None:
+        flows.add(rows)
+        flow_rows = flows.drain(final)
+        exporter = capture_exporters.get(capture_id)
+        if exporter is not None and flow_rows:
+            exporter.export(flow_rows)
+        if not Config.FLOW_ASSEMBLY:
+            flow_rows = None
+    
+    # Flow-only captures keep their statistics but not the packets
+    stats = capture_stats.get(capture_id)
+    packet_rows = rows if stats is None or stats['store_packets'] else []
+    
+    # Wait for the commit so the buffer's backpressure reflects database speed
+    if packet_rows or checkpoint or flow_rows:
+        submit_write(store_packet_batch, capture_id, packet_rows, changes, checkpoint, flow_rows).result()
+    
+    # Completed bandwidth intervals of interfaces without kernel counters
+    bandwidth = capture_bandwidth.get(capture_id)
+    if bandwidth is not None:
+        bandwidth.add(rows)
+        points = bandwidth.drain(final)
+        if points:
+            get_metrics_store().write('bandwidth', points)
+
+def store_packet_batch(capture_id, rows, segment_changes=None, checkpoint=None, flow_rows=None):
+    """Insert drained packet rows and assembled flows, sync segments and write a statistics checkpoint"""
+    if rows:
+        # Save to database in one bulk load (COPY on PostgreSQL, executemany elsewhere)
+        bulk_insert(Packet, rows)
+        
+        # Expire segments that fell out of the ring buffer
+        if segment_changes:
+            sync_capture_segments(capture_id, segment_changes)
     
-    # Save to database
-    db.session.bulk_save_objects(packet_objects)
-    db.session.commit()
+    if flow_rows:
+        bulk_insert(FlowRecord, flow_rows)
     
-    # Update packet count
-    packet_count = db.session.query(Packet).filter_by(capture_id=capture_id).count()
-    update_packet_count(capture_id, packet_count)
+    if checkpoint:
+        db.session.execute(
+            db.update(PacketCapture).where(PacketCapture.id == capture_id).values(**checkpoint)
+        )
 
-def update_packet_count(capture_id, count):
-    """Update packet count for a capture"""
-    capture = PacketCapture.query.get(capture_id)
-    if capture:
-        capture.packet_count = count
-        db.session.commit()
+def capture_statistics(capture_id):
+    """Filter throughput, kernel/application drop counters and (in workers) the handshake snapshot, as PacketCapture columns"""
+    stats = capture_stats.get(capture_id)
+    if not stats:
+        return {}
+    columns = {
+        'packets_seen': packets_seen_since(stats['interface'], stats['baseline']),
+        'packets_delivered': stats['delivered'],
+        'kernel_drops': stats['kernel_drops']
+    }
+    buffer = capture_buffers.get(capture_id)
+    if buffer is not None:
+        columns['app_drops'] = buffer.dropped
+    if report_tcp_handshakes:
+        columns['tcp_handshakes'] = json.dumps(tcp_tracker.snapshot(Config.TCP_TRACKER_REPORT_DESTINATIONS))
+    return columns
 
 def update_capture_status(capture_id, end=False, error=None):
     """Update capture status in the database"""
+    submit_write(apply_capture_status, capture_id, end, error).result()
+
+def apply_capture_status(capture_id, end=False, error=None):
+    """Mark a capture as ended, recording any error"""
     capture = PacketCapture.query.get(capture_id)
     if capture:
         if end:
             capture.end_time = datetime.datetime.utcnow()
             if error:
                 capture.description = f"{capture.description} (Error: {error})"
-        db.session.commit()
 
 def get_packet_details(packet):
     """Get detailed information about a packet"""
-    # This would typically involve examining the PCAP file
-    # For now, we'll return a simplified version based on the database record
+    # Seek straight to the stored frame and dissect it
+    file_path = get_frame_file(packet)
+    if packet.pcap_offset is not None and file_path and os.path.exists(file_path):
+        try:
+            frame = read_frame(file_path, packet.pcap_offset)
+            details = get_record_details(packet)
+            details['general']['captured_length'] = frame['captured_length']
+            details['general']['original_length'] = frame['original_length']
+            details.update(dissect_frame(frame['data'], frame['linktype']))
+            details['raw'] = frame['data'].hex()
+            return details
+        except Exception as e:
+            logger.error(f"Error reading frame for packet {packet.id}: {e}")
+    
+    return get_record_details(packet)
+
+def get_frame_file(packet):
+    """Get the pcap file holding a packet's frame"""
+    if packet.pcap_segment is not None:
+        segment = CaptureSegment.query.filter_by(
+            capture_id=packet.capture_id, sequence=packet.pcap_segment
+        ).first()
+        return segment.file_path if segment else None
+    return packet.capture.file_path if packet.capture else None
+
+def get_capture_pcap_files(capture, start_time=None):
+    """Get the pcap files of a capture that may hold frames after start_time, oldest first"""
+    if not capture.continuous:
+        return [capture.file_path] if capture.file_path else []
+    
+    query = CaptureSegment.query.filter_by(capture_id=capture.id)
+    if start_time:
+        query = query.filter(db.or_(CaptureSegment.end_time == None, CaptureSegment.end_time >= start_time))
+    
+    paths = [segment.file_path for segment in query.order_by(CaptureSegment.sequence.asc()).all()]
+    
+    # The segment being written may not be synced yet
+    writer = capture_writers.get(capture.id)
+    if isinstance(writer, RotatingPcapWriter) and writer.segments:
+        current = writer.segments[-1]['file_path']
+        if current not in paths:
+            paths.append(current)
+    
+    return paths
+
+def get_record_details(packet):
+    """Get packet details from the database record alone (no stored frame)"""
     details = {
         'general': {
             'timestamp': packet.timestamp.isoformat(),
@@ -464,38 +811,37 @@ def get_packet_details(packet):
         }
     
     return details
+
 def cleanup_stale_captures():
     """Clean up stale captures that might be stuck"""
+    from utils.capture_manager import is_worker_alive
+    
     current_time = datetime.datetime.utcnow()
-    timeout_threshold = current_time - datetime.timedelta(hours=1)
+    grace = datetime.timedelta(seconds=Config.STALE_CAPTURE_TIMEOUT)
     
     with app.app_context():
-        stale_captures = PacketCapture.query.filter(
+        # Continuous captures are expected to run indefinitely
+        open_captures = PacketCapture.query.filter(
             PacketCapture.end_time == None,
-            PacketCapture.start_time < timeout_threshold
+            PacketCapture.start_time < current_time - grace,
+            db.or_(PacketCapture.continuous == None, PacketCapture.continuous == False)
         ).all()
         
+        # A capture is stale once it has overrun its own timeout by the grace period
+        # and no worker process is still running it
+        stale_captures = [
+            capture for capture in open_captures
+            if capture.start_time + datetime.timedelta(seconds=capture.timeout or 0) + grace < current_time
+            and not (capture.worker_pid is not None and is_worker_alive(capture.worker_pid, capture.id))
+        ]
+        
         for capture in stale_captures:
             capture.end_time = current_time
-            capture.description += " (Automatically closed due to inactivity)"
+            capture.description = f"{capture.description or ''} (Automatically closed due to inactivity)".lstrip()
         
         db.session.commit()
         logger.info(f"Cleaned up {len(stale_captures)} stale captures")
         # Remove from active captures
         for capture in stale_captures:
-            if capture.id in active_captures:
-                del active_captures[capture.id]
-            if capture.id in capture_data:
-                del capture_data[capture.id]
+            release_capture(capture.id)
     logger.info("Stale captures cleaned up")
-# Schedule cleanup every 10 minutes
-cleanup_interval = 600  # 10 minutes
-cleanup_thread = threading.Thread(target=cleanup_stale_captures)
-cleanup_thread.daemon = True
-cleanup_thread.start()
-# Schedule cleanup
-while True:
-    time.sleep(cleanup_interval)
-    cleanup_stale_captures()
-# Note: This is a simplified version of the cleanup function. In a real application,
-# you would want to handle threading and database sessions more robustly.
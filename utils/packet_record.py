@@ -0,0 +1,65 @@
+"""
+Compact packet record used from the capture parsers to the database writer
+
+A PacketRecord holds one parsed packet with an integer microsecond
+timestamp and TCP flags as a bitmask. It is converted to the Packet table's
+column values only when it is written.
+"""
+import datetime
+from utils.tcp_tracker import TCP_FIN, TCP_SYN, TCP_RST, TCP_PSH, TCP_ACK, TCP_URG
+
+# Order in which flags are spelled in the Packet.tcp_flags column
+FLAG_LETTERS = (
+    (TCP_SYN, 'S'),
+    (TCP_ACK, 'A'),
+    (TCP_FIN, 'F'),
+    (TCP_RST, 'R'),
+    (TCP_PSH, 'P'),
+    (TCP_URG, 'U')
+)
+
+# Spelling of every possible flags byte, so conversion is a table lookup
+FLAG_STRINGS = tuple(
+    ''.join(letter for bit, letter in FLAG_LETTERS if mask & bit) for mask in range(256)
+)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def mask_to_flags(mask):
+    """Spell a TCP flag bitmask the way the Packet table stores it (e.g. 'SA')"""
+    if mask is None:
+        return None
+    return FLAG_STRINGS[mask & 0xff]
+
+def seconds_to_us(timestamp):
+    """Convert an epoch timestamp (float, or a decimal string as tshark reports it) to microseconds"""
+    if isinstance(timestamp, str):
+        seconds, _, fraction = timestamp.partition('.')
+        return int(seconds) * 1000000 + int((fraction + '000000')[:6])
+    return int(round(float(timestamp) * 1000000))
+
+def us_to_datetime(timestamp_us):
+    """Convert epoch microseconds to a naive UTC datetime"""
+    return EPOCH + datetime.timedelta(microseconds=timestamp_us)
+
+class PacketRecord:
+    """One parsed packet"""
+    __slots__ = ('timestamp_us', 'length', 'protocol', 'source_ip', 'destination_ip',
+                 'source_port', 'destination_port', 'tcp_flags', 'info',
+                 'pcap_offset', 'pcap_segment', 'sample_weight')
+
+    def __init__(self, timestamp_us, length, protocol=None, source_ip=None, destination_ip=None,
+                 source_port=None, destination_port=None, tcp_flags=None, info=None):
+        self.timestamp_us = timestamp_us
+        self.length = length
+        self.protocol = protocol
+        self.source_ip = source_ip
+        self.destination_ip = destination_ip
+        self.source_port = source_port
+        self.destination_port = destination_port
+        self.tcp_flags = tcp_flags  # Bitmask, None for non-TCP packets
+        self.info = info
+        self.pcap_offset = None
+        self.pcap_segment = None
+        self.sample_weight = 1
+
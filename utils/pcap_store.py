@@ -0,0 +1,269 @@
+"""
+Managed pcap storage for captured frames
+
+Frames are appended to classic libpcap files and every packet keeps the byte
+offset of its record, so a single frame can be read back with one seek.
+"""
+import logging
+import os
+import struct
+import threading
+from config import Config
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# libpcap file format
+PCAP_MAGIC = 0xa1b2c3d4  # microsecond timestamps
+PCAP_MAGIC_SWAPPED = 0xd4c3b2a1
+PCAP_VERSION = (2, 4)
+PCAP_GLOBAL_HEADER = struct.Struct('<IHHiIII')
+PCAP_RECORD_HEADER = struct.Struct('<IIII')
+
+# Link-layer header types
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+def get_store_dir():
+    """Get (and create) the managed pcap directory"""
+    os.makedirs(Config.PCAP_STORE_DIR, exist_ok=True)
+    return Config.PCAP_STORE_DIR
+
+def capture_file_path(capture_id):
+    """Path of the pcap file for a capture"""
+    return os.path.join(get_store_dir(), f"capture_{capture_id}.pcap")
+
+class PcapWriter:
+    """Append-only pcap writer that reports the offset of each record"""
+
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=None):
+        self.path = path
+        self.linktype = linktype
+        self.snaplen = snaplen or Config.MAX_PACKET_SIZE
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb')
+        self.file.write(pcap_global_header('<', linktype, self.snaplen))
+        self.offset = PCAP_GLOBAL_HEADER.size
+        self.packets = 0
+
+    def write(self, timestamp, data, original_length=None):
+        """Append one frame and return the byte offset of its record header"""
+        seconds = int(timestamp)
+        microseconds = int(round((timestamp - seconds) * 1000000))
+        if microseconds >= 1000000:
+            seconds, microseconds = seconds + 1, microseconds - 1000000
+        captured = data[:self.snaplen]
+
+        with self.lock:
+            if self.file is None:
+                return None
+            offset = self.offset
+            self.file.write(PCAP_RECORD_HEADER.pack(
+                seconds, microseconds, len(captured), original_length or len(data)
+            ))
+            self.file.write(captured)
+            self.offset += PCAP_RECORD_HEADER.size + len(captured)
+            self.packets += 1
+        return offset
+
+    def flush(self):
+        """Flush buffered frames to disk"""
+        with self.lock:
+            if self.file:
+                self.file.flush()
+
+    def close(self):
+        """Flush and close the file"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+def read_pcap_header(f):
+    """Read a pcap global header, returning (byte order prefix, linktype)"""
+    header = f.read(PCAP_GLOBAL_HEADER.size)
+    if len(header) < PCAP_GLOBAL_HEADER.size:
+        raise ValueError("Truncated pcap header")
+    magic = struct.unpack('<I', header[:4])[0]
+    if magic == PCAP_MAGIC:
+        order = '<'
+    elif magic == PCAP_MAGIC_SWAPPED:
+        order = '>'
+    else:
+        raise ValueError(f"Not a microsecond pcap file (magic {magic:#x})")
+    linktype = struct.unpack(order + 'I', header[20:24])[0]
+    return order, linktype
+
+def read_frame(path, offset):
+    """Read the frame whose record header starts at `offset`
+
+    Returns a dict with the timestamp, captured bytes, original length and
+    link-layer type.
+    """
+    with open(path, 'rb') as f:
+        order, linktype = read_pcap_header(f)
+        f.seek(offset)
+        record = f.read(PCAP_RECORD_HEADER.size)
+        if len(record) < PCAP_RECORD_HEADER.size:
+            raise ValueError(f"No pcap record at offset {offset}")
+        seconds, microseconds, captured_length, original_length = struct.unpack(order + 'IIII', record)
+        data = f.read(captured_length)
+
+    return {
+        'timestamp': seconds + microseconds / 1000000,
+        'data': data,
+        'captured_length': captured_length,
+        'original_length': original_length,
+        'linktype': linktype
+    }
+
+def segment_file_path(capture_id, sequence):
+    """Path of one segment of a continuous capture"""
+    return os.path.join(get_store_dir(), f"capture_{capture_id}_{sequence:06d}.pcap")
+
+class RotatingPcapWriter:
+    """Ring of fixed-size pcap segments bounded by a total disk budget
+
+    When the current segment would exceed `segment_size` a new segment is
+    started, and the oldest segments are deleted while the retained total
+    exceeds `disk_budget`. Closed and deleted segments are queued so the
+    capture pipeline can sync their metadata to the database.
+    """
+
+    def __init__(self, capture_id, segment_size=None, disk_budget=None, linktype=LINKTYPE_ETHERNET, snaplen=None):
+        self.capture_id = capture_id
+        self.segment_size = segment_size or Config.CAPTURE_SEGMENT_SIZE
+        self.disk_budget = max(disk_budget or Config.CAPTURE_DISK_BUDGET, self.segment_size)
+        self.linktype = linktype
+        self.snaplen = snaplen
+        self.lock = threading.Lock()
+        self.segments = []  # Retained segments, oldest first
+        self.closed_segments = []  # Segments finished since the last sync
+        self.deleted_segments = []  # Sequence numbers deleted since the last sync
+        self.writer = None
+        self.segment = -1
+        self._open_segment()
+
+    def _open_segment(self):
+        """Start the next segment"""
+        self.segment += 1
+        path = segment_file_path(self.capture_id, self.segment)
+        self.writer = PcapWriter(path, self.linktype, self.snaplen)
+        self.segments.append({
+            'sequence': self.segment,
+            'file_path': path,
+            'start_time': None,
+            'end_time': None,
+            'packet_count': 0,
+            'byte_size': self.writer.offset
+        })
+
+    def _rotate(self):
+        """Close the current segment, open a new one and enforce the disk budget"""
+        self.writer.close()
+        self.closed_segments.append(dict(self.segments[-1]))
+        self._open_segment()
+
+        while len(self.segments) > 1 and sum(s['byte_size'] for s in self.segments) > self.disk_budget:
+            oldest = self.segments.pop(0)
+            try:
+                os.remove(oldest['file_path'])
+            except OSError as e:
+                logger.error(f"Error deleting pcap segment {oldest['file_path']}: {e}")
+            self.deleted_segments.append(oldest['sequence'])
+
+    def write(self, timestamp, data, original_length=None):
+        """Append one frame and return its offset within the current segment"""
+        with self.lock:
+            if self.writer is None:
+                return None
+            record_size = PCAP_RECORD_HEADER.size + min(len(data), self.writer.snaplen)
+            if self.writer.packets and self.writer.offset + record_size > self.segment_size:
+                self._rotate()
+
+            offset = self.writer.write(timestamp, data, original_length)
+            current = self.segments[-1]
+            if current['start_time'] is None:
+                current['start_time'] = timestamp
+            current['end_time'] = timestamp
+            current['packet_count'] += 1
+            current['byte_size'] = self.writer.offset
+        return offset
+
+    def flush(self):
+        """Flush the current segment to disk"""
+        with self.lock:
+            if self.writer:
+                self.writer.flush()
+
+    def close(self):
+        """Close the current segment"""
+        with self.lock:
+            if self.writer:
+                self.writer.close()
+                self.closed_segments.append(dict(self.segments[-1]))
+                self.writer = None
+
+    def take_changes(self):
+        """Return (current segment, closed segments, deleted sequences) since the last call"""
+        with self.lock:
+            current = dict(self.segments[-1]) if self.writer else None
+            closed, self.closed_segments = self.closed_segments, []
+            deleted, self.deleted_segments = self.deleted_segments, []
+        return current, closed, deleted
+
+def iter_records(path, start_timestamp=None, end_timestamp=None):
+    """Yield raw (record header + frame) bytes from a pcap file within a time range"""
+    with open(path, 'rb') as f:
+        order, _ = read_pcap_header(f)
+        record_header = struct.Struct(order + 'IIII')
+        while True:
+            header = f.read(record_header.size)
+            if len(header) < record_header.size:
+                return
+            seconds, microseconds, captured_length, _ = record_header.unpack(header)
+            data = f.read(captured_length)
+            if len(data) < captured_length:
+                return  # Segment still being written
+            timestamp = seconds + microseconds / 1000000
+            if start_timestamp is not None and timestamp < start_timestamp:
+                continue
+            if end_timestamp is not None and timestamp > end_timestamp:
+                return
+            yield header + data
+
+def pcap_global_header(order='<', linktype=LINKTYPE_ETHERNET, snaplen=None):
+    """Build a pcap global header in the given byte order"""
+    return struct.pack(
+        order + 'IHHiIII', PCAP_MAGIC, PCAP_VERSION[0], PCAP_VERSION[1], 0, 0,
+        snaplen or Config.MAX_PACKET_SIZE, linktype
+    )
+
+def stream_pcap(paths, start_timestamp=None, end_timestamp=None, chunk_size=1 << 20):
+    """Yield one merged pcap file built from several segment files, in chunks"""
+    header_written = False
+    chunk = []
+    chunk_bytes = 0
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        if not header_written:
+            with open(path, 'rb') as f:
+                order, linktype = read_pcap_header(f)
+            chunk.append(pcap_global_header(order, linktype))
+            header_written = True
+        for record in iter_records(path, start_timestamp, end_timestamp):
+            chunk.append(record)
+            chunk_bytes += len(record)
+            if chunk_bytes >= chunk_size:
+                yield b''.join(chunk)
+                chunk, chunk_bytes = [], 0
+
+    if not header_written:
+        # No data: still return a valid, empty pcap file
+        chunk.append(pcap_global_header())
+    if chunk:
+        yield b''.join(chunk)
@@ -6,7 +6,8 @@ import socket
 import struct
 import binascii
 from app import db
-from models import Packet, ProtocolDistribution
+from models import Packet
+from utils.metrics_store import get_metrics_store
 import datetime
 
 # Set up logging
@@ -132,6 +133,22 @@ def parse_ipv4_packet(data):
         'dst_ip': dst_ip
     }
 
+def parse_ipv6_packet(data):
+    """Parse IPv6 fixed header"""
+    first_word = struct.unpack('!I', data[0:4])[0]
+    payload_length = struct.unpack('!H', data[4:6])[0]
+    
+    return {
+        'version': first_word >> 28,
+        'traffic_class': (first_word >> 20) & 0xFF,
+        'flow_label': first_word & 0xFFFFF,
+        'payload_length': payload_length,
+        'next_header': data[6],
+        'hop_limit': data[7],
+        'src_ip': socket.inet_ntop(socket.AF_INET6, data[8:24]),
+        'dst_ip': socket.inet_ntop(socket.AF_INET6, data[24:40])
+    }
+
 def parse_tcp_segment(data):
     """Parse TCP segment header"""
     src_port = struct.unpack('!H', data[0:2])[0]
@@ -196,12 +213,115 @@ def parse_udp_segment(data):
         'checksum': checksum
     }
 
+def dissect_frame(data, linktype=1):
+    """Fully dissect a captured frame into per-layer header fields
+
+    Supports Ethernet (with 802.1Q tags), Linux cooked and raw IP link types.
+    """
+    details = {}
+    
+    # Link layer
+    if linktype == 1:  # Ethernet
+        ethernet = parse_ethernet_frame(data)
+        offset = 14
+        ethertype = ethernet['ethertype']
+        vlan_ids = []
+        while ethertype in (0x8100, 0x88A8) and len(data) >= offset + 4:
+            vlan_ids.append(struct.unpack('!H', data[offset:offset + 2])[0] & 0x0FFF)
+            ethertype = struct.unpack('!H', data[offset + 2:offset + 4])[0]
+            offset += 4
+        details['ethernet'] = {
+            'source_mac': ethernet['src_mac'],
+            'destination_mac': ethernet['dest_mac'],
+            'ethertype': f"0x{ethertype:04x}",
+            'vlan_ids': vlan_ids
+        }
+    elif linktype == 113:  # Linux cooked capture
+        ethertype = struct.unpack('!H', data[14:16])[0]
+        offset = 16
+    elif linktype == 101:  # Raw IP
+        ethertype = 0x0800 if data and data[0] >> 4 == 4 else 0x86DD
+        offset = 0
+    else:
+        return details
+    
+    # Network layer
+    payload = data[offset:]
+    if ethertype == 0x0800 and len(payload) >= 20:
+        ip = parse_ipv4_packet(payload)
+        details['ip'] = {
+            'version': ip['version'],
+            'header_length': ip['ihl'],
+            'dscp': ip['tos'] >> 2,
+            'ecn': ip['tos'] & 0x3,
+            'total_length': ip['total_length'],
+            'identification': ip['identification'],
+            'flags': ip['flags'],
+            'fragment_offset': ip['fragment_offset'],
+            'ttl': ip['ttl'],
+            'protocol': get_protocol_name(ip['protocol']),
+            'checksum': f"0x{ip['header_checksum']:04x}",
+            'source': ip['src_ip'],
+            'destination': ip['dst_ip']
+        }
+        transport_protocol = ip['protocol']
+        payload = payload[ip['ihl']:]
+    elif ethertype == 0x86DD and len(payload) >= 40:
+        ip = parse_ipv6_packet(payload)
+        details['ip'] = {
+            'version': ip['version'],
+            'header_length': 40,
+            'traffic_class': ip['traffic_class'],
+            'flow_label': ip['flow_label'],
+            'total_length': ip['payload_length'] + 40,
+            'ttl': ip['hop_limit'],
+            'protocol': get_protocol_name(ip['next_header']),
+            'source': ip['src_ip'],
+            'destination': ip['dst_ip']
+        }
+        transport_protocol = ip['next_header']
+        payload = payload[40:]
+    else:
+        return details
+    
+    # Transport layer
+    if transport_protocol == 6 and len(payload) >= 20:
+        tcp = parse_tcp_segment(payload)
+        details['tcp'] = {
+            'source_port': tcp['src_port'],
+            'destination_port': tcp['dst_port'],
+            'sequence_number': tcp['sequence'],
+            'acknowledgment_number': tcp['acknowledgement'],
+            'data_offset': tcp['offset'],
+            'flags': tcp['flag_str'],
+            'window_size': tcp['window'],
+            'checksum': f"0x{tcp['checksum']:04x}",
+            'urgent_pointer': tcp['urgent_pointer'],
+            'payload_length': max(len(payload) - tcp['offset'], 0)
+        }
+    elif transport_protocol == 17 and len(payload) >= 8:
+        udp = parse_udp_segment(payload)
+        details['udp'] = {
+            'source_port': udp['src_port'],
+            'destination_port': udp['dst_port'],
+            'length': udp['length'],
+            'checksum': f"0x{udp['checksum']:04x}"
+        }
+    elif transport_protocol in (1, 58) and len(payload) >= 4:
+        details['icmp'] = {
+            'type': payload[0],
+            'code': payload[1],
+            'checksum': f"0x{struct.unpack('!H', payload[2:4])[0]:04x}"
+        }
+    
+    return details
+
 def analyze_protocol_distribution(start_time=None, end_time=None):
     """Analyze protocol distribution in the captured packets"""
     query = db.session.query(
         Packet.protocol,
-        db.func.count().label('packet_count'),
-        db.func.sum(Packet.length).label('byte_count')
+        db.func.sum(Packet.sample_weight).label('packet_count'),
+        db.func.sum(Packet.length * Packet.sample_weight).label('byte_count')
     )
     
     if start_time:
@@ -215,24 +335,23 @@ def analyze_protocol_distribution(start_time=None, end_time=None):
     # Calculate total bytes for percentage
     total_bytes = sum(result.byte_count for result in results if result.byte_count is not None)
     
-    # Create distribution records
+    # Record the distribution in the metrics store
     timestamp = datetime.datetime.utcnow()
+    points = []
     
     for result in results:
         if result.protocol and result.byte_count:
             percentage = (result.byte_count / total_bytes) * 100 if total_bytes > 0 else 0
             
-            distribution = ProtocolDistribution(
-                timestamp=timestamp,
-                protocol=result.protocol,
-                packet_count=result.packet_count,
-                byte_count=result.byte_count,
-                percentage=percentage
-            )
-            
-            db.session.add(distribution)
+            points.append({
+                'timestamp': timestamp,
+                'protocol': result.protocol,
+                'packet_count': result.packet_count,
+                'byte_count': result.byte_count,
+                'percentage': percentage
+            })
     
-    db.session.commit()
+    get_metrics_store().write('protocol_distribution', points)
     
     return results
 
@@ -240,7 +359,7 @@ def analyze_tcp_flags(start_time=None, end_time=None):
     """Analyze TCP flags in the captured packets"""
     query = db.session.query(
         Packet.tcp_flags,
-        db.func.count().label('count')
+        db.func.sum(Packet.sample_weight).label('count')
     ).filter(
         Packet.protocol == 'TCP',
         Packet.tcp_flags != None
@@ -0,0 +1,139 @@
+"""
+API response encoding
+
+Bulk read endpoints return their tables in one of three formats, chosen
+by ?format= or the Accept header:
+
+- 'json' (application/json, the default): a list of row objects with ISO
+  timestamps, as the web UI expects
+- 'columnar' (application/vnd.nativeprobe.columnar+json): column names
+  once plus one array per column, timestamps as integer microseconds
+  since the Unix epoch
+- 'msgpack' (application/msgpack): the columnar layout as MessagePack,
+  offered when the msgpack package is installed
+
+FastJSONProvider renders every JSON response with orjson when it is
+installed, with output matching Flask's default provider.
+"""
+import datetime
+import json
+from flask import abort, current_app, jsonify, make_response, request
+from flask.json.provider import DefaultJSONProvider
+
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.nativeprobe.columnar+json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+optional_modules = {}  # Serializer modules, imported on first use (None if missing)
+
+def get_optional_module(name):
+    """Import an optional serializer once; None if it isn't installed"""
+    if name not in optional_modules:
+        try:
+            optional_modules[name] = __import__(name)
+        except ImportError:
+            optional_modules[name] = None
+    return optional_modules[name]
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that renders responses with orjson when available
+
+    Datetimes, Decimals and other types orjson would format differently are
+    passed to Flask's default handler and keys stay sorted, so the JSON is
+    the same as the default provider's compact output (except that
+    non-ASCII text is sent as UTF-8 rather than escaped).
+    """
+
+    def response(self, *args, **kwargs):
+        orjson = get_optional_module('orjson')
+        # Debug mode pretty-prints; leave that to the default provider
+        if orjson is None or (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_APPEND_NEWLINE
+        )
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def negotiate_format():
+    """Response format from ?format= or the Accept header; aborts with 406 if unavailable"""
+    available = ['json', 'columnar']
+    if get_optional_module('msgpack') is not None:
+        available.append('msgpack')
+
+    response_format = request.args.get('format')
+    if response_format is None:
+        mimetypes = [JSON_MIMETYPE, COLUMNAR_MIMETYPE]
+        if 'msgpack' in available:
+            mimetypes.extend(MSGPACK_MIMETYPES)
+        best = request.accept_mimetypes.best_match(mimetypes, default=JSON_MIMETYPE)
+        if best == COLUMNAR_MIMETYPE:
+            response_format = 'columnar'
+        elif best in MSGPACK_MIMETYPES:
+            response_format = 'msgpack'
+        else:
+            response_format = 'json'
+
+    if response_format not in available:
+        abort(make_response(jsonify({
+            'success': False,
+            'error': f"Unsupported response format: {response_format}",
+            'available': available
+        }), 406))
+    return response_format
+
+def epoch_microseconds(values):
+    """Datetimes to integer microseconds since the Unix epoch (None stays None)"""
+    return [None if value is None else (value - EPOCH) // ONE_MICROSECOND for value in values]
+
+def isoformat_column(values):
+    """Datetimes to ISO strings (None stays None)"""
+    return [None if value is None else value.isoformat() for value in values]
+
+def encode_table(columns, rows, response_format, time_columns=('timestamp',)):
+    """Encode rows (tuples in column order) as row objects or as columns
+
+    Returns a list of dicts for 'json', and for the columnar formats
+    {'columns': [...], 'data': [[...column values...], ...], 'time_unit': 'us'}.
+    """
+    rows = list(rows)
+    time_indexes = [i for i, name in enumerate(columns) if name in time_columns]
+
+    if response_format == 'json':
+        if time_indexes:
+            # Convert the timestamp columns once, then rebuild the rows around them
+            data = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+            for i in time_indexes:
+                data[i] = isoformat_column(data[i])
+            rows = zip(*data)
+        return [dict(zip(columns, row)) for row in rows]
+
+    data = [list(column) for column in zip(*rows)] if rows else [[] for _ in columns]
+    for i in time_indexes:
+        data[i] = epoch_microseconds(data[i])
+    return {'columns': list(columns), 'data': data, 'time_unit': 'us'}
+
+def send(payload, response_format):
+    """Response for a payload in the negotiated format"""
+    if response_format == 'msgpack':
+        msgpack = get_optional_module('msgpack')
+        response = current_app.response_class(msgpack.packb(payload), mimetype=MSGPACK_MIMETYPES[0])
+    elif response_format == 'columnar':
+        # Machine-read, so always compact, even in debug mode
+        orjson = get_optional_module('orjson')
+        if orjson is not None:
+            body = orjson.dumps(payload, default=current_app.json.default, option=orjson.OPT_NON_STR_KEYS)
+        else:
+            body = json.dumps(payload, default=current_app.json.default, separators=(',', ':'))
+        response = current_app.response_class(body, mimetype=COLUMNAR_MIMETYPE)
+    else:
+        response = jsonify(payload)
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,272 @@
+"""
+TCP handshake tracking for SYN flood and half-open connection detection
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# TCP flag bits (as carried in the TCP header)
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+TCP_URG = 0x20
+TCP_ECE = 0x40
+TCP_CWR = 0x80
+
+FLAG_BITS = {
+    'F': TCP_FIN,
+    'S': TCP_SYN,
+    'R': TCP_RST,
+    'P': TCP_PSH,
+    'A': TCP_ACK,
+    'U': TCP_URG,
+    'E': TCP_ECE,
+    'C': TCP_CWR
+}
+
+# Handshake states
+SYN_SENT = 1
+SYN_RECEIVED = 2
+
+def flags_to_mask(flags):
+    """Convert a flag string such as 'SA' to a TCP flag bitmask"""
+    mask = 0
+    for flag in flags or '':
+        mask |= FLAG_BITS.get(flag, 0)
+    return mask
+
+class Handshake:
+    """An in-progress (half-open) TCP handshake"""
+    __slots__ = ('server_ip', 'state', 'started')
+
+    def __init__(self, server_ip, started):
+        self.server_ip = server_ip
+        self.state = SYN_SENT
+        self.started = started
+
+class VictimStats:
+    """Handshake counters for one destination over a tumbling window"""
+    __slots__ = ('syns', 'completed', 'failed', 'half_open', 'window_start',
+                 'last_syns', 'last_completed', 'last_failed')
+
+    def __init__(self, window_start):
+        self.syns = 0
+        self.completed = 0
+        self.failed = 0
+        self.half_open = 0
+        self.window_start = window_start
+        self.last_syns = 0
+        self.last_completed = 0
+        self.last_failed = 0
+
+    def roll(self, now, window):
+        """Close the current window if it has elapsed"""
+        if now - self.window_start < window:
+            return
+        # A gap of more than one window means the previous window was empty
+        elapsed_windows = int((now - self.window_start) // window)
+        if elapsed_windows == 1:
+            self.last_syns, self.last_completed, self.last_failed = self.syns, self.completed, self.failed
+        else:
+            self.last_syns = self.last_completed = self.last_failed = 0
+        self.syns = self.completed = self.failed = 0
+        self.window_start += elapsed_windows * window
+
+    def completion_ratio(self):
+        """Completed handshakes over SYNs in the last full window (or the current one)"""
+        syns, completed = (self.last_syns, self.last_completed) if self.last_syns else (self.syns, self.completed)
+        return completed / syns if syns else 1.0
+
+class TCPConnectionTracker:
+    """Bounded-memory tracker of TCP handshakes keyed by connection 4-tuple
+
+    Only half-open connections are held in the table; once a handshake
+    completes or is reset the entry is dropped. Both the connection table and
+    the per-destination table evict least-recently-used entries when full.
+    """
+
+    def __init__(self, max_connections=None, max_destinations=None, handshake_timeout=None, window=None):
+        self.max_connections = max_connections or Config.TCP_TRACKER_MAX_CONNECTIONS
+        self.max_destinations = max_destinations or Config.TCP_TRACKER_MAX_DESTINATIONS
+        self.handshake_timeout = handshake_timeout or Config.TCP_HANDSHAKE_TIMEOUT
+        self.window = window or Config.SYN_FLOOD_WINDOW
+        self.connections = OrderedDict()
+        self.victims = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.last_expiry = time.monotonic()
+
+    def observe(self, src_ip, src_port, dst_ip, dst_port, flags):
+        """Feed one TCP segment (flags as a bitmask) into the tracker"""
+        now = time.monotonic()
+
+        with self.lock:
+            if flags & TCP_SYN and not flags & TCP_ACK:
+                key = (src_ip, src_port, dst_ip, dst_port)
+                if key in self.connections:
+                    # Retransmitted SYN
+                    self.connections.move_to_end(key)
+                    return
+                victim = self._victim(dst_ip, now)
+                victim.syns += 1
+                victim.half_open += 1
+                self.connections[key] = Handshake(dst_ip, now)
+                if len(self.connections) > self.max_connections:
+                    _, evicted = self.connections.popitem(last=False)
+                    self._fail(evicted, now)
+                    self.evictions += 1
+
+            elif flags & TCP_SYN and flags & TCP_ACK:
+                # SYN-ACK travels server -> client
+                entry = self.connections.get((dst_ip, dst_port, src_ip, src_port))
+                if entry:
+                    entry.state = SYN_RECEIVED
+
+            elif flags & TCP_RST:
+                key = (src_ip, src_port, dst_ip, dst_port)
+                entry = self.connections.pop(key, None) or self.connections.pop(
+                    (dst_ip, dst_port, src_ip, src_port), None)
+                if entry:
+                    self._fail(entry, now)
+
+            elif flags & TCP_ACK:
+                entry = self.connections.pop((src_ip, src_port, dst_ip, dst_port), None)
+                if entry:
+                    victim = self._victim(entry.server_ip, now)
+                    victim.completed += 1
+                    victim.half_open = max(victim.half_open - 1, 0)
+
+            if now - self.last_expiry >= 1.0:
+                self._expire(now)
+
+    def _victim(self, ip, now):
+        """Get (or create) the stats for a destination, marking it recently used"""
+        victim = self.victims.get(ip)
+        if victim is None:
+            victim = VictimStats(now)
+            self.victims[ip] = victim
+            if len(self.victims) > self.max_destinations:
+                self.victims.popitem(last=False)
+        else:
+            self.victims.move_to_end(ip)
+            victim.roll(now, self.window)
+        return victim
+
+    def _fail(self, entry, now):
+        """Account for a handshake that was reset, timed out or evicted"""
+        victim = self.victims.get(entry.server_ip)
+        if victim:
+            victim.roll(now, self.window)
+            victim.failed += 1
+            victim.half_open = max(victim.half_open - 1, 0)
+
+    def _expire(self, now):
+        """Fail handshakes that have been half-open longer than the timeout"""
+        self.last_expiry = now
+        cutoff = now - self.handshake_timeout
+        while self.connections:
+            key, entry = next(iter(self.connections.items()))
+            if entry.started >= cutoff:
+                break
+            del self.connections[key]
+            self._fail(entry, now)
+
+    def get_victims(self, min_syns=1):
+        """Snapshot per-destination handshake statistics"""
+        now = time.monotonic()
+        with self.lock:
+            self._expire(now)
+            victims = []
+            for ip, victim in self.victims.items():
+                victim.roll(now, self.window)
+                syns = max(victim.syns, victim.last_syns)
+                if syns < min_syns and victim.half_open == 0:
+                    continue
+                victims.append({
+                    'destination_ip': ip,
+                    'half_open': victim.half_open,
+                    'syns': victim.syns,
+                    'completed': victim.completed,
+                    'failed': victim.failed,
+                    'last_window_syns': victim.last_syns,
+                    'last_window_completed': victim.last_completed,
+                    'completion_ratio': round(victim.completion_ratio(), 4)
+                })
+        return victims
+
+    def find_syn_floods(self):
+        """Destinations whose handshake behaviour looks like a SYN flood"""
+        return find_syn_floods(self.get_victims(min_syns=Config.SYN_FLOOD_MIN_SYNS))
+
+    def snapshot(self, limit=None):
+        """Destination and table statistics, the busiest `limit` destinations first"""
+        victims = self.get_victims()
+        victims.sort(key=lambda v: (v['half_open'], max(v['syns'], v['last_window_syns'])), reverse=True)
+        return {'destinations': victims[:limit], 'tracker': self.get_statistics()}
+
+    def get_statistics(self):
+        """Table occupancy statistics"""
+        with self.lock:
+            return {
+                'tracked_handshakes': len(self.connections),
+                'tracked_destinations': len(self.victims),
+                'max_connections': self.max_connections,
+                'max_destinations': self.max_destinations,
+                'evictions': self.evictions
+            }
+
+def find_syn_floods(victims):
+    """The destinations in get_victims() output whose handshakes look like a SYN flood"""
+    floods = []
+    for victim in victims:
+        syns = max(victim['syns'], victim['last_window_syns'])
+        if victim['half_open'] >= Config.SYN_FLOOD_HALF_OPEN_THRESHOLD or (
+                syns >= Config.SYN_FLOOD_MIN_SYNS and
+                victim['completion_ratio'] < Config.SYN_FLOOD_MIN_COMPLETION_RATIO):
+            floods.append(victim)
+    return floods
+
+def merge_snapshots(snapshots, min_syns=1):
+    """Combine tracker snapshots (see snapshot()) from several capture processes
+
+    Counters of a destination seen by more than one tracker are summed and
+    its completion ratio recomputed from the sums.
+    """
+    merged = {}
+    tracker = {'tracked_handshakes': 0, 'tracked_destinations': 0, 'max_connections': 0,
+               'max_destinations': 0, 'evictions': 0, 'trackers': 0}
+    for snapshot in snapshots:
+        tracker['trackers'] += 1
+        for key, value in snapshot['tracker'].items():
+            tracker[key] = tracker.get(key, 0) + value
+        for victim in snapshot['destinations']:
+            total = merged.get(victim['destination_ip'])
+            if total is None:
+                merged[victim['destination_ip']] = dict(victim)
+                continue
+            for key in ('half_open', 'syns', 'completed', 'failed', 'last_window_syns', 'last_window_completed'):
+                total[key] += victim[key]
+    
+    victims = []
+    for victim in merged.values():
+        if max(victim['syns'], victim['last_window_syns']) < min_syns and victim['half_open'] == 0:
+            continue
+        if victim['last_window_syns']:
+            syns, completed = victim['last_window_syns'], victim['last_window_completed']
+        else:
+            syns, completed = victim['syns'], victim['completed']
+        victim['completion_ratio'] = round(completed / syns if syns else 1.0, 4)
+        victims.append(victim)
+    victims.sort(key=lambda v: v['half_open'], reverse=True)
+    return {'destinations': victims, 'tracker': tracker}
+
+# Shared tracker fed by the capture pipeline
+tcp_tracker = TCPConnectionTracker()
@@ -0,0 +1,77 @@
+"""
+Production web serving for NativeProbe
+
+Runs the Flask app under gunicorn with pre-forked worker processes, each
+serving requests from a thread pool (the gthread worker class). The
+database schema is created once in the master before forking, and each
+worker starts with an empty connection pool.
+"""
+import logging
+from config import Config
+
+# Set up logging
+logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+def post_fork(server, worker):
+    """Drop pooled connections inherited from the master"""
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def post_worker_init(worker):
+    """Start per-process maintenance when this server also runs the agent"""
+    if Config.AGENT_MODE == 'embedded':
+        from utils.agent_service import start_maintenance
+        start_maintenance()
+
+def serve(application, host='0.0.0.0', port=5000, workers=None, threads=None):
+    """Serve the app with gunicorn until it is stopped"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.error("gunicorn is not installed; run 'pip install gunicorn' or start without 'serve'")
+        return 1
+
+    workers = workers or Config.SERVER_WORKERS
+    threads = threads or Config.SERVER_THREADS
+
+    # Embedded captures and detectors live in the serving process, so they can't be split across
+    # workers, and recycling the worker after max_requests would silently stop them
+    max_requests = Config.SERVER_MAX_REQUESTS
+    if Config.AGENT_MODE == 'embedded':
+        if workers > 1:
+            logger.warning(f"Agent mode is 'embedded'; using 1 worker instead of {workers}. "
+                           f"Run agent.py and set NATIVEPROBE_AGENT=remote to scale out")
+            workers = 1
+        max_requests = 0
+
+    if application.config.get('DEBUG'):
+        logger.warning("Serving with a debug configuration; set FLASK_ENV=production")
+
+    options = {
+        'bind': f"{host}:{port}",
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'timeout': Config.SERVER_TIMEOUT,
+        'keepalive': Config.SERVER_KEEPALIVE,
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests // 10,
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init
+    }
+
+    class WebServer(BaseApplication):
+        """gunicorn application serving an already-imported Flask app"""
+
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    logger.info(f"Serving on {host}:{port} with {workers} worker(s) x {threads} thread(s)")
+    WebServer().run()
+    return 0